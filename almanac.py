@@ -0,0 +1,248 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Precomputed table of lunar phases, equinoxes and solstices
+
+Events from FIRST_YEAR to LAST_YEAR are solved by ephem once and stored in
+packed file of float64 ephem dates. Lunar phases and seasons are cyclic, so
+only date of each event and kind of the first one are stored. Lookups are
+binary searches in the arrays. If the table file cannot be written (e.g.
+read-only installation), solved events are kept in memory only.
+
+File layout (little endian):
+    header   magic, version, first year, last year, first lunar phase, lunar count, season count
+    dates    float64 dates of lunar phases, float64 dates of seasons
+
+    python -m skybber.almanac [--build] [--year YEAR]
+"""
+
+import array
+import bisect
+import logging
+import os
+import struct
+import sys
+import threading
+
+from .utils import lazyImport
+
+ephem = lazyImport('ephem')
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'almanac.dat')
+
+MAGIC = b'SKAL'
+VERSION = 1
+HEADER_FORMAT = '<4sIHHBII'
+FIRST_YEAR = 1950
+LAST_YEAR = 2100
+
+NEW_MOON, FIRST_QUARTER, FULL_MOON, LAST_QUARTER = range(4)
+MARCH_EQUINOX, JUNE_SOLSTICE, SEPTEMBER_EQUINOX, DECEMBER_SOLSTICE = range(4)
+
+PHASE_NAMES = ('New Moon', 'First Quarter', 'Full Moon', 'Last Quarter')
+SEASON_NAMES = ('March equinox', 'June solstice', 'September equinox', 'December solstice')
+
+_HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+_PHASE_SOLVERS = ('next_new_moon', 'next_first_quarter_moon', 'next_full_moon', 'next_last_quarter_moon')
+_SEASON_SOLVERS = ('next_vernal_equinox', 'next_summer_solstice', 'next_autumnal_equinox', 'next_winter_solstice')
+
+
+def _solveCycle(solvers, first, start, end):
+    """ Return array of dates of cyclic events from start to end, the first event is of kind first
+    """
+    dates = array.array('d')
+    kind = first
+    date = getattr(ephem, solvers[kind])(start)
+    while date < end:
+        dates.append(date)
+        kind = (kind + 1) % len(solvers)
+        date = getattr(ephem, solvers[kind])(date)
+    return dates
+
+
+def solveTable(first_year=FIRST_YEAR, last_year=LAST_YEAR):
+    """ Return (first lunar phase, dates of lunar phases, dates of seasons) of years
+    """
+    start, end = ephem.Date('%d/1/1' % first_year), ephem.Date('%d/1/1' % (last_year + 1))
+    first_phase = min(range(len(_PHASE_SOLVERS)), key=lambda kind: getattr(ephem, _PHASE_SOLVERS[kind])(start))
+    phases = _solveCycle(_PHASE_SOLVERS, first_phase, start, end)
+    seasons = _solveCycle(_SEASON_SOLVERS, MARCH_EQUINOX, start, end)
+    return first_phase, phases, seasons
+
+
+def buildTable(path, first_year=FIRST_YEAR, last_year=LAST_YEAR):
+    """ Solve events of years and write table file, return number of events
+    """
+    first_phase, phases, seasons = solveTable(first_year, last_year)
+    _writeTable(path, first_year, last_year, first_phase, phases, seasons)
+    return len(phases) + len(seasons)
+
+
+def _writeTable(path, first_year, last_year, first_phase, phases, seasons):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, first_year, last_year, first_phase, len(phases), len(seasons)))
+        for dates in (phases, seasons):
+            if sys.byteorder != 'little':
+                dates = array.array('d', dates)
+                dates.byteswap()
+            f.write(dates.tobytes())
+    os.replace(tmp_path, path)
+
+
+class Event(object):
+    """ Lunar phase or season
+    """
+
+    def __init__(self, kind, name, date):
+        self._kind = kind
+        self._name = name
+        self._date = date
+
+    def getKind(self):
+        return self._kind
+
+    def getName(self):
+        return self._name
+
+    def getDate(self):
+        """ Return ephem date (UTC) of event
+        """
+        return self._date
+
+
+class Almanac(object):
+    """ Lookup of lunar phases and seasons in precomputed table.
+
+    Table is loaded (and built if it is missing) on first lookup or by warmup
+    thread of the bot.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self._path = path
+        self._lock = threading.Lock()
+        self._phases = None
+        self._seasons = None
+        self._first_phase = 0
+        self._first_year = FIRST_YEAR
+        self._last_year = LAST_YEAR
+
+    def _read(self):
+        if not os.path.exists(self._path):
+            return False
+        with open(self._path, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER_SIZE:
+            return False
+        magic, version, first_year, last_year, first_phase, phase_count, season_count = \
+            struct.unpack_from(HEADER_FORMAT, data, 0)
+        if (magic, version) != (MAGIC, VERSION) or len(data) != _HEADER_SIZE + 8 * (phase_count + season_count):
+            return False
+        phases, seasons = array.array('d'), array.array('d')
+        phases.frombytes(data[_HEADER_SIZE:_HEADER_SIZE + 8 * phase_count])
+        seasons.frombytes(data[_HEADER_SIZE + 8 * phase_count:])
+        if sys.byteorder != 'little':
+            phases.byteswap()
+            seasons.byteswap()
+        self._first_year, self._last_year, self._first_phase = first_year, last_year, first_phase
+        self._seasons = seasons
+        self._phases = phases
+        return True
+
+    def open(self):
+        """ Load table, build it first if it is missing or invalid
+        """
+        if self._phases is not None:
+            return
+        with self._lock:
+            if self._phases is not None:
+                return
+            if self._read():
+                return
+            first_phase, phases, seasons = solveTable(self._first_year, self._last_year)
+            try:
+                _writeTable(self._path, self._first_year, self._last_year, first_phase, phases, seasons)
+            except (IOError, OSError) as e:
+                logging.warning('Almanac table kept in memory, it cannot be written: %s', e)
+            self._first_phase, self._seasons, self._phases = first_phase, seasons, phases
+
+    def getYearRange(self):
+        """ Return (first year, last year) of table
+        """
+        self.open()
+        return self._first_year, self._last_year
+
+    def isInRange(self, date):
+        """ Return True if events after ephem date are in table
+        """
+        self.open()
+        return len(self._phases) > 0 and self._phases[0] <= date < self._phases[-1]
+
+    def nextPhases(self, date, count=4):
+        """ Return list of at most count lunar phases after ephem date
+        """
+        self.open()
+        i = bisect.bisect_right(self._phases, date)
+        return [Event((self._first_phase + j) % 4, PHASE_NAMES[(self._first_phase + j) % 4], ephem.Date(self._phases[j]))
+                for j in range(i, min(i + count, len(self._phases)))]
+
+    def iterPhases(self, start, end):
+        """ Yield lunar phases from ephem date start to end
+        """
+        self.open()
+        for j in range(bisect.bisect_left(self._phases, start), bisect.bisect_left(self._phases, end)):
+            phase = (self._first_phase + j) % 4
+            yield Event(phase, PHASE_NAMES[phase], ephem.Date(self._phases[j]))
+
+    def seasons(self, year):
+        """ Return list of equinoxes and solstices of year, empty if year is out of table
+        """
+        self.open()
+        i = bisect.bisect_left(self._seasons, ephem.Date('%d/1/1' % year))
+        j = bisect.bisect_left(self._seasons, ephem.Date('%d/1/1' % (year + 1)))
+        # first season of table is March equinox
+        return [Event(k % 4, SEASON_NAMES[k % 4], ephem.Date(self._seasons[k])) for k in range(i, j)]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build and query skybber almanac table')
+    parser.add_argument('--path', default=DEFAULT_PATH, help='table file')
+    parser.add_argument('--build', action='store_true', help='rebuild table')
+    parser.add_argument('--year', type=int, help='show seasons and lunar phases of year')
+    args = parser.parse_args(argv)
+
+    if args.build:
+        print('Events: %d' % buildTable(args.path))
+    almanac = Almanac(args.path)
+    print('Years: %d - %d' % almanac.getYearRange())
+    if args.year is not None:
+        for event in almanac.seasons(args.year):
+            print('%s  %s' % (event.getDate(), event.getName()))
+        date = ephem.Date('%d/1/1' % args.year)
+        for event in almanac.nextPhases(date, 60):
+            if event.getDate() >= ephem.Date('%d/1/1' % (args.year + 1)):
+                break
+            print('%s  %s' % (event.getDate(), event.getName()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
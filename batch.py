@@ -0,0 +1,206 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Offline batch runs of bot commands
+
+Input is one command per line, 'text' or 'jid<TAB>text' (commands of the
+jid use its saved locations), or with --csv rows of sites and dates:
+
+    place,date              lng,lat,date
+    prague,2024-03-01       14.42,50.09,2024-03-01
+
+each row expanding to commands of --commands. Commands are executed by
+SkybberBot handlers like chat messages, without xmpp connection. With more
+jobs they are run in chunks by forked worker processes sharing data loaded
+by the parent; results are written in input order as soon as they are ready.
+
+    python -m skybber.batch commands.txt
+    python -m skybber.batch --csv sites.csv --commands night,tw,moon --format jsonl
+"""
+
+import collections
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+
+DEFAULT_JID = 'batch@localhost'
+DEFAULT_COMMANDS = ('night', 'tw', 'moon')
+CHUNK_LINES = 32
+TEXT = 'text'
+JSONL = 'jsonl'
+
+
+class BatchMessage(object):
+    """ Message of command read from batch input, handlers use only its sender
+    """
+    def __init__(self, jid, body):
+        self._jid = jid
+        self._body = body
+
+    def getFrom(self):
+        return self
+
+    def getStripped(self):
+        return self._jid
+
+    def getBody(self):
+        return self._body
+
+    def getType(self):
+        return 'chat'
+
+
+def readCommands(stream, jid=DEFAULT_JID):
+    """ Yield (jid, text) of command lines, empty lines and # comments are skipped
+    """
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if '\t' in line:
+            line_jid, line = line.split('\t', 1)
+            yield line_jid.strip(), line.strip()
+        else:
+            yield jid, line
+
+
+def readSites(stream, commands=DEFAULT_COMMANDS, jid=DEFAULT_JID):
+    """ Yield (jid, text) of commands of CSV rows with columns place or lng and lat,
+        optional date and jid
+    """
+    reader = csv.DictReader(stream)
+    for row in reader:
+        row = dict((key.strip().lower(), (value or '').strip()) for key, value in row.items() if key is not None)
+        if row.get('place'):
+            site = row['place']
+        elif row.get('lng') and row.get('lat'):
+            site = row['lng'] + ' ' + row['lat']
+        else:
+            raise ValueError('Line %d: place or lng and lat expected.' % reader.line_num)
+        for cmd in commands:
+            yield row.get('jid') or jid, ' '.join(arg for arg in (cmd, row.get('date'), site) if arg)
+
+
+def runCommand(bot, jid, text):
+    """ Return reply text of command, only commands which do not change data are allowed
+    """
+    cmd, _, args = text.partition(' ')
+    cmd = cmd.lower()
+    if cmd not in bot.REQUEST_COMMANDS:
+        return 'Unknown command: ' + cmd
+    try:
+        return str(bot.execute_command(BatchMessage(jid, text), cmd, args))
+    except Exception as e:
+        logging.exception('Command failed: %s', text)
+        return 'Error: %s' % e
+
+
+# bot of batch run, forked workers inherit it
+_bot = None
+
+
+def _runChunk(chunk):
+    results = [(jid, text, runCommand(_bot, jid, text)) for jid, text in chunk]
+    # workers are terminated at the end, ephemerides of chunk are written now
+    _bot.flushEphemeris(force=True)
+    return results
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def runBatch(bot, items, jobs=1, chunk_lines=CHUNK_LINES):
+    """ Yield (jid, text, reply) of commands (jid, text) in input order. With more jobs
+        chunks of commands are run by forked worker processes, at most two chunks
+        per worker are pending, so input is read as results are written
+    """
+    global _bot
+    if jobs <= 1:
+        for jid, text in items:
+            yield jid, text, runCommand(bot, jid, text)
+        return
+    bot.preload()
+    _bot = bot
+    pending = collections.deque()
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+        for chunk in _chunks(items, chunk_lines):
+            pending.append(pool.apply_async(_runChunk, (chunk, )))
+            if len(pending) >= 2 * jobs:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+
+
+def formatResult(jid, text, reply, fmt=TEXT):
+    if fmt == JSONL:
+        return json.dumps({'jid': jid, 'command': text, 'reply': reply}, ensure_ascii=False) + '\n'
+    return '> ' + text + '\n' + reply.strip('\n') + '\n\n'
+
+
+def main(argv=None):
+    import argparse
+    from .skybberbot import SkybberBot, MasterDBConnection
+
+    parser = argparse.ArgumentParser(description='Run skybber commands of file without xmpp connection')
+    parser.add_argument('file', nargs='?', default='-', help="file of commands or sites, '-' for stdin")
+    parser.add_argument('--csv', action='store_true', help='file is CSV of sites (place or lng,lat) and dates')
+    parser.add_argument('--commands', default=','.join(DEFAULT_COMMANDS), help='commands run for each CSV row')
+    parser.add_argument('--jid', default=DEFAULT_JID, help='requester of commands, its saved locations can be used')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--chunk', type=int, default=CHUNK_LINES, help='commands sent to worker at once')
+    parser.add_argument('--format', choices=(TEXT, JSONL), default=TEXT, help='output format')
+    parser.add_argument('--db', default=MasterDBConnection.SKYBBER_DB, help='skybber database')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    MasterDBConnection.SKYBBER_DB = args.db
+    bot = SkybberBot('skybber@localhost', '')
+    stream = sys.stdin if args.file == '-' else open(args.file, newline='')
+    try:
+        with stream:
+            if args.csv:
+                items = readSites(stream, [cmd.strip().lower() for cmd in args.commands.split(',') if cmd.strip()], args.jid)
+            else:
+                items = readCommands(stream, args.jid)
+            try:
+                for jid, text, reply in runBatch(bot, items, args.jobs, args.chunk):
+                    sys.stdout.write(formatResult(jid, text, reply, args.format))
+            except ValueError as e:
+                sys.stderr.write('%s\n' % e)
+                return 1
+    finally:
+        # ephemerides computed by single process run
+        bot.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,944 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Message-replay benchmark of SkybberBot
+
+Drives SkybberBot.callback_message with synthetic xmpp messages. Replies are
+captured by a fake connection, users live in a temporary skybber.db and the
+satellite service is replaced by a local stub HTTP server, so the benchmark
+runs offline.
+
+    python -m skybber.benchmark --users 100 --messages 2000
+    python -m skybber.benchmark --workload recorded.txt
+    python -m skybber.benchmark --startup
+    python -m skybber.benchmark --roster 10000
+    python -m skybber.benchmark --import 100000
+    python -m skybber.benchmark --gazetteer 100000
+    python -m skybber.benchmark --render 1000
+    python -m skybber.benchmark --muc 100000
+    python -m skybber.benchmark --catalog 10000
+    python -m skybber.benchmark --satscan 10000
+    python -m skybber.benchmark --flares 10000
+    python -m skybber.benchmark --http 20000
+"""
+
+import datetime
+import http.client
+import http.server
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import ephem
+import xmpp
+
+from .bulkdata import importLocations, exportLocations
+from .catalog import Catalog, KINDS, buildIndex as buildCatalogIndex
+from . import flares
+from .gazetteer import Gazetteer, buildIndex
+from .httpapi import HttpApi
+from .migrations import upgrade, explainQueries
+from .render import Reply, Rows
+from .satscan import SatelliteCatalog
+from .satellitepass import SatellitePasses
+from .skybberbot import SkybberBot, MasterDBConnection
+from .site import Site
+from .stats import commandStats, RoomStats
+
+BOT_JID = 'skybber@localhost'
+USER_DOMAIN = 'localhost'
+USER_RESOURCE = 'bench'
+
+# (command, weight)
+DEFAULT_MIX = (
+    ('night', 4),
+    ('tw', 3),
+    ('moon', 3),
+    ('lsloc', 1),
+    ('addloc', 1),
+    ('iss', 1),
+    ('whatsup', 1),
+)
+
+REPLY_TIMEOUT = 10.0
+
+
+class FakeRoster(object):
+    """ Roster of the fake connection, every contact has mutual subscription
+    """
+    def __init__(self, items=()):
+        self._items = list(items)
+
+    def getItems(self):
+        return self._items
+
+    def getSubscription(self, jid):
+        return 'both'
+
+    def getResources(self, jid):
+        return [USER_RESOURCE]
+
+    def Authorize(self, jid):
+        pass
+
+    def Subscribe(self, jid):
+        pass
+
+    def Unauthorize(self, jid):
+        pass
+
+
+class FakeConnection(object):
+    """ Connection capturing stanzas sent by bot instead of sending them to server
+    """
+    def __init__(self, roster=None):
+        self.Roster = self
+        self._roster = roster or FakeRoster()
+        self._cond = threading.Condition()
+        self._replies = []
+
+    def getRoster(self):
+        return self._roster
+
+    def RegisterHandler(self, name, handler):
+        pass
+
+    def send(self, stanza):
+        with self._cond:
+            self._replies.append((time.perf_counter(), stanza))
+            self._cond.notify_all()
+
+    def sendInitPresence(self):
+        pass
+
+    def Process(self, timeout):
+        pass
+
+    def getReplyCount(self):
+        return len(self._replies)
+
+    def getReplies(self):
+        return self._replies
+
+    def waitReply(self, count, timeout=REPLY_TIMEOUT):
+        """ Wait until connection has captured more than count stanzas, return time of the last one
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._replies) > count, timeout):
+                return None
+            return self._replies[-1][0]
+
+
+class QueryCounter(object):
+    """ SQL trace callback counting executed statements
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
+
+
+class StubSatelliteHandler(http.server.BaseHTTPRequestHandler):
+    """ Stub of satellite service returning fixed xml passes
+    """
+    def do_GET(self):
+        if self.path.split('?', 1)[0].endswith('/passes'):
+            body = passesXml(datetime.datetime.utcnow())
+        else:
+            body = '<satellite><id>25544</id><name>ISS (ZARYA)</name></satellite>'
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSatelliteService(object):
+    """ Local satellite service running in a background thread
+    """
+    def __init__(self):
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubSatelliteHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def getUrl(self):
+        return 'http://127.0.0.1:%d/satellites/' % self._server.server_address[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def passesXml(now, count=5):
+    """ Return xml document with count satellite passes starting after now
+    """
+    def fmt(dt):
+        return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def coord(tag, dt, alt, az):
+        return '<%s><time>%s</time><alt>%d</alt><az>%d</az></%s>' % (tag, fmt(dt), alt, az, tag)
+
+    parts = ['<passes><location><lat>50.761</lat><lng>15.057</lng></location><altitude>400</altitude>',
+             '<from>%s</from><to>%s</to>' % (fmt(now), fmt(now + datetime.timedelta(days=10)))]
+    for i in range(count):
+        start = now + datetime.timedelta(hours=3 + 25 * i)
+        parts.append('<pass><magnitude>%0.1f</magnitude>' % (-2.5 + 0.5 * i))
+        parts.append(coord('start', start, 10, 250))
+        parts.append(coord('max', start + datetime.timedelta(minutes=3), 60, 180))
+        parts.append(coord('end', start + datetime.timedelta(minutes=6), 10, 110))
+        parts.append('</pass>')
+    parts.append('</passes>')
+    return ''.join(parts)
+
+
+def userJid(i):
+    return 'user%d@%s' % (i, USER_DOMAIN)
+
+
+def seedDatabase(path, users, locations_per_user=10):
+    """ Create skybber.db at path with users x locations_per_user locations
+    """
+    conn = sqlite3.connect(path)
+    upgrade(conn)
+    c = conn.cursor()
+    c.executemany('INSERT INTO users(user_id, jid, descr) VALUES (?, ?, ?)',
+                  ((i + 1, userJid(i), 'description') for i in range(users)))
+    locations = [(i + 1, 'loc%d' % j, 14.0 + 0.1 * j, 49.0 + 0.1 * (i % 20))
+                 for i in range(users) for j in range(locations_per_user)]
+    sites = Site.getOrCreateIds(c, (Site.cellOf(lng, lat) for user_id, name, lng, lat in locations))
+    c.executemany('INSERT INTO locations(user_id, name, long, lat, site_id) VALUES (?, ?, ?, ?, ?)',
+                  ((user_id, name, lng, lat, sites[Site.cellOf(lng, lat)]) for user_id, name, lng, lat in locations))
+    c.execute('UPDATE users SET default_location_id = (SELECT MIN(location_id) FROM locations WHERE locations.user_id = users.user_id)')
+    conn.commit()
+    conn.close()
+
+
+def _commandArgs(cmd, rnd, seq):
+    """ Return random arguments of cmd
+    """
+    if cmd in ('night', 'tw', 'moon'):
+        return rnd.choice(('', 'loc%d' % rnd.randrange(10), '14.86524 50.78461',
+                           (datetime.date.today() + datetime.timedelta(rnd.randrange(30))).strftime('%Y-%m-%d')))
+    if cmd == 'whatsup':
+        return rnd.choice(('', 'loc%d' % rnd.randrange(10), '14.86524 50.78461'))
+    if cmd == 'addloc':
+        return 'new%d %0.5f %0.5f' % (seq, rnd.uniform(-180.0, 180.0), rnd.uniform(-60.0, 60.0))
+    return ''
+
+
+def generateWorkload(users, count, mix=DEFAULT_MIX, seed=None):
+    """ Return list of (jid, text) messages with commands drawn from weighted mix
+    """
+    rnd = random.Random(seed)
+    commands = [cmd for cmd, _ in mix]
+    weights = [weight for _, weight in mix]
+    workload = []
+    for seq in range(count):
+        cmd = rnd.choices(commands, weights)[0]
+        args = _commandArgs(cmd, rnd, seq)
+        workload.append((userJid(rnd.randrange(users)), (cmd + ' ' + args).strip()))
+    return workload
+
+
+def loadWorkload(path, users):
+    """ Read recorded workload. Each line is either 'jid<TAB>text' or just text,
+    text only lines are assigned to users round robin.
+    """
+    workload = []
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            if '\t' in line:
+                jid, text = line.split('\t', 1)
+            else:
+                jid, text = userJid(len(workload) % users), line
+            workload.append((jid, text))
+    return workload
+
+
+def percentile(sorted_values, pct):
+    """ Nearest-rank percentile of sorted values
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def createBot(conn):
+    """ Create SkybberBot connected to fake connection conn
+    """
+    bot = SkybberBot(BOT_JID, '')
+    bot.conn = conn
+    bot.roster = conn.getRoster()
+    return bot
+
+
+def replay(bot, conn, workload, query_counter=None):
+    """ Send workload messages one by one and wait for replies.
+
+    Return (elapsed seconds, {command: [latencies]}, number of timeouts, {command: [sql statements]})
+    """
+    latencies = {}
+    queries = {}
+    timeouts = 0
+    seen = set()
+    started = time.perf_counter()
+    for jid, text in workload:
+        frm = jid + '/' + USER_RESOURCE
+        if frm not in seen:
+            bot.callback_presence(conn, xmpp.Presence(frm=frm))
+            seen.add(frm)
+        mess = xmpp.Message(to=BOT_JID, frm=frm, typ='chat', body=text)
+        count = conn.getReplyCount()
+        query_count = query_counter.count if query_counter is not None else 0
+        t0 = time.perf_counter()
+        bot.callback_message(conn, mess)
+        t1 = conn.waitReply(count)
+        if t1 is None:
+            timeouts += 1
+            continue
+        cmd = text.split(' ', 1)[0].lower()
+        latencies.setdefault(cmd, []).append(t1 - t0)
+        if query_counter is not None:
+            queries.setdefault(cmd, []).append(query_counter.count - query_count)
+    return time.perf_counter() - started, latencies, timeouts, queries
+
+
+def formatReport(elapsed, latencies, timeouts, queries):
+    lines = ['%-10s %8s %10s %10s %10s %10s %10s' % ('command', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'sql/msg')]
+    total = 0
+    for cmd in sorted(latencies):
+        values = sorted(latencies[cmd])
+        total += len(values)
+        cmd_queries = queries.get(cmd)
+        lines.append('%-10s %8d %10.3f %10.3f %10.3f %10.3f %10.2f' % (cmd, len(values),
+                     1000.0 * sum(values) / len(values),
+                     1000.0 * percentile(values, 50), 1000.0 * percentile(values, 95),
+                     1000.0 * percentile(values, 99),
+                     float(sum(cmd_queries)) / len(cmd_queries) if cmd_queries else 0.0))
+    lines.append('')
+    lines.append('messages: %d  timeouts: %d  elapsed: %0.3f s  throughput: %0.1f msg/s' %
+                 (total, timeouts, elapsed, total / elapsed if elapsed > 0 else 0.0))
+    return '\n'.join(lines)
+
+
+def runReplay(users, workload, profile_threshold=None):
+    """ Seed temporary database, start stub services and replay workload
+    """
+    tmpdir = tempfile.mkdtemp(prefix='skybber-bench-')
+    saved_db, saved_url = MasterDBConnection.SKYBBER_DB, SkybberBot.SATELLITE_SERVICE_URL
+    try:
+        MasterDBConnection.SKYBBER_DB = os.path.join(tmpdir, 'skybber.db')
+        seedDatabase(MasterDBConnection.SKYBBER_DB, users)
+        with StubSatelliteService() as service:
+            SkybberBot.SATELLITE_SERVICE_URL = service.getUrl()
+            conn = FakeConnection()
+            bot = createBot(conn)
+            if profile_threshold is not None:
+                bot.enable_profiling(threshold=profile_threshold, interval=0.001)
+            MasterDBConnection.TRACE_CALLBACK = QueryCounter()
+            try:
+                return replay(bot, conn, workload, MasterDBConnection.TRACE_CALLBACK)
+            finally:
+                if bot.profiler is not None:
+                    sys.stderr.write(bot.profiler.format_collapsed())
+                    bot.disable_profiling()
+    finally:
+        MasterDBConnection.SKYBBER_DB, SkybberBot.SATELLITE_SERVICE_URL = saved_db, saved_url
+        MasterDBConnection.TRACE_CALLBACK = None
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+_CHATTER = ('hi all', 'clear skies tonight?', 'anyone seen the comet', 'the Moon is too bright', 'lol',
+            'my scope is cooling down', 'good night', 'twilight is early this week', 'nice picture of M31!')
+
+
+def measureMuc(messages, rooms=10, nicks=20, command_pct=1.0):
+    """ Measure throughput of groupchat messages, command_pct percent of them are commands
+    """
+    rnd = random.Random(1)
+    occupants = ['room%d@conference.%s/nick%d' % (r, USER_DOMAIN, n) for r in range(rooms) for n in range(nicks)]
+    commands = ('moon', 'tw', 'skybber: night', 'skybber, moon')
+    texts = [rnd.choice(commands) if rnd.random() < command_pct / 100.0 else rnd.choice(_CHATTER)
+             for _ in range(messages)]
+    frms = [rnd.choice(occupants) for _ in range(messages)]
+    tmpdir = tempfile.mkdtemp(prefix='skybber-bench-')
+    saved_db = MasterDBConnection.SKYBBER_DB
+    lines = ['messages: %d  rooms: %d  commands: %0.1f %%' % (messages, rooms, command_pct), '',
+             '%-10s %12s %10s %10s %10s' % ('filter', 'msg/s', 'us/msg', 'filtered', 'handled')]
+    try:
+        MasterDBConnection.SKYBBER_DB = os.path.join(tmpdir, 'skybber.db')
+        for prefilter in (True, False):
+            conn = FakeConnection()
+            room_stats = RoomStats()
+            bot = SkybberBot(BOT_JID, '', room_stats=room_stats)
+            bot.conn = conn
+            bot.roster = conn.getRoster()
+            bot._command_filter = prefilter
+            for frm in occupants:
+                bot.callback_presence(conn, xmpp.Presence(frm=frm))
+            stanzas = [xmpp.Message(to=BOT_JID, frm=frm, typ='groupchat', body=text) for frm, text in zip(frms, texts)]
+            t0 = time.perf_counter()
+            for mess in stanzas:
+                bot.callback_message(conn, mess)
+            elapsed = time.perf_counter() - t0
+            counts = room_stats.getCounts().values()
+            lines.append('%-10s %12.0f %10.2f %10d %10d' % ('on' if prefilter else 'off', messages / elapsed,
+                                                           1e6 * elapsed / messages, sum(c[0] for c in counts),
+                                                           sum(c[1] for c in counts)))
+    finally:
+        MasterDBConnection.SKYBBER_DB = saved_db
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return '\n'.join(lines)
+
+
+def measureRosterLoad(contacts):
+    """ Measure session start with roster of contacts followed by presence of each contact
+    """
+    jids = [userJid(i) for i in range(contacts)]
+    presences = [xmpp.Presence(frm=jid + '/' + USER_RESOURCE, show=('away' if i % 3 else None), status='observing')
+                 for i, jid in enumerate(jids)]
+    conn = FakeConnection(FakeRoster(jids))
+    tmpdir = tempfile.mkdtemp(prefix='skybber-bench-')
+    saved_db = MasterDBConnection.SKYBBER_DB
+    try:
+        MasterDBConnection.SKYBBER_DB = os.path.join(tmpdir, 'skybber.db')
+        bot = SkybberBot(BOT_JID, '')
+    finally:
+        MasterDBConnection.SKYBBER_DB = saved_db
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    bot.conn = conn
+    t0 = time.perf_counter()
+    bot._init_session()
+    for presence in presences:
+        bot.callback_presence(conn, presence)
+    t1 = time.perf_counter()
+    bot._flush_presence_batch()
+    t2 = time.perf_counter()
+    return 'contacts: %d  session+presences: %0.2f ms  flush: %0.2f ms  total: %0.2f ms' % (
+        contacts, 1000.0 * (t1 - t0), 1000.0 * (t2 - t1), 1000.0 * (t2 - t0))
+
+
+def measureImport(rows, users_per_location=10):
+    """ Measure bulk import and export of rows locations into empty database
+    """
+    tmpdir = tempfile.mkdtemp(prefix='skybber-bench-')
+    try:
+        csv_path = os.path.join(tmpdir, 'locations.csv')
+        rnd = random.Random(1)
+        with open(csv_path, 'w') as f:
+            for i in range(rows):
+                f.write('%s,loc%d,%0.5f,%0.5f\n' % (userJid(i // users_per_location), i % users_per_location,
+                                                  rnd.uniform(-180.0, 180.0), rnd.uniform(-90.0, 90.0)))
+        conn = sqlite3.connect(os.path.join(tmpdir, 'skybber.db'))
+        upgrade(conn)
+        t0 = time.perf_counter()
+        with open(csv_path, newline='') as f:
+            result = importLocations(conn, f)
+        t1 = time.perf_counter()
+        with open(os.path.join(tmpdir, 'export.csv'), 'w', newline='') as f:
+            exported = exportLocations(conn, f)
+        t2 = time.perf_counter()
+        conn.close()
+        return '%s\nimport: %0.3f s (%0.0f rows/s)  export: %0.3f s (%d rows)' % (
+            result.format(), t1 - t0, rows / (t1 - t0), t2 - t1, exported)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+_SYLLABLES = ('ba', 'ber', 'ce', 'dor', 'en', 'fal', 'gra', 'hof', 'in', 'ka', 'lin', 'mo', 'nov',
+              'os', 'pra', 'ro', 'stein', 'tal', 'u', 'vi', 'ze')
+
+
+def measureGazetteer(places, lookups=10000):
+    """ Measure index build, memory and lookup latency of gazetteer of synthetic places
+    """
+    tmpdir = tempfile.mkdtemp(prefix='skybber-bench-')
+    try:
+        tsv_path = os.path.join(tmpdir, 'places.tsv')
+        rnd = random.Random(1)
+        names = []
+        with open(tsv_path, 'w', encoding='utf-8') as f:
+            for i in range(places):
+                name = ''.join(rnd.choice(_SYLLABLES) for _ in range(rnd.randint(2, 4))).capitalize()
+                names.append(name)
+                f.write('\t'.join([str(i), name, name, '', '%0.5f' % rnd.uniform(-60.0, 70.0),
+                                   '%0.5f' % rnd.uniform(-180.0, 180.0), 'P', 'PPL', 'XX', '', '', '', '', '',
+                                   str(rnd.randrange(100000)), '', '', 'Etc/UTC', '']) + '\n')
+        t0 = time.perf_counter()
+        keys = buildIndex(tsv_path, tsv_path + '.idx')
+        t1 = time.perf_counter()
+        tracemalloc.start()
+        gazetteer = Gazetteer(tsv_path)
+        gazetteer.open()
+        heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        t2 = time.perf_counter()
+
+        lines = ['places: %d  keys: %d  build: %0.3f s  open: %0.2f ms  index: %0.1f MB  heap: %0.1f kB' % (
+            places, keys, t1 - t0, 1000.0 * (t2 - t1), os.path.getsize(tsv_path + '.idx') / 1048576.0, heap / 1024.0),
+            '', '%-8s %10s %10s %10s' % ('lookup', 'p50 us', 'p99 us', 'max us')]
+        queries = (('exact', gazetteer.find, [rnd.choice(names) for _ in range(lookups)]),
+                   ('miss', gazetteer.find, [rnd.choice(names) + 'x' for _ in range(lookups)]),
+                   ('prefix', gazetteer.findPrefix, [rnd.choice(names)[:3] for _ in range(lookups)]))
+        for label, lookup, args in queries:
+            latencies = []
+            for arg in args:
+                t = time.perf_counter()
+                lookup(arg)
+                latencies.append(time.perf_counter() - t)
+            latencies.sort()
+            lines.append('%-8s %10.1f %10.1f %10.1f' % (label, 1e6 * percentile(latencies, 50),
+                                                      1e6 * percentile(latencies, 99), 1e6 * latencies[-1]))
+        gazetteer.close()
+        return '\n'.join(lines)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def measureCatalog(objects, screens=200):
+    """ Measure index build and screening of catalog of synthetic objects for random observers
+    """
+    tmpdir = tempfile.mkdtemp(prefix='skybber-bench-')
+    try:
+        tsv_path = os.path.join(tmpdir, 'catalog.tsv')
+        rnd = random.Random(1)
+        with open(tsv_path, 'w', encoding='utf-8') as f:
+            for i in range(objects):
+                f.write('OBJ %d\t%s\t%0.4f\t%0.3f\t%0.2f\n' % (i, rnd.choice(KINDS), rnd.uniform(0.0, 24.0),
+                                                              math.degrees(math.asin(rnd.uniform(-1.0, 1.0))),
+                                                              rnd.uniform(-1.0, 12.0)))
+        t0 = time.perf_counter()
+        buildCatalogIndex(tsv_path, tsv_path + '.idx')
+        t1 = time.perf_counter()
+        catalog = Catalog(tsv_path)
+        catalog.open()
+        t2 = time.perf_counter()
+
+        lines = ['objects: %d  build: %0.3f s  open: %0.2f ms  index: %0.1f kB' % (
+            objects, t1 - t0, 1000.0 * (t2 - t1), os.path.getsize(tsv_path + '.idx') / 1024.0),
+            '', '%-8s %10s %10s %10s %10s' % ('screen', 'p50 ms', 'p99 ms', 'max ms', 'visible')]
+        observers = [(rnd.uniform(0.0, 2 * math.pi), math.asin(rnd.uniform(-1.0, 1.0))) for _ in range(screens)]
+        for label, limit in (('full', None), ('whatsup', 30)):
+            latencies = []
+            visible = 0
+            for lst, lat in observers:
+                t = time.perf_counter()
+                visible += len(catalog.above(lst, lat, 10.0, limit))
+                latencies.append(time.perf_counter() - t)
+            latencies.sort()
+            lines.append('%-8s %10.3f %10.3f %10.3f %10d' % (label, 1000.0 * percentile(latencies, 50),
+                                                            1000.0 * percentile(latencies, 99), 1000.0 * latencies[-1],
+                                                            visible // screens))
+        catalog.close()
+        return '\n'.join(lines)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _tleLine(line):
+    return line + str(sum(int(c) if c.isdigit() else 1 if c == '-' else 0 for c in line) % 10)
+
+
+def _tleField(epoch):
+    return '%02d%012.8f' % (epoch.year % 100, epoch.timetuple().tm_yday + (epoch.hour * 3600 + epoch.minute * 60) / 86400.0)
+
+
+def _writeTleObject(f, name, number, field, inc, raan, ecc, argp, m, motion):
+    f.write(name + '\n')
+    f.write(_tleLine('1 %05dU %-8s %14s %10s %8s %8s 0 %4d' % (number % 100000, '26001A', field, ' .00000000',
+                                                                 ' 00000-0', ' 10000-3', 999)) + '\n')
+    f.write(_tleLine('2 %05d %8.4f %8.4f %07d %8.4f %8.4f %11.8f%5d' % (number % 100000, inc, raan, int(ecc * 1e7),
+                                                                      argp, m, motion, 1)) + '\n')
+
+
+def writeTle(f, objects, epoch, rnd):
+    """ Write objects synthetic TLEs of epoch (datetime), 90 % low orbits and 10 % higher orbits
+    """
+    field = _tleField(epoch)
+    for i in range(objects):
+        if rnd.random() < 0.9:
+            motion, ecc = rnd.uniform(13.0, 16.0), rnd.uniform(0.0, 0.02)
+        else:
+            motion, ecc = rnd.uniform(1.0, 3.0), rnd.uniform(0.0, 0.3)
+        _writeTleObject(f, 'SAT %d' % i, i, field, rnd.uniform(0.0, 110.0), rnd.uniform(0.0, 360.0), ecc,
+                        rnd.uniform(0.0, 360.0), rnd.uniform(0.0, 360.0), motion)
+
+
+def writeIridiumTle(f, epoch, planes=6, per_plane=11):
+    """ Write TLEs of Iridium-like constellation of planes x per_plane satellites of epoch (datetime)
+    """
+    field = _tleField(epoch)
+    for plane in range(planes):
+        for k in range(per_plane):
+            number = 90000 + plane * per_plane + k
+            _writeTleObject(f, 'IRIDIUM %d' % (plane * per_plane + k), number, field, 86.4, plane * 31.6, 0.0002,
+                            90.0, (k * 360.0 / per_plane + plane * 16.4) % 360.0, 14.342)
+
+
+def _passKey(info):
+    return (info.satid, float(info.start.tm), float(info.max.tm), info.max.alt, float(info.end.tm))
+
+
+def measureSatscan(objects, scans=20, minutes=10, limit=SkybberBot.MAX_OVERHEAD):
+    """ Measure screening and scan of catalog of synthetic TLEs for random observers as
+        overhead command shows them, count and shown passes are compared to refinement
+        of every satellite
+    """
+    tmpdir = tempfile.mkdtemp(prefix='skybber-bench-')
+    try:
+        tle_path = os.path.join(tmpdir, 'satellites.tle')
+        rnd = random.Random(1)
+        with open(tle_path, 'w') as f:
+            writeTle(f, objects, datetime.datetime.utcnow() - datetime.timedelta(days=1), rnd)
+        catalog = SatelliteCatalog(tle_path)
+        t0 = time.perf_counter()
+        catalog.open()
+        t1 = time.perf_counter()
+
+        screens, totals, brute = [], [], []
+        candidates = found = missed = wrong = 0
+        for _ in range(scans):
+            observer = ephem.Observer()
+            observer.long, observer.lat = rnd.uniform(-math.pi, math.pi), math.asin(rnd.uniform(-0.95, 0.95))
+            observer.date = ephem.now() + rnd.uniform(0.0, 1.0)
+            start = observer.date
+            middle = ephem.Observer()
+            middle.long, middle.lat, middle.date = observer.long, observer.lat, start + minutes / 2880.0
+            t = time.perf_counter()
+            candidates += len(catalog.screen(float(middle.sidereal_time()), float(observer.lat), float(middle.date), minutes,
+                                             sunlit=True))
+            screens.append(time.perf_counter() - t)
+            t = time.perf_counter()
+            count, shown = catalog.scan(observer, minutes, limit)
+            totals.append(time.perf_counter() - t)
+            t = time.perf_counter()
+            expected = []
+            for i in range(len(catalog)):
+                info = catalog.refine(i, observer, float(start), minutes, skip=False)
+                if info is not None:
+                    expected.append(info)
+            brute.append(time.perf_counter() - t)
+            expected.sort(key=lambda info: (info.getDate(), -float(info.start.alt)))
+            found += len(expected)
+            missed += len(expected) - count
+            wrong += 0 if [_passKey(info) for info in shown] == [_passKey(info) for info in expected[:limit]] else 1
+
+        lines = ['satellites: %d  load: %0.1f ms  window: %d min  candidates: %d  visible: %d  missed: %d  '
+                 'wrong shown: %d' % (len(catalog), 1000.0 * (t1 - t0), minutes, candidates // scans, found // scans,
+                                      missed, wrong),
+            '', '%-8s %10s %10s %10s' % ('', 'p50 ms', 'p95 ms', 'max ms')]
+        for label, latencies in (('screen', screens), ('scan', totals), ('refine all', brute)):
+            latencies.sort()
+            lines.append('%-10s %8.1f %10.1f %10.1f' % (label, 1000.0 * percentile(latencies, 50),
+                                                      1000.0 * percentile(latencies, 95), 1000.0 * latencies[-1]))
+        return '\n'.join(lines)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _bruteForceFlares(catalog, observer, hours, max_mag):
+    """ Return list of (satellite name, ephem date) of flares found by sampling every second
+        minutes when a satellite is above horizon, sunlit and sun is below horizon
+    """
+    search = flares.FlareSearch(catalog, observer, hours, max_mag)
+    start = float(observer.date)
+    minutes = hours * 60
+    result = []
+    for i in catalog.find(flares.FLARE_PREFIXES):
+        satellite = catalog.getSatellite(i)
+        coarse = [search.getPosition(satellite, start + minute / 1440.0) for minute in range(minutes + 1)]
+        for minute in range(minutes):
+            if (coarse[minute][1] <= 0.0 and coarse[minute + 1][1] <= 0.0) or (coarse[minute][3] and coarse[minute + 1][3]) \
+                    or not search.isDark(minute * search.windows // minutes):
+                continue
+            angles = []
+            for second in range(61):
+                date = start + (minute + second / 60.0) / 1440.0
+                sample = search.getPosition(satellite, date)
+                angles.append((search.getAngles(i, date, sample), sample, search.getSun(date)[0]))
+            for k in range(1, 60):
+                for panel in range(len(flares.PANEL_AZIMUTHS)):
+                    angle, sample, sun_alt = angles[k][0][panel], angles[k][1], angles[k][2]
+                    if angle <= angles[k - 1][0][panel] and angle < angles[k + 1][0][panel] \
+                            and flares.flareMag(angle, sample[2]) <= max_mag and sample[1] >= flares.MIN_ALT \
+                            and not sample[3] and sun_alt <= flares.SUN_MAX_ALT:
+                        result.append((satellite.name, start + (minute + k / 60.0) / 1440.0))
+    return result
+
+
+def measureFlares(objects, scans=20, checks=3, hours=24):
+    """ Measure flare search of a day in catalog of synthetic TLEs with Iridium-like constellation
+        for random observers, flares of first checks observers are compared to sampling every second
+    """
+    tmpdir = tempfile.mkdtemp(prefix='skybber-bench-')
+    try:
+        tle_path = os.path.join(tmpdir, 'satellites.tle')
+        rnd = random.Random(1)
+        epoch = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        with open(tle_path, 'w') as f:
+            writeTle(f, objects, epoch, rnd)
+            writeIridiumTle(f, epoch)
+        catalog = SatelliteCatalog(tle_path)
+        predictor = flares.FlarePredictor(catalog)
+        catalog.find(flares.FLARE_PREFIXES)
+
+        totals = []
+        found = expected = missed = 0
+        for scan in range(scans):
+            observer = ephem.Observer()
+            observer.long, observer.lat = rnd.uniform(-math.pi, math.pi), math.asin(rnd.uniform(-0.95, 0.95))
+            observer.date = ephem.now() + rnd.uniform(0.0, 1.0)
+            t = time.perf_counter()
+            result = predictor.predict(observer, hours)
+            totals.append(time.perf_counter() - t)
+            found += len(result)
+            if scan < checks:
+                # flares close to magnitude limit may be on either side of it
+                brute = _bruteForceFlares(catalog, observer, hours, flares.MAX_MAG - 0.3)
+                expected += len(brute)
+                missed += sum(1 for name, date in brute
+                              if not any(info.satid == name and abs(info.max.tm - date) * 86400.0 < 10.0 for info in result))
+
+        totals.sort()
+        return '\n'.join([
+            'satellites: %d  flaring: %d  span: %d h  flares: %0.1f' % (
+                len(catalog), len(catalog.find(flares.FLARE_PREFIXES)), hours, found / float(scans)),
+            'checked observers: %d  flares by 1 s sampling: %d  missed: %d' % (min(checks, scans), expected, missed),
+            '', '%-8s %10s %10s %10s' % ('', 'p50 ms', 'p95 ms', 'max ms'),
+            '%-10s %8.1f %10.1f %10.1f' % ('predict', 1000.0 * percentile(totals, 50), 1000.0 * percentile(totals, 95),
+                                           1000.0 * totals[-1])])
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def measureRender(rows, runs=20):
+    """ Measure rendering of reply with rows satellite passes and of night table of rows intervals
+    """
+    now = datetime.datetime(2024, 1, 1)
+    passes = SatellitePasses()
+    passes.parseFromXml(passesXml(now, rows))
+    start = datetime.datetime(2024, 1, 1, 18)
+    intervals = [{'start': start + datetime.timedelta(days=i), 'end': start + datetime.timedelta(days=i, hours=10)}
+                 for i in range(rows)]
+    replies = (('passes', lambda: passes.toReply('Europe/Prague')),
+               ('night', lambda: Reply('night', {'intervals': Rows('interval', intervals, ' , ')}, 'Europe/Prague')))
+    lines = ['rows: %d' % rows, '', '%-8s %12s %12s %12s %12s' % ('reply', 'build us', 'text us', 'xhtml us', 'json us')]
+    for label, build in replies:
+        timings = []
+        for render in (None, Reply.toText, Reply.toXhtml, Reply.toJson):
+            best = None
+            for _ in range(runs):
+                t = time.perf_counter()
+                reply = build()
+                if render is not None:
+                    t = time.perf_counter()
+                    render(reply)
+                elapsed = time.perf_counter() - t
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(1e6 * best)
+        lines.append('%-8s %12.1f %12.1f %12.1f %12.1f' % tuple([label] + timings))
+    return '\n'.join(lines)
+
+
+HTTP_COMMANDS = ('night', 'tw', 'sun', 'moon', 'mer', 'ven', 'mar', 'jup', 'sat', 'phases')
+
+
+def _httpClient(args):
+    """ Send paths over one keep-alive connection, return (latencies, number of failed requests)
+    """
+    port, paths = args
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = []
+    failed = 0
+    for path in paths:
+        t = time.perf_counter()
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - t)
+        if response.status != 200:
+            failed += 1
+    conn.close()
+    return latencies, failed
+
+
+def measureHttp(requests, clients=8, sites=200, concurrency=HttpApi.CONCURRENCY):
+    """ Measure HTTP API with keep-alive clients running in separate processes, requests
+        are spread over commands and sites
+    """
+    rnd = random.Random(1)
+    coords = [(rnd.uniform(-180.0, 180.0), rnd.uniform(-60.0, 60.0)) for _ in range(sites)]
+    paths = ['/%s?lng=%0.3f&lat=%0.3f' % ((rnd.choice(HTTP_COMMANDS), ) + rnd.choice(coords)) for _ in range(requests)]
+    tmpdir = tempfile.mkdtemp(prefix='skybber-bench-')
+    saved_db = MasterDBConnection.SKYBBER_DB
+    try:
+        MasterDBConnection.SKYBBER_DB = os.path.join(tmpdir, 'skybber.db')
+        bot = createBot(FakeConnection())
+        api = HttpApi(bot, '127.0.0.1', 0, concurrency)
+        api.start()
+        try:
+            chunks = [(api.getPort(), paths[i::clients]) for i in range(clients)]
+            with multiprocessing.get_context('fork').Pool(clients) as pool:
+                t0 = time.perf_counter()
+                results = pool.map(_httpClient, chunks)
+                elapsed = time.perf_counter() - t0
+        finally:
+            api.stop()
+    finally:
+        MasterDBConnection.SKYBBER_DB = saved_db
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    latencies = sorted(latency for result in results for latency in result[0])
+    return '\n'.join(['requests: %d  clients: %d  sites: %d  concurrency: %d' % (requests, clients, sites, concurrency), '',
+                      'failed: %d  elapsed: %0.3f s  throughput: %0.0f req/s  p50: %0.3f ms  p95: %0.3f ms  p99: %0.3f ms' % (
+                          sum(result[1] for result in results), elapsed, requests / elapsed,
+                          1000.0 * percentile(latencies, 50), 1000.0 * percentile(latencies, 95),
+                          1000.0 * percentile(latencies, 99))])
+
+
+STARTUP_SCRIPT = '''
+import time
+t0 = time.perf_counter()
+from %(package)s.skybberbot import SkybberBot
+t1 = time.perf_counter()
+bot = SkybberBot('skybber@localhost', '')
+t2 = time.perf_counter()
+print(t1 - t0, t2 - t1)
+'''
+
+
+def measureStartup(runs=5, top=15):
+    """ Measure import time (-X importtime) and bot construction time in fresh interpreters
+    """
+    package = __package__ or 'skybber'
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    script = STARTUP_SCRIPT % {'package': package}
+    imports, constructs = [], []
+    # bot creates skybber.db in working directory
+    cwd = tempfile.mkdtemp(prefix='skybber-bench-')
+    try:
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, '-c', script], cwd=cwd, env=env, check=True,
+                                 stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+            imports.append(float(out[0]))
+            constructs.append(float(out[1]))
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s.skybberbot' % package],
+                                cwd=cwd, env=env, check=True, stderr=subprocess.PIPE, universal_newlines=True).stderr
+    finally:
+        shutil.rmtree(cwd, ignore_errors=True)
+    modules = []
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            modules.append((int(parts[1]), parts[2].rstrip()))
+    modules.sort(reverse=True)
+    lines = ['import: %0.2f ms (min of %d)  construct: %0.3f ms' % (1000.0 * min(imports), runs, 1000.0 * min(constructs)),
+             '', '%12s  module' % 'cumul us']
+    for cumulative, name in modules[:top]:
+        lines.append('%12d  %s' % (cumulative, name))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Skybber message-replay benchmark')
+    parser.add_argument('--users', type=int, default=100, help='number of seeded users')
+    parser.add_argument('--messages', type=int, default=1000, help='number of generated messages')
+    parser.add_argument('--seed', type=int, default=None, help='random seed of generated workload')
+    parser.add_argument('--workload', help='recorded workload file, one message per line')
+    parser.add_argument('--stats', action='store_true', help='print db/ephem/http split collected by the bot')
+    parser.add_argument('--profile', type=float, metavar='SECONDS',
+                        help='profile commands slower than SECONDS and print collapsed stacks')
+    parser.add_argument('--startup', action='store_true', help='measure import and construction time of the bot')
+    parser.add_argument('--import', dest='import_rows', type=int, metavar='ROWS', help='measure bulk import of ROWS locations')
+    parser.add_argument('--roster', type=int, metavar='CONTACTS', help='measure login with roster of CONTACTS contacts')
+    parser.add_argument('--gazetteer', type=int, metavar='PLACES', help='measure gazetteer of PLACES synthetic places')
+    parser.add_argument('--catalog', type=int, metavar='OBJECTS', help='measure catalog of OBJECTS synthetic objects')
+    parser.add_argument('--muc', type=int, metavar='MESSAGES', help='measure throughput of MESSAGES groupchat messages')
+    parser.add_argument('--render', type=int, metavar='ROWS', help='measure rendering of replies with ROWS rows')
+    parser.add_argument('--satscan', type=int, metavar='SATELLITES', help='measure scan of SATELLITES synthetic TLEs')
+    parser.add_argument('--flares', type=int, metavar='SATELLITES', help='measure flare search in SATELLITES synthetic TLEs')
+    parser.add_argument('--http', type=int, metavar='REQUESTS', help='measure HTTP API with REQUESTS keep-alive requests')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        print(measureStartup())
+        return 0
+    if args.import_rows:
+        print(measureImport(args.import_rows))
+        return 0
+    if args.roster:
+        print(measureRosterLoad(args.roster))
+        return 0
+    if args.gazetteer:
+        print(measureGazetteer(args.gazetteer))
+        return 0
+    if args.catalog:
+        print(measureCatalog(args.catalog))
+        return 0
+    if args.muc:
+        print(measureMuc(args.muc))
+        return 0
+    if args.render:
+        print(measureRender(args.render))
+        return 0
+    if args.satscan:
+        print(measureSatscan(args.satscan))
+        return 0
+    if args.flares:
+        print(measureFlares(args.flares))
+        return 0
+    if args.http:
+        print(measureHttp(args.http))
+        return 0
+
+    if args.workload:
+        workload = loadWorkload(args.workload, args.users)
+    else:
+        workload = generateWorkload(args.users, args.messages, seed=args.seed)
+
+    elapsed, latencies, timeouts, queries = runReplay(args.users, workload, profile_threshold=args.profile)
+    print(formatReport(elapsed, latencies, timeouts, queries))
+    if args.stats:
+        print(commandStats.formatText())
+    return 0 if timeouts == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
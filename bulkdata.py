@@ -0,0 +1,263 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Bulk import and export of users and their locations
+
+CSV rows:    jid,name,long,lat[,default]
+JSONL lines: {"jid": ..., "name": ..., "long": ..., "lat": ..., "default": true}
+
+Rows with empty name only register the user. Coordinates are accepted in
+any format of addloc. Input is streamed and written in batches with
+executemany, committing every COMMIT_ROWS rows.
+
+    python -m skybber.bulkdata import locations.csv
+    python -m skybber.bulkdata export - --format jsonl
+"""
+
+import csv
+import json
+import sys
+
+from .site import Site
+from .typedetector import TypeDetector
+from .utils import lazyImport
+
+sqlite3 = lazyImport('sqlite3')
+
+CSV = 'csv'
+JSONL = 'jsonl'
+
+BATCH_SIZE = 5000
+COMMIT_ROWS = 100000
+MAX_REPORTED_ERRORS = 20
+
+# sqlite limit of host parameters is 999 in older versions
+_IN_CHUNK = 500
+
+_TRUE_VALUES = ('1', 'true', 'yes', 'y', '*')
+
+
+class ImportResult(object):
+    """ Counters of bulk import
+    """
+    def __init__(self):
+        self.users = 0
+        self.locations = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, lineno, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append('line %d: %s' % (lineno, message))
+
+    def format(self):
+        result = 'Imported users: %d, locations: %d, skipped existing: %d, rejected: %d' % \
+                 (self.users, self.locations, self.skipped, self.rejected)
+        if self.errors:
+            result += '\n' + '\n'.join(self.errors)
+        return result
+
+
+def detectFormat(path):
+    return JSONL if path.endswith('.jsonl') or path.endswith('.json') else CSV
+
+
+def _readRows(stream, fmt):
+    """ Yield (line number, jid, name, long, lat, default, parse error) of input rows, values are not validated
+    """
+    if fmt == JSONL:
+        for lineno, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                yield (lineno, None, None, None, None, False, str(e))
+                continue
+            if not isinstance(obj, dict):
+                yield (lineno, None, None, None, None, False, 'expected JSON object')
+                continue
+            yield (lineno, obj.get('jid'), obj.get('name'), obj.get('long'), obj.get('lat'), bool(obj.get('default')), None)
+    else:
+        for lineno, row in enumerate(csv.reader(stream), 1):
+            if not row or row[0].startswith('#') or (lineno == 1 and row[0] == 'jid'):
+                continue
+            row += [''] * (5 - len(row))
+            yield (lineno, row[0], row[1], row[2], row[3], row[4].strip().lower() in _TRUE_VALUES, None)
+
+
+def _validRows(rows, result):
+    """ Yield validated (line number, jid, name, lng, lat, default), name is None for user only rows
+    """
+    for lineno, jid, name, slng, slat, default, error in rows:
+        if error is not None:
+            result.reject(lineno, error)
+            continue
+        jid = (jid or '').strip()
+        if '@' not in jid:
+            result.reject(lineno, 'invalid jid: ' + jid)
+            continue
+        name = (name or '').strip()
+        if not name:
+            yield (lineno, jid, None, None, None, False)
+            continue
+        if len(name.split()) != 1:
+            result.reject(lineno, 'invalid location name: ' + name)
+            continue
+        lng, lat, error = TypeDetector.parseCoordinates(str(slng).strip(), str(slat).strip())
+        if error is not None:
+            result.reject(lineno, error)
+            continue
+        yield (lineno, jid, name, lng, lat, default)
+
+
+def _loadUsers(c, jids):
+    """ Return {jid: [user_id, set of location names]} of existing users
+    """
+    users = {}
+    jids = list(jids)
+    for i in range(0, len(jids), _IN_CHUNK):
+        chunk = jids[i:i + _IN_CHUNK]
+        marks = ','.join('?' * len(chunk))
+        for user_id, jid, name in c.execute('SELECT u.user_id, u.jid, l.name FROM users u LEFT JOIN locations l ON l.user_id=u.user_id '
+                                            'WHERE u.jid IN (' + marks + ')', chunk):
+            names = users.setdefault(jid, [user_id, set()])[1]
+            if name is not None:
+                names.add(name)
+    return users
+
+
+def _importBatch(c, batch, result, max_user_locations):
+    jids = set(row[1] for row in batch)
+    users = _loadUsers(c, jids)
+    new_jids = [jid for jid in jids if jid not in users]
+    if new_jids:
+        c.executemany('INSERT INTO users(jid, descr) VALUES (?, ?)', ((jid, 'description') for jid in new_jids))
+        result.users += len(new_jids)
+        users.update(_loadUsers(c, new_jids))
+
+    locations = []
+    defaults = []
+    for lineno, jid, name, lng, lat, default in batch:
+        if name is None:
+            continue
+        user_id, names = users[jid]
+        if name in names:
+            result.skipped += 1
+            continue
+        if len(names) >= max_user_locations:
+            result.reject(lineno, 'user %s exceeded limit of %d locations' % (jid, max_user_locations))
+            continue
+        names.add(name)
+        locations.append((user_id, name, lng, lat))
+        if default:
+            defaults.append((user_id, name, user_id))
+
+    cells = [Site.cellOf(lng, lat) for user_id, name, lng, lat in locations]
+    sites = Site.getOrCreateIds(c, cells)
+    c.executemany('INSERT INTO locations(user_id, name, long, lat, site_id) VALUES (?, ?, ?, ?, ?)',
+                  ((user_id, name, lng, lat, sites[cell]) for (user_id, name, lng, lat), cell in zip(locations, cells)))
+    result.locations += len(locations)
+    if defaults:
+        c.executemany('UPDATE users SET default_location_id=(SELECT location_id FROM locations WHERE user_id=? AND name=?) '
+                      'WHERE user_id=?', defaults)
+
+
+def importLocations(conn, stream, fmt=CSV, max_user_locations=10):
+    """ Import users and locations from stream into database connection conn, return ImportResult
+    """
+    result = ImportResult()
+    c = conn.cursor()
+    batch = []
+    uncommitted = 0
+    for row in _validRows(_readRows(stream, fmt), result):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            _importBatch(c, batch, result, max_user_locations)
+            uncommitted += len(batch)
+            batch = []
+            if uncommitted >= COMMIT_ROWS:
+                conn.commit()
+                uncommitted = 0
+    if batch:
+        _importBatch(c, batch, result, max_user_locations)
+    # first location becomes default one, like in addloc
+    c.execute('UPDATE users SET default_location_id=(SELECT MIN(location_id) FROM locations WHERE user_id=users.user_id) '
+              'WHERE default_location_id IS NULL')
+    conn.commit()
+    return result
+
+
+def exportLocations(conn, stream, fmt=CSV):
+    """ Write all users and locations to stream, return number of written rows
+    """
+    rs = conn.execute('SELECT u.jid, l.name, l.long, l.lat, l.location_id=u.default_location_id '
+                      'FROM users u LEFT JOIN locations l ON l.user_id=u.user_id ORDER BY u.user_id, l.location_id')
+    count = 0
+    if fmt == JSONL:
+        for jid, name, lng, lat, default in rs:
+            obj = {'jid': jid}
+            if name is not None:
+                obj.update(name=name, long=lng, lat=lat, default=bool(default))
+            stream.write(json.dumps(obj) + '\n')
+            count += 1
+    else:
+        writer = csv.writer(stream, lineterminator='\n')
+        writer.writerow(('jid', 'name', 'long', 'lat', 'default'))
+        for jid, name, lng, lat, default in rs:
+            if name is None:
+                writer.writerow((jid, '', '', '', ''))
+            else:
+                writer.writerow((jid, name, repr(lng), repr(lat), 'true' if default else ''))
+            count += 1
+    return count
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Bulk import/export of skybber users and locations')
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('file', help="input/output file, '-' for stdin/stdout")
+    parser.add_argument('--db', default='skybber.db', help='path of skybber database')
+    parser.add_argument('--format', choices=(CSV, JSONL), help='file format, detected from extension by default')
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detectFormat(args.file)
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.action == 'import':
+            stream = sys.stdin if args.file == '-' else open(args.file, newline='')
+            with stream:
+                print(importLocations(conn, stream, fmt).format())
+        else:
+            stream = sys.stdout if args.file == '-' else open(args.file, 'w', newline='')
+            with stream:
+                count = exportLocations(conn, stream, fmt)
+            if args.file != '-':
+                print('Exported rows: %d' % count)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Catalog of stars and deep-sky objects
+
+Objects are read from tab separated file (name, kind, RA J2000 in hours,
+Dec J2000 in degrees, magnitude), lines starting with '#' are ignored.
+They are written sorted by magnitude to binary index file which is memory
+mapped, it is rebuilt when it is older than the source file.
+
+Index layout (little endian):
+    header   magic, version, object count, offset of strings, offset and length of constellations
+    arrays   float32 arrays of count items: ra, dec (radians), x, y, z (unit vector), magnitude
+    records  RECORD_FORMAT
+    strings  utf-8 names, constellation names separated by newline
+
+Objects above horizon are screened by dot product of unit vectors of objects
+and of zenith, there is no trigonometry per object.
+
+    python -m skybber.catalog [--tsv catalog.tsv] [--lng LNG --lat LAT]
+"""
+
+import array
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+
+from .utils import lazyImport, constellationName, cachePath
+
+ephem = lazyImport('ephem')
+
+DEFAULT_TSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.tsv')
+INDEX_SUFFIX = '.idx'
+
+MAGIC = b'SKCT'
+VERSION = 1
+HEADER_FORMAT = '<4sIIIII'
+# name offset, name length, kind, constellation
+RECORD_FORMAT = '<IHBB'
+
+KINDS = ('star', 'cluster', 'nebula', 'galaxy')
+
+_HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+_RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+_ARRAYS = ('ra', 'dec', 'x', 'y', 'z', 'mag')
+
+
+class SkyObject(object):
+    """ Object of catalog
+    """
+
+    def __init__(self, name, kind, ra, dec, mag, constellation):
+        self._name = name
+        self._kind = kind
+        self._ra = ra
+        self._dec = dec
+        self._mag = mag
+        self._constellation = constellation
+
+    def getName(self):
+        return self._name
+
+    def getKind(self):
+        return self._kind
+
+    def getRa(self):
+        """ Return right ascension J2000 in radians
+        """
+        return self._ra
+
+    def getDec(self):
+        """ Return declination J2000 in radians
+        """
+        return self._dec
+
+    def getMag(self):
+        return self._mag
+
+    def getConstellation(self):
+        return self._constellation
+
+    def toBody(self):
+        """ Return ephem body of object
+        """
+        body = ephem.FixedBody()
+        body._ra, body._dec, body._epoch = self._ra, self._dec, ephem.J2000
+        body.name = self._name
+        return body
+
+
+def _readObjects(stream):
+    """ Yield (name, kind, ra, dec, mag) of catalog lines, ra and dec in radians
+    """
+    for line in stream:
+        if not line.strip() or line.startswith('#'):
+            continue
+        cols = line.rstrip('\n').split('\t')
+        if len(cols) < 5 or cols[1] not in KINDS:
+            continue
+        try:
+            ra, dec, mag = math.radians(15.0 * float(cols[2])), math.radians(float(cols[3])), float(cols[4])
+        except ValueError:
+            continue
+        yield cols[0], cols[1], ra, dec, mag
+
+
+def buildIndex(tsv_path, index_path):
+    """ Build index file of catalog, return number of objects
+    """
+    with open(tsv_path, encoding='utf-8') as f:
+        objects = sorted(_readObjects(f), key=lambda o: o[4])
+    count = len(objects)
+
+    constellations = {}
+    arrays = dict((name, array.array('f')) for name in _ARRAYS)
+    records = bytearray(_RECORD_SIZE * count)
+    strings_offset = _HEADER_SIZE + 4 * len(_ARRAYS) * count + _RECORD_SIZE * count
+    strings = bytearray()
+    for i, (name, kind, ra, dec, mag) in enumerate(objects):
+        constellation = constellationName((ra, dec), '2000')
+        encoded = name.encode('utf-8')
+        struct.pack_into(RECORD_FORMAT, records, i * _RECORD_SIZE, strings_offset + len(strings), len(encoded),
+                         KINDS.index(kind), constellations.setdefault(constellation, len(constellations)))
+        strings += encoded
+        cos_dec = math.cos(dec)
+        for array_name, value in zip(_ARRAYS, (ra, dec, cos_dec * math.cos(ra), cos_dec * math.sin(ra), math.sin(dec), mag)):
+            arrays[array_name].append(value)
+    constellations_blob = '\n'.join(sorted(constellations, key=constellations.get)).encode('utf-8')
+
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, count, strings_offset,
+                            strings_offset + len(strings), len(constellations_blob)))
+        for name in _ARRAYS:
+            if sys.byteorder != 'little':
+                arrays[name].byteswap()
+            f.write(arrays[name].tobytes())
+        f.write(records)
+        f.write(strings)
+        f.write(constellations_blob)
+    os.replace(tmp_path, index_path)
+    return count
+
+
+class Catalog(object):
+    """ Memory mapped catalog of objects sorted by magnitude.
+
+    Index is opened (and built if it is stale) on first use. Without index
+    path it is next to the catalog or in user cache directory.
+    """
+
+    def __init__(self, tsv_path=DEFAULT_TSV, index_path=None):
+        self._tsv_path = tsv_path
+        self._index_path = index_path
+        self._lock = threading.Lock()
+        self._mm = None
+        self._count = 0
+        self._records_offset = 0
+        self._constellations = None
+        self._arrays = None
+
+    def _isStale(self):
+        if not os.path.exists(self._index_path):
+            return True
+        if os.path.getmtime(self._index_path) < os.path.getmtime(self._tsv_path):
+            return True
+        with open(self._index_path, 'rb') as f:
+            header = f.read(_HEADER_SIZE)
+        return len(header) < _HEADER_SIZE or struct.unpack(HEADER_FORMAT, header)[:2] != (MAGIC, VERSION)
+
+    def open(self):
+        """ Map index into memory, build it first if it is stale
+        """
+        if self._mm is not None:
+            return
+        with self._lock:
+            if self._mm is not None:
+                return
+            if self._index_path is None:
+                self._index_path = cachePath(self._tsv_path + INDEX_SUFFIX)
+            if self._isStale():
+                buildIndex(self._tsv_path, self._index_path)
+            with open(self._index_path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _, _, count, _, constellations_offset, constellations_length = struct.unpack_from(HEADER_FORMAT, mm, 0)
+            blob = mm[constellations_offset:constellations_offset + constellations_length].decode('utf-8')
+            self._constellations = blob.split('\n') if blob else []
+            arrays = {}
+            for i, name in enumerate(_ARRAYS):
+                start = _HEADER_SIZE + 4 * i * count
+                if sys.byteorder == 'little':
+                    arrays[name] = memoryview(mm)[start:start + 4 * count].cast('f')
+                else:
+                    arrays[name] = array.array('f', mm[start:start + 4 * count])
+                    arrays[name].byteswap()
+            self._arrays = arrays
+            self._records_offset = _HEADER_SIZE + 4 * len(_ARRAYS) * count
+            self._count = count
+            self._mm = mm
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                for view in self._arrays.values():
+                    if isinstance(view, memoryview):
+                        view.release()
+                self._arrays = None
+                self._mm.close()
+                self._mm = None
+
+    def __len__(self):
+        self.open()
+        return self._count
+
+    def getObject(self, i):
+        """ Return SkyObject of index i
+        """
+        self.open()
+        name_offset, name_length, kind, constellation = \
+            struct.unpack_from(RECORD_FORMAT, self._mm, self._records_offset + i * _RECORD_SIZE)
+        return SkyObject(self._mm[name_offset:name_offset + name_length].decode('utf-8'), KINDS[kind],
+                         self._arrays['ra'][i], self._arrays['dec'][i], self._arrays['mag'][i],
+                         self._constellations[constellation])
+
+    def above(self, lst, lat, min_alt=0.0, limit=None):
+        """ Return indexes of objects higher than min_alt degrees in magnitude order.
+
+        lst is local sidereal time and lat latitude of observer in radians. Position of
+        objects is not precessed from J2000, screening is precise to about a degree.
+        """
+        self.open()
+        cos_lat = math.cos(lat)
+        zx, zy, zz = cos_lat * math.cos(lst), cos_lat * math.sin(lst), math.sin(lat)
+        min_sin = math.sin(math.radians(min_alt))
+        arrays = self._arrays
+        visible = (i for i, x, y, z in zip(range(self._count), arrays['x'], arrays['y'], arrays['z'])
+                   if x * zx + y * zy + z * zz > min_sin)
+        if limit is None:
+            return list(visible)
+        result = []
+        for i in visible:
+            result.append(i)
+            if len(result) >= limit:
+                break
+        return result
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build and query skybber catalog index')
+    parser.add_argument('--tsv', default=DEFAULT_TSV, help='catalog file')
+    parser.add_argument('--index', help='index file, default is next to catalog or in user cache directory')
+    parser.add_argument('--lng', type=float, help='longitude of observer in degrees')
+    parser.add_argument('--lat', type=float, help='latitude of observer in degrees')
+    parser.add_argument('--alt', type=float, default=10.0, help='minimal altitude in degrees')
+    parser.add_argument('--limit', type=int, default=20, help='max number of listed objects')
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.tsv, args.index)
+    print('Indexed objects: %d' % len(catalog))
+    if args.lng is not None and args.lat is not None:
+        observer = ephem.Observer()
+        observer.long, observer.lat = math.radians(args.lng), math.radians(args.lat)
+        for i in catalog.above(observer.sidereal_time(), observer.lat, args.alt, args.limit):
+            sky_object = catalog.getObject(i)
+            body = sky_object.toBody()
+            body.compute(observer)
+            print('%-32s %-8s %5.1f  %5.1f %6.1f  %s' % (sky_object.getName(), sky_object.getKind(), sky_object.getMag(),
+                                                         math.degrees(body.alt), math.degrees(body.az),
+                                                         sky_object.getConstellation()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# coding: utf-8
+
+import datetime
+import re
+
+from .location import Location
+from .typedetector import TypeDetector
+
+
+class CmdError(Exception):
+    """ Help class for handling command arguments errors
+    """
+    def __init__(self, value):
+        self.value = value
+        def __str__(self):
+            return repr(self.value)
+
+
+class CommandRequest(object):
+    """ Transport neutral arguments of command: jid of requester, command options
+        (e.g. 'all' of tw), location given by name or coordinates in degrees and date.
+        Requests are parsed from text of chat message or from parameters of HTTP query.
+    """
+
+    ARG_RE = re.compile('[ \t]+')
+
+    def __init__(self, jid, loc=None, dt=None, flags=''):
+        self._jid = jid
+        self._loc = loc
+        self._dt = dt
+        self._flags = flags
+
+    def getJID(self):
+        return self._jid
+
+    def getLocation(self):
+        """ Return Location with name or with coordinates or None
+        """
+        return self._loc
+
+    def getDate(self):
+        """ Return datetime.date or None
+        """
+        return self._dt
+
+    def getFlags(self):
+        return self._flags
+
+    @staticmethod
+    def parse(jid, args, parse_date=True, flags=''):
+        """ Return request of command arguments '[date] [location]', location is
+            name, longitude and latitude in degrees or in geographic format
+        """
+        args = args.strip() if args is not None else ''
+        if len(args) == 0:
+            return CommandRequest(jid, flags=flags)
+
+        dt = None
+        lng = None
+        lat = None
+        loc_name = None
+        numbers = []
+
+        for arg in CommandRequest.ARG_RE.split(args):
+            parsed_arg = TypeDetector(arg)
+            if parse_date and parsed_arg.getType() == TypeDetector.DATE:
+                if dt is not None:
+                    raise CmdError('Invalid double date argument: ' + arg)
+                dt = parsed_arg.getTypeValue()
+            elif parsed_arg.getType() == TypeDetector.LOCATION_LONG:
+                if lng is not None:
+                    raise CmdError('Invalid double longitude argument: ' + arg)
+                lng = parsed_arg.getTypeValue()
+            elif parsed_arg.getType() == TypeDetector.LOCATION_LAT:
+                if lat is not None:
+                    raise CmdError('Invalid double latitude argument: ' + arg)
+                lat = parsed_arg.getTypeValue()
+            elif parsed_arg.isNumber():
+                numbers.append(arg)
+            elif parsed_arg.getType() == TypeDetector.STRING:
+                if loc_name is not None:
+                    raise CmdError('Invalid double location name argument: ' + arg)
+                loc_name = parsed_arg.getValue()
+            else:
+                raise CmdError('Invalid argument: ' + arg)
+
+        # two numbers are longitude and latitude
+        if numbers:
+            if len(numbers) != 2 or lng is not None or lat is not None:
+                raise CmdError('Invalid argument: ' + numbers[0])
+            lng, lat, error = TypeDetector.parseCoordinates(numbers[0], numbers[1])
+            if error is not None:
+                raise CmdError(error)
+
+        if (lng is not None or lat is not None) and loc_name is not None:
+            raise CmdError('Invalid arguments. Please specify only one of longitude/latitude or location name.')
+        if lng is not None and lat is None:
+            raise CmdError('Invalid argument. Latitude missing.')
+        if lng is None and lat is not None:
+            raise CmdError('Invalid argument. Longitude missing.')
+        loc = None
+        if lng is not None:
+            loc = Location(None, None, None, lng, lat)
+        elif loc_name is not None:
+            loc = Location(None, None, loc_name, None, None)
+        return CommandRequest(jid, loc, dt, flags)
+
+    @staticmethod
+    def fromParams(jid, params, flags=''):
+        """ Return request of query parameters: lng and lat in degrees or place (name of
+            location), date YYYY-MM-DD
+        """
+        loc = None
+        if 'lng' in params or 'lat' in params:
+            if 'place' in params:
+                raise CmdError('Invalid arguments. Please specify only one of lng/lat or place.')
+            if 'lng' not in params or 'lat' not in params:
+                raise CmdError('Invalid argument. Both lng and lat expected.')
+            lng, lat, error = TypeDetector.parseCoordinates(params['lng'], params['lat'])
+            if error is not None:
+                raise CmdError(error)
+            loc = Location(None, None, None, lng, lat)
+        elif params.get('place'):
+            loc = Location(None, None, params['place'], None, None)
+        dt = None
+        if params.get('date'):
+            try:
+                dt = datetime.datetime.strptime(params['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CmdError('Invalid date: ' + params['date'] + '. YYYY-MM-DD expected.')
+        return CommandRequest(jid, loc, dt, flags)
@@ -0,0 +1,181 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Persistent store of computed rise/set times, twilights and satellite passes
+
+Results are kept in memory and written behind in batches to side table
+ephemeris of skybber.db, so they survive restarts. Every entry has a day
+(ephem date); entries of days older than retention or too far ahead are
+deleted when the table is loaded and once a day after, entries of other far
+days are kept only in memory. Memory holds at most MAX_ENTRIES recently used
+entries. The table is loaded on first lookup or in background by warmup
+thread of the bot.
+"""
+
+import collections
+import json
+import logging
+import threading
+import time
+
+from .utils import lazyImport
+
+ephem = lazyImport('ephem')
+sqlite3 = lazyImport('sqlite3')
+
+
+class EphemerisStore(object):
+    """ Memory map of (kind, key): (day, value) backed by ephemeris table
+    """
+
+    RETENTION_DAYS = 2
+    AHEAD_DAYS = 30
+    MAX_ENTRIES = 100000
+    FLUSH_SIZE = 500
+    FLUSH_INTERVAL = 10.0
+    COMPACT_INTERVAL = 86400.0
+
+    SQL_LOAD = 'SELECT kind, key, day, value FROM ephemeris WHERE day>=? AND day<=? LIMIT ?'
+    SQL_COMPACT = 'DELETE FROM ephemeris WHERE day<? OR day>?'
+    SQL_PUT = 'INSERT OR REPLACE INTO ephemeris(kind, key, day, value) VALUES (?,?,?,?)'
+
+    def __init__(self, path, retention_days=RETENTION_DAYS, max_entries=MAX_ENTRIES):
+        self._path = path
+        self._retention_days = retention_days
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        # (kind, key, day, json value) not written yet
+        self._pending = []
+        self._flushed = time.time()
+        self._compacted = time.time()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _window(self):
+        """ Return (first, last) day of entries written to table
+        """
+        now = float(ephem.now())
+        return now - self._retention_days, now + self.AHEAD_DAYS
+
+    def open(self, wait=True):
+        """ Load entries of recent days and delete older rows. Return False if
+            wait is False and other thread is loading
+        """
+        if self._loaded:
+            return True
+        if not self._load_lock.acquire(wait):
+            return False
+        try:
+            if not self._loaded:
+                loaded = {}
+                conn = sqlite3.connect(self._path)
+                try:
+                    first, last = self._window()
+                    conn.execute(self.SQL_COMPACT, (first, last))
+                    for kind, key, day, value in conn.execute(self.SQL_LOAD, (first, last, self._max_entries)):
+                        loaded[(kind, key)] = (day, json.loads(value))
+                    conn.commit()
+                finally:
+                    conn.close()
+                with self._lock:
+                    # entries computed during loading are newer
+                    for entry_key, entry in loaded.items():
+                        if len(self._entries) >= self._max_entries:
+                            break
+                        if entry_key not in self._entries:
+                            self._entries[entry_key] = entry
+                            self._entries.move_to_end(entry_key, last=False)
+                self._loaded = True
+        finally:
+            self._load_lock.release()
+        return True
+
+    def get(self, kind, key):
+        """ Return value of entry or None. Lookup during loading by other thread
+            does not wait and sees entries loaded so far
+        """
+        self.open(wait=False)
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end((kind, key))
+            self._hits += 1
+            return entry[1]
+
+    def put(self, kind, key, day, value):
+        """ Store JSON serializable value of ephem date day, it is written by next flush
+            if the day is not too far
+        """
+        day = float(day)
+        with self._lock:
+            self._entries[(kind, key)] = (day, value)
+            self._entries.move_to_end((kind, key))
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        first, last = self._window()
+        if day < first or day > last:
+            return
+        with self._pending_lock:
+            self._pending.append((kind, key, day, json.dumps(value)))
+
+    def flush(self, force=False):
+        """ Write pending entries if there are enough of them, or they wait long
+            enough, or force is True. Return number of written entries
+        """
+        now = time.time()
+        with self._pending_lock:
+            if not self._pending or (not force and len(self._pending) < self.FLUSH_SIZE
+                                     and now - self._flushed < self.FLUSH_INTERVAL):
+                return 0
+            pending, self._pending = self._pending, []
+        self._flushed = now
+        compact = now - self._compacted >= self.COMPACT_INTERVAL
+        conn = sqlite3.connect(self._path)
+        try:
+            conn.executemany(self.SQL_PUT, pending)
+            if compact:
+                first, last = self._window()
+                conn.execute(self.SQL_COMPACT, (first, last))
+            conn.commit()
+        except sqlite3.Error as e:
+            logging.error('Error writing ephemeris store %s: %s', self._path, e)
+            return 0
+        finally:
+            conn.close()
+        if compact:
+            self._compacted = now
+            with self._lock:
+                for entry_key in [entry_key for entry_key, entry in self._entries.items() if entry[0] < first]:
+                    del self._entries[entry_key]
+        return len(pending)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def formatText(self):
+        return '\nephemeris store  entries %d  pending %d  hits %d  misses %d  evictions %d%s\n' % (
+            len(self._entries), len(self._pending), self._hits, self._misses, self._evictions,
+            '' if self._loaded else '  (not loaded)')
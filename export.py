@@ -0,0 +1,358 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Export of ephemeris events of a site as iCalendar or CSV
+
+Events of a range of days are dark windows (astronomical night without the
+Moon, as night command), twilights, sunset and sunrise, Moon rise and set,
+lunar phases and rise and set of planets. Every kind is a generator solved
+day after day: twilights by twilight.iterTwilights, rise and set by searches
+starting at the previous event. Dark windows share twilights and Moon events
+with the other kinds by itertools.tee. Generators are merged by time and
+written line by line, so memory does not depend on length of the range.
+
+    python -m skybber.export --jid user@example.org --loc home --year 2025 > home.ics
+    python -m skybber.export --place prague --from 2025-01-01 --to 2025-03-31 --format csv
+"""
+
+import csv
+import datetime
+import heapq
+import itertools
+import math
+import sys
+
+from .almanac import Almanac
+from .gazetteer import Gazetteer
+from .usercontext import UserContext
+from .utils import lazyImport, localToUtc, formatLocalDateTime
+from . import twilight
+
+ephem = lazyImport('ephem')
+sqlite3 = lazyImport('sqlite3')
+
+NIGHT, TWILIGHT, SUN, MOON, PHASES, PLANETS = 'night', 'tw', 'sun', 'moon', 'phases', 'planets'
+KINDS = (NIGHT, TWILIGHT, SUN, MOON, PHASES, PLANETS)
+PLANET_NAMES = ('Mercury', 'Venus', 'Mars', 'Jupiter', 'Saturn')
+ICS = 'ics'
+CSV = 'csv'
+
+DARK_WINDOW = 'Dark window'
+
+
+def iterRiseSet(lng, lat, body, start, end, horizon='0.0'):
+    """ Yield (ephem date, True if rising) of rise and set of body from start to end,
+        longitude and latitude are in radians. Every search starts at previous event
+        of the same kind, days when body does not cross horizon are skipped
+    """
+    observer = ephem.Observer()
+    observer.long, observer.lat = lng, lat
+    observer.horizon = horizon
+
+    def search(rising, date):
+        observer.date = date
+        try:
+            return float(observer.next_rising(body) if rising else observer.next_setting(body))
+        except (ephem.NeverUpError, ephem.AlwaysUpError):
+            return None
+
+    date = float(start)
+    following = {True: search(True, date), False: search(False, date)}
+    while date < end:
+        found = [(event, rising) for rising, event in following.items() if event is not None]
+        if not found:
+            # circumpolar or never rising, search again next day
+            date += 1.0
+            following = {True: search(True, date), False: search(False, date)}
+            continue
+        date, rising = min(found)
+        if date >= end:
+            break
+        yield ephem.Date(date), rising
+        following[rising] = search(rising, date + ephem.minute)
+
+
+def _twilightEvents(nights, kinds):
+    """ Yield (start, None, summary) of sunset, sunrise, dusks and dawns of nights
+    """
+    for _, twilights in nights:
+        events = []
+        for tw in twilights:
+            if tw.getRiset() != twilight.RISET_OK:
+                continue
+            if tw.getName() == twilight.HORIZONS[twilight.SUNSET][0]:
+                if SUN in kinds:
+                    events.append((float(tw.getDusk()), None, 'Sunset'))
+                    events.append((float(tw.getDawn()), None, 'Sunrise'))
+            elif TWILIGHT in kinds:
+                events.append((float(tw.getDusk()), None, tw.getName() + ' dusk'))
+                events.append((float(tw.getDawn()), None, tw.getName() + ' dawn'))
+        events.sort()
+        for event in events:
+            yield event
+
+
+def _darkWindows(nights, moon_events, moon_up):
+    """ Yield (start, end, DARK_WINDOW) of astronomical nights of nights when the Moon
+        is below horizon. moon_events are (date, rising) and moon_up is state at start,
+        windows of consecutive polar nights are joined
+    """
+    moon_events = iter(moon_events)
+    following = next(moon_events, None)
+    window = None
+    for noon, twilights in nights:
+        astronomical = twilights[twilight.ASTRONOMICAL]
+        if astronomical.getRiset() == twilight.RISET_OK:
+            dusk, dawn = float(astronomical.getDusk()), float(astronomical.getDawn())
+        elif astronomical.getRiset() == twilight.NEVER_RISING:
+            # the Sun stays below astronomical horizon
+            dusk, dawn = float(noon), float(noon) + 1.0
+        else:
+            continue
+        while following is not None and following[0] <= dusk:
+            moon_up = following[1]
+            following = next(moon_events, None)
+        start = None if moon_up else dusk
+        while following is not None and following[0] < dawn:
+            if following[1]:
+                if start is not None:
+                    window, done = _joinWindow(window, start, following[0])
+                    if done is not None:
+                        yield done
+                    start = None
+            else:
+                start = following[0]
+            moon_up = following[1]
+            following = next(moon_events, None)
+        if start is not None:
+            window, done = _joinWindow(window, start, dawn)
+            if done is not None:
+                yield done
+    if window is not None:
+        yield window
+
+
+def _joinWindow(window, start, end):
+    """ Return (current window, finished window or None) after adding window start - end
+    """
+    if window is not None and start - window[1] < ephem.second:
+        return (window[0], end, DARK_WINDOW), None
+    return (start, end, DARK_WINDOW), window
+
+
+def _riseSetEvents(events, rise_summary, set_summary):
+    for date, rising in events:
+        yield float(date), None, rise_summary if rising else set_summary
+
+
+def _isMoonUp(lng, lat, date):
+    """ Return True if the Moon is above horizon of rise and set at ephem date
+    """
+    observer = ephem.Observer()
+    observer.long, observer.lat, observer.date = lng, lat, date
+    moon = ephem.Moon()
+    try:
+        return observer.next_setting(moon) < observer.next_rising(moon)
+    except ephem.AlwaysUpError:
+        return True
+    except ephem.NeverUpError:
+        return False
+
+
+def iterEvents(lng, lat, first, last, zone=None, kinds=KINDS, almanac=None):
+    """ Yield (start, end or None, summary) of events of local dates first to last
+        ordered by start (ephem dates), longitude and latitude are in radians
+    """
+    start = ephem.Date(localToUtc(datetime.datetime.combine(first, datetime.time()), zone))
+    end = ephem.Date(localToUtc(datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time()), zone))
+    noon = ephem.Date(localToUtc(datetime.datetime.combine(first, datetime.time(12)), zone))
+    days = (last - first).days + 1
+    sources = []
+    nights = twilight.iterTwilights(lng, lat, noon, days)
+    if NIGHT in kinds and (TWILIGHT in kinds or SUN in kinds):
+        night_nights, nights = itertools.tee(nights)
+    else:
+        night_nights = nights
+    if NIGHT in kinds or MOON in kinds:
+        moon_events = iterRiseSet(lng, lat, ephem.Moon(), start, end + 1.0)
+        if NIGHT in kinds and MOON in kinds:
+            # Moon events are read by dark windows about a day ahead of merge
+            night_moon_events, moon_events = itertools.tee(moon_events)
+        else:
+            night_moon_events = moon_events
+        if NIGHT in kinds:
+            sources.append(_darkWindows(night_nights, night_moon_events, _isMoonUp(lng, lat, start)))
+        if MOON in kinds:
+            sources.append(event for event in _riseSetEvents(moon_events, 'Moonrise', 'Moonset') if event[0] < end)
+    if TWILIGHT in kinds or SUN in kinds:
+        sources.append(_twilightEvents(nights, kinds))
+    if PHASES in kinds:
+        sources.append((float(phase.getDate()), None, phase.getName())
+                       for phase in (almanac or Almanac()).iterPhases(start, end))
+    if PLANETS in kinds:
+        for name in PLANET_NAMES:
+            sources.append(_riseSetEvents(iterRiseSet(lng, lat, getattr(ephem, name)(), start, end),
+                                          name + ' rise', name + ' set'))
+    return heapq.merge(*sources, key=lambda event: event[0])
+
+
+def writeCsv(stream, events, zone=None):
+    """ Write events with local times, return number of events
+    """
+    writer = csv.writer(stream)
+    writer.writerow(('start', 'end', 'event'))
+    count = 0
+    for start, end, summary in events:
+        writer.writerow((formatLocalDateTime(start, zone), formatLocalDateTime(end, zone), summary))
+        count += 1
+    return count
+
+
+def _icsDate(date):
+    return ephem.Date(date).datetime().strftime('%Y%m%dT%H%M%SZ')
+
+
+def _icsText(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _icsLine(line):
+    """ Return content line folded to lines of at most 75 octets
+    """
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts = []
+    while data:
+        size = 75 if not parts else 74
+        # do not split utf-8 sequence
+        while size < len(data) and (data[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(data[:size].decode('utf-8'))
+        data = data[size:]
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def writeIcs(stream, events, name, lng, lat):
+    """ Write events as iCalendar in UTC, return number of events. Events are transparent,
+        so they do not block time of the calendar
+    """
+    stamp = _icsDate(ephem.now())
+    site = '%.4f,%.4f' % (math.degrees(lat), math.degrees(lng))
+    stream.write(_icsLine('BEGIN:VCALENDAR') + _icsLine('VERSION:2.0') + _icsLine('PRODID:-//skybber//ephemeris export//EN') +
+                 _icsLine('CALSCALE:GREGORIAN') + _icsLine('X-WR-CALNAME:' + _icsText('Skybber ' + name)))
+    count = 0
+    for start, end, summary in events:
+        lines = ['BEGIN:VEVENT',
+                 'UID:%s-%s-%s@skybber' % (_icsDate(start), summary.lower().replace(' ', '-'), site),
+                 'DTSTAMP:' + stamp,
+                 'DTSTART:' + _icsDate(start)]
+        if end is not None:
+            lines.append('DTEND:' + _icsDate(end))
+        lines.extend(('SUMMARY:' + _icsText(summary), 'LOCATION:' + _icsText(name), 'GEO:' + site.replace(',', ';'),
+                      'TRANSP:TRANSPARENT', 'END:VEVENT'))
+        stream.write(''.join(_icsLine(line) for line in lines))
+        count += 1
+    stream.write(_icsLine('END:VCALENDAR'))
+    return count
+
+
+def _parseDate(value):
+    import argparse
+
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('YYYY-MM-DD expected: ' + value)
+
+
+def _findSite(args):
+    """ Return (name, lng, lat in degrees, zone or None) of site of arguments
+    """
+    if args.lng is not None or args.lat is not None:
+        if args.lng is None or args.lat is None:
+            raise ValueError('Both --lng and --lat expected.')
+        return '%s %s' % (args.lng, args.lat), args.lng, args.lat, None
+    if args.place is not None:
+        place = Gazetteer().find(args.place)
+        if place is None:
+            raise ValueError('Place not found: ' + args.place)
+        return place.getName(), place.getLng(), place.getLat(), place.getTimeZone()
+    if args.jid is None:
+        raise ValueError('One of --jid, --place or --lng and --lat expected.')
+    conn = sqlite3.connect(args.db)
+    try:
+        ctx = UserContext.load(conn.cursor(), args.jid, args.loc)
+    finally:
+        conn.close()
+    loc = ctx.getObserverLocation()
+    if loc is None:
+        raise ValueError('Location of %s not found: %s' % (args.jid, args.loc or 'default'))
+    user_zone = ctx.getUser().getTimeZone() if ctx.getUser() is not None else None
+    return loc.getName(), loc.getLng(), loc.getLat(), user_zone
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export ephemeris events of a site as iCalendar or CSV')
+    parser.add_argument('--jid', help='user of saved location')
+    parser.add_argument('--loc', help='name of saved location, default location of user by default')
+    parser.add_argument('--place', help='place of gazetteer')
+    parser.add_argument('--lng', type=float, help='longitude in degrees')
+    parser.add_argument('--lat', type=float, help='latitude in degrees')
+    parser.add_argument('--year', type=int, help='export whole year')
+    parser.add_argument('--from', dest='first', type=_parseDate, help='first date YYYY-MM-DD, today by default')
+    parser.add_argument('--to', dest='last', type=_parseDate, help='last date YYYY-MM-DD, a year from first by default')
+    parser.add_argument('--events', default=','.join(KINDS), help='kinds of events: ' + ','.join(KINDS))
+    parser.add_argument('--format', choices=(ICS, CSV), default=ICS, help='output format')
+    parser.add_argument('--zone', help='time zone of CSV times and of dates, zone of site by default')
+    parser.add_argument('--db', default='skybber.db', help='skybber database')
+    parser.add_argument('--output', '-o', default='-', help="output file, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    kinds = set(kind.strip() for kind in args.events.split(','))
+    if not kinds <= set(KINDS):
+        parser.error('unknown events: ' + ','.join(sorted(kinds - set(KINDS))))
+    try:
+        name, lng, lat, zone = _findSite(args)
+    except ValueError as e:
+        parser.error(str(e))
+    zone = args.zone or zone or Gazetteer().findZone(lng, lat)
+    if args.year is not None:
+        first, last = datetime.date(args.year, 1, 1), datetime.date(args.year, 12, 31)
+    else:
+        first = args.first or datetime.date.today()
+        last = args.last or first + datetime.timedelta(days=364)
+    if last < first:
+        parser.error('last date precedes first date')
+
+    events = iterEvents(math.radians(lng), math.radians(lat), first, last, zone, kinds)
+    stream = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    with stream:
+        if args.format == CSV:
+            count = writeCsv(stream, events, zone)
+        else:
+            count = writeIcs(stream, events, name or '%s %s' % (lng, lat), math.radians(lng), math.radians(lat))
+    if args.output != '-':
+        print('Exported events: %d' % count)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,410 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Prediction of flares of satellites with flat reflective panels (Iridium-style)
+
+Satellites of TLE catalog with name starting with one of prefixes are
+modeled as nadir pointing bodies with x axis in direction of motion (normal
+of the orbital plane x position) and three flat panels 120 deg apart, tilted
+40 deg from the body axis. A flare is seen when sunlight reflected by a
+panel points close to the observer, brightness falls with the angle between
+the reflected ray and direction to the observer (flare angle) and with range.
+
+Search of the time span runs in three stages:
+
+    window   satellites which may be above horizon during windows of 10 min
+             with sun below horizon of observer are screened by catalog
+    bounds   positions are sampled by ephem every 2 min. Flare angle of a
+             panel changes at most by rate 2 n + v / range (panel rotation
+             with the orbit, motion of the satellite seen from observer),
+             altitude by v / range, so interval of two samples with flare
+             angles a, b is kept only if the lower bound (a + b - rate * span) / 2
+             is small enough, the satellite may be above minimum altitude and
+             it is not in shadow at both ends. Kept intervals are bisected
+             down to 30 s
+    peak     minimum of squared flare angle is found by parabolic
+             interpolation, flare start and end are times when the flare is
+             as bright as the magnitude limit
+
+    python -m skybber.flares [--tle satellites.tle] --lng LNG --lat LAT [--hours 24]
+"""
+
+import math
+import sys
+
+from .satellitepass import SatellitePassInfo, TimeAltAz
+from .satscan import DEFAULT_TLE, EARTH_MU, EARTH_RADIUS, EARTH_ROTATION, SatelliteCatalog
+from .utils import lazyImport
+
+ephem = lazyImport('ephem')
+
+FLARE_PREFIXES = ('IRIDIUM', )
+
+# panel normal from nadir, panels are tilted 40 deg from body axis
+PANEL_TILT = math.radians(50.0)
+PANEL_AZIMUTHS = (0.0, 120.0, 240.0)
+# brightness model: magnitude at zero flare angle and range, magnitudes per degree out of the solar disk
+PEAK_MAG = -8.0
+PEAK_RANGE = 800.0
+MAG_SLOPE = 3.5
+SUN_RADIUS = 0.27
+
+MAX_MAG = -1.0
+MIN_ALT = math.radians(10.0)
+SUN_MAX_ALT = 0.0
+
+WINDOW_MINUTES = 10
+# seconds of the finest interval, intervals of COARSE steps are sampled first
+STEP = 30.0
+COARSE = 4
+# km/s, speed of observer in inertial frame added to speed of satellite
+OBSERVER_SPEED = 0.47
+EARTH_FLATTENING = 1.0 / 298.257223563
+
+_PANELS = tuple((math.cos(PANEL_TILT), math.sin(PANEL_TILT) * math.cos(math.radians(az)),
+                 math.sin(PANEL_TILT) * math.sin(math.radians(az))) for az in PANEL_AZIMUTHS)
+
+
+def flareMag(angle, dist):
+    """ Return magnitude of flare of flare angle (radians) seen from range dist (km)
+    """
+    return PEAK_MAG + 5.0 * math.log10(dist / PEAK_RANGE) + MAG_SLOPE * max(0.0, math.degrees(angle) - SUN_RADIUS)
+
+
+def flareAngle(mag, dist):
+    """ Return largest flare angle (radians) of flare of magnitude mag seen from range dist (km)
+    """
+    return math.radians(SUN_RADIUS + max(0.0, (mag - PEAK_MAG - 5.0 * math.log10(dist / PEAK_RANGE)) / MAG_SLOPE))
+
+
+def _unit(alt, az):
+    cos_alt = math.cos(alt)
+    return (cos_alt * math.sin(az), cos_alt * math.cos(az), math.sin(alt))
+
+
+def _earthCenter(lat, elevation):
+    """ Return position of Earth center in east, north, up frame of observer in km
+    """
+    e2 = EARTH_FLATTENING * (2.0 - EARTH_FLATTENING)
+    sin_lat = math.sin(lat)
+    n = EARTH_RADIUS / math.sqrt(1.0 - e2 * sin_lat * sin_lat)
+    return (0.0, n * e2 * sin_lat * math.cos(lat), -(n + elevation / 1000.0 - n * e2 * sin_lat * sin_lat))
+
+
+class FlareInfo(SatellitePassInfo):
+    """ Flare shown as satellite pass: start, peak and end of the flare
+    """
+
+    MAG_METER = (-8.0, -1.0, 1.0)
+
+    def __init__(self, satid=None):
+        SatellitePassInfo.__init__(self, satid)
+        self.angle = None
+
+
+class FlareSearch(object):
+    """ Flares of catalog satellites seen by observer from observer.date during hours.
+        Positions are sampled on grid of STEP seconds and kept for the whole search
+    """
+
+    def __init__(self, catalog, observer, hours, max_mag=MAX_MAG):
+        self._catalog = catalog
+        self._max_mag = max_mag
+        self._start = float(observer.date)
+        self._site = ephem.Observer()
+        self._site.long, self._site.lat, self._site.elevation = observer.long, observer.lat, observer.elevation
+        # geometric altitudes
+        self._site.pressure = 0
+        self._lat = float(observer.lat)
+        self._center = _earthCenter(self._lat, observer.elevation)
+        self._site.date = self._start
+        self._lst = float(self._site.sidereal_time())
+        self.windows = int(hours * 60 / WINDOW_MINUTES)
+        sun = ephem.Sun()
+        self._suns = []
+        for w in range(self.windows + 1):
+            self._site.date = self.getWindowStart(w)
+            sun.compute(self._site)
+            self._suns.append((float(sun.alt), _unit(sun.alt, sun.az)))
+        # (satellite index, grid index): (sample, flare angles)
+        self._samples = {}
+        # grid index: (alt, unit vector) of sun
+        self._grid_suns = {}
+        self._orbits = {}
+
+    def getWindowStart(self, w):
+        return self._start + w * WINDOW_MINUTES / 1440.0
+
+    def isDark(self, w):
+        """ Return True if sun is below horizon at start or end of window w
+        """
+        return self._suns[w][0] <= SUN_MAX_ALT or self._suns[w + 1][0] <= SUN_MAX_ALT
+
+    def screen(self, w, indexes):
+        """ Return indexes of satellites which may be above horizon during window w
+        """
+        self._site.date = self.getWindowStart(w) + WINDOW_MINUTES / 2880.0
+        return self._catalog.screen(float(self._site.sidereal_time()), self._lat, float(self._site.date),
+                                    WINDOW_MINUTES, indexes)
+
+    def getSun(self, date):
+        """ Return (alt, unit vector) of sun interpolated between window boundaries
+        """
+        f = (date - self._start) * 1440.0 / WINDOW_MINUTES
+        w = min(max(int(f), 0), self.windows - 1)
+        (alt0, u0), (alt1, u1) = self._suns[w], self._suns[w + 1]
+        f -= w
+        u = (u0[0] + (u1[0] - u0[0]) * f, u0[1] + (u1[1] - u0[1]) * f, u0[2] + (u1[2] - u0[2]) * f)
+        norm = math.sqrt(u[0] * u[0] + u[1] * u[1] + u[2] * u[2])
+        return (alt0 + (alt1 - alt0) * f, (u[0] / norm, u[1] / norm, u[2] / norm))
+
+    def getPosition(self, satellite, date):
+        """ Return (position km in east, north, up frame, alt, range km, eclipsed, az)
+        """
+        self._site.date = date
+        satellite.compute(self._site)
+        alt, az, dist = satellite.alt, satellite.az, satellite.range / 1000.0
+        u = _unit(alt, az)
+        return ((dist * u[0], dist * u[1], dist * u[2]), float(alt), dist, satellite.eclipsed, float(az))
+
+    def getAngles(self, i, date, sample, sun=None):
+        """ Return flare angles of panels of satellite i of position sample at date, sun
+            is unit vector of sun at date
+        """
+        # normal of orbital plane in east, north, up frame
+        w = self._catalog.getPlane(i, date)
+        lst = self._lst + EARTH_ROTATION * (date - self._start)
+        sin_lst, cos_lst, sin_lat, cos_lat = math.sin(lst), math.cos(lst), math.sin(self._lat), math.cos(self._lat)
+        equator = cos_lst * w[0] + sin_lst * w[1]
+        plane = (cos_lst * w[1] - sin_lst * w[0], cos_lat * w[2] - sin_lat * equator, cos_lat * equator + sin_lat * w[2])
+
+        if sun is None:
+            sun = self.getSun(date)[1]
+        p, dist, center = sample[0], sample[2], self._center
+        g = (p[0] - center[0], p[1] - center[1], p[2] - center[2])
+        r = math.sqrt(g[0] * g[0] + g[1] * g[1] + g[2] * g[2])
+        z = (-g[0] / r, -g[1] / r, -g[2] / r)
+        # direction of motion perpendicular to nadir
+        x = (plane[1] * g[2] - plane[2] * g[1], plane[2] * g[0] - plane[0] * g[2], plane[0] * g[1] - plane[1] * g[0])
+        norm = math.sqrt(x[0] * x[0] + x[1] * x[1] + x[2] * x[2])
+        x = (x[0] / norm, x[1] / norm, x[2] / norm)
+        y = (z[1] * x[2] - z[2] * x[1], z[2] * x[0] - z[0] * x[2], z[0] * x[1] - z[1] * x[0])
+        o = (-p[0] / dist, -p[1] / dist, -p[2] / dist)
+        result = []
+        for cz, cx, cy in _PANELS:
+            normal = (cz * z[0] + cx * x[0] + cy * y[0], cz * z[1] + cx * x[1] + cy * y[1], cz * z[2] + cx * x[2] + cy * y[2])
+            ns = normal[0] * sun[0] + normal[1] * sun[1] + normal[2] * sun[2]
+            if ns <= 0.0:
+                # back side of panel
+                result.append(math.pi)
+                continue
+            cos_angle = ((2.0 * ns * normal[0] - sun[0]) * o[0] + (2.0 * ns * normal[1] - sun[1]) * o[1] +
+                         (2.0 * ns * normal[2] - sun[2]) * o[2])
+            result.append(math.acos(max(-1.0, min(1.0, cos_angle))))
+        return result
+
+    def _getOrbit(self, i):
+        """ Return (perigee altitude km, speed bound km/s, rate of panel rotation rad/s, flare angle limit)
+        """
+        orbit = self._orbits.get(i)
+        if orbit is None:
+            a, e, n = self._catalog.getOrbit(i)
+            perigee = max(100.0, a * (1.0 - e) - EARTH_RADIUS)
+            speed = math.sqrt(EARTH_MU / 86400.0 ** 2 / a * (1.0 + e) / (1.0 - e)) + OBSERVER_SPEED
+            orbit = self._orbits[i] = (perigee, speed, 2.0 * n / 86400.0, flareAngle(self._max_mag, perigee))
+        return orbit
+
+    def _getGridSun(self, k):
+        sun = self._grid_suns.get(k)
+        if sun is None:
+            sun = self._grid_suns[k] = self.getSun(self._start + k * STEP / 86400.0)
+        return sun
+
+    def _getSample(self, i, satellite, k, with_angles):
+        """ Return (sample, flare angles or None) of satellite i at grid index k
+        """
+        entry = self._samples.get((i, k))
+        if entry is None:
+            date = self._start + k * STEP / 86400.0
+            sample = self.getPosition(satellite, date)
+            entry = self._samples[(i, k)] = [sample, None]
+        if with_angles and entry[1] is None:
+            entry[1] = self.getAngles(i, self._start + k * STEP / 86400.0, entry[0], self._getGridSun(k)[1])
+        return entry
+
+    def _getPanels(self, i, satellite, a, b):
+        """ Return panels of satellite i which may flare between grid indexes a and b
+        """
+        sa, sb = self._getSample(i, satellite, a, False)[0], self._getSample(i, satellite, b, False)[0]
+        # satellite cannot leave and enter shadow again within COARSE steps
+        if sa[3] and sb[3]:
+            return ()
+        if self._getGridSun(a)[0] > SUN_MAX_ALT and self._getGridSun(b)[0] > SUN_MAX_ALT:
+            return ()
+        perigee, speed, spin, limit = self._getOrbit(i)
+        span = (b - a) * STEP
+        # closest approach within interval
+        dist = max(perigee, min(sa[2], sb[2]) - speed * span / 2.0)
+        if sa[1] + sb[1] + speed / dist * span < 2.0 * MIN_ALT:
+            return ()
+        bound = 2.0 * limit + (spin + speed / dist) * span
+        angles_a, angles_b = self._getSample(i, satellite, a, True)[1], self._getSample(i, satellite, b, True)[1]
+        return [panel for panel in range(len(_PANELS)) if angles_a[panel] + angles_b[panel] <= bound]
+
+    def searchWindow(self, i, satellite, w):
+        """ Return list of (panel, FlareInfo) of satellite i with peak in window w
+        """
+        steps = int(WINDOW_MINUTES * 60 / STEP)
+        first = w * steps
+        intervals = [(a, min(a + COARSE, first + steps)) for a in range(first, first + steps, COARSE)]
+        result = []
+        while intervals:
+            a, b = intervals.pop()
+            panels = self._getPanels(i, satellite, a, b)
+            if not panels:
+                continue
+            if b - a > 1:
+                middle = (a + b) // 2
+                intervals.extend(((a, middle), (middle, b)))
+                continue
+            for panel in panels:
+                info = self._getPeak(i, satellite, panel, self._start + a * STEP / 86400.0, self._start + b * STEP / 86400.0)
+                if info is not None:
+                    result.append((panel, info))
+        return result
+
+    def _getPeak(self, i, satellite, panel, t0, t1):
+        """ Return FlareInfo of flare of panel with peak in interval t0, t1 or None
+        """
+        def angle(date):
+            sample = self.getPosition(satellite, date)
+            return self.getAngles(i, date, sample)[panel], sample
+
+        middle = (t0 + t1) / 2.0
+        # coarse fit over the interval, fine fit of 2 s around the estimated peak
+        for h in ((t1 - t0) / 2.0, 2.0 / 86400.0):
+            y = [angle(middle + k * h)[0] ** 2 for k in (-1, 0, 1)]
+            curvature = y[0] - 2.0 * y[1] + y[2]
+            if curvature > 0.0:
+                middle += h * (y[0] - y[2]) / (2.0 * curvature)
+            else:
+                middle += h if y[2] < y[0] else -h
+            middle = min(max(middle, t0 - h), t1 + h)
+        if not t0 <= middle < t1:
+            # peak belongs to neighbouring interval
+            return None
+        flare_angle, sample = angle(middle)
+        dist = sample[2]
+        mag = flareMag(flare_angle, dist)
+        if mag > self._max_mag or sample[1] < MIN_ALT or sample[3] or self.getSun(middle)[0] > SUN_MAX_ALT:
+            return None
+
+        # squared flare angle is parabola around the peak
+        limit = flareAngle(self._max_mag, dist)
+        duration = STEP / 86400.0
+        if curvature > 0.0:
+            duration = min(duration, math.sqrt(max(0.0, limit * limit - flare_angle * flare_angle) / (curvature / (h * h))))
+        info = FlareInfo(satellite.name)
+        info.mag = '%.1f' % mag
+        info.angle = flare_angle
+        info.max = self._getPoint(middle, sample)
+        info.start = self._getPoint(middle - duration, self.getPosition(satellite, middle - duration))
+        info.end = self._getPoint(middle + duration, self.getPosition(satellite, middle + duration))
+        return info
+
+    @staticmethod
+    def _getPoint(date, sample):
+        point = TimeAltAz()
+        point.tm = ephem.Date(date)
+        point.alt = '%.0f' % math.degrees(sample[1])
+        point.az = '%.0f' % math.degrees(sample[4])
+        return point
+
+
+class FlarePredictor(object):
+    """ Flare search over satellites of SatelliteCatalog with name starting with one of prefixes
+    """
+
+    def __init__(self, catalog, prefixes=FLARE_PREFIXES, max_mag=MAX_MAG):
+        self._catalog = catalog
+        self._prefixes = tuple(prefixes)
+        self._max_mag = max_mag
+
+    def predict(self, observer, hours=24):
+        """ Return list of FlareInfo of flares brighter than max_mag from observer.date
+            during hours ordered by time of the peak
+        """
+        indexes = self._catalog.find(self._prefixes)
+        if not indexes:
+            return []
+        search = FlareSearch(self._catalog, observer, hours, self._max_mag)
+        satellites = {}
+        found = []
+        for w in range(search.windows):
+            if not search.isDark(w):
+                continue
+            for i in search.screen(w, indexes):
+                if i not in satellites:
+                    try:
+                        satellites[i] = self._catalog.getSatellite(i)
+                    except ValueError:
+                        satellites[i] = None
+                if satellites[i] is None:
+                    continue
+                try:
+                    found.extend((i, panel, info) for panel, info in search.searchWindow(i, satellites[i], w))
+                except RuntimeError:
+                    # decayed or invalid elements
+                    satellites[i] = None
+
+        # peak close to boundary of intervals may be found from both of them
+        found.sort(key=lambda flare: (flare[0], flare[1], flare[2].max.tm))
+        result = []
+        for k, (i, panel, info) in enumerate(found):
+            if k > 0 and found[k - 1][:2] == (i, panel) and (info.max.tm - found[k - 1][2].max.tm) * 86400.0 < STEP:
+                if info.angle < result[-1].angle:
+                    result[-1] = info
+                continue
+            result.append(info)
+        result.sort(key=lambda info: info.max.tm)
+        return result
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Predict flares of satellites of TLE catalog')
+    parser.add_argument('--tle', default=DEFAULT_TLE, help='TLE catalog file')
+    parser.add_argument('--lng', type=float, required=True, help='longitude of observer in degrees')
+    parser.add_argument('--lat', type=float, required=True, help='latitude of observer in degrees')
+    parser.add_argument('--hours', type=int, default=24, help='length of time span')
+    args = parser.parse_args(argv)
+
+    catalog = SatelliteCatalog(args.tle)
+    observer = ephem.Observer()
+    observer.long, observer.lat = math.radians(args.lng), math.radians(args.lat)
+    predictor = FlarePredictor(catalog)
+    print('Satellites: %d' % len(catalog.find(FLARE_PREFIXES)))
+    for info in predictor.predict(observer, args.hours):
+        print('%-24s %s  %5s  %3s / %3s' % (info.satid, ephem.localtime(info.max.tm).strftime('%Y-%m-%d %H:%M:%S'),
+                                            info.mag, info.max.alt, info.max.az))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
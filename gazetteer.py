@@ -0,0 +1,356 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Offline gazetteer of place names
+
+Places are read from GeoNames dump (tab separated, e.g. cities500.txt from
+download.geonames.org), lines starting with '#' are ignored. Name, ascii
+name and alternate names of each place are normalized (lower case, no
+accents, letters and digits only) and written to binary index file sorted
+by key. The index is memory mapped and searched by bisection, it is rebuilt
+when it is older than the dump. It is written next to the dump, or to user
+cache directory if the directory of the dump is not writable.
+
+Index layout (little endian):
+    header   magic, version, record count, offset of strings, offset and length of time zones,
+             offset and count of zone grid cells
+    records  RECORD_FORMAT sorted by (key, -population)
+    strings  utf-8 keys and names, time zone names separated by newline
+    zones    GRID_FORMAT sorted by cell, time zone of most populated place of 1x1 degree cell
+
+    python -m skybber.gazetteer [--tsv gazetteer.tsv] [--index FILE] [name] [--prefix]
+"""
+
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import unicodedata
+
+from .utils import cachePath
+
+DEFAULT_TSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.tsv')
+INDEX_SUFFIX = '.idx'
+
+MAGIC = b'SKGZ'
+VERSION = 3
+HEADER_FORMAT = '<4sIIIIIII'
+# key offset, key length, name offset, name length, time zone, lat, long, population
+RECORD_FORMAT = '<IHIHHffI'
+# cell, time zone
+GRID_FORMAT = '<IH'
+
+_HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+_RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+_GRID_SIZE = struct.calcsize(GRID_FORMAT)
+# offset of name offset in record
+_NAME_OFFSET = struct.calcsize('<IH')
+
+# columns of GeoNames dump
+_COL_NAME, _COL_ASCIINAME, _COL_ALTERNATENAMES, _COL_LAT, _COL_LNG, _COL_POPULATION, _COL_TIMEZONE = \
+    1, 2, 3, 4, 5, 14, 17
+
+
+def _gridCell(lng, lat):
+    return (min(int(math.floor(lat)), 89) + 90) * 360 + (int(math.floor(lng)) + 180) % 360
+
+
+def normalize(name):
+    """ Return search key of place name
+    """
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    return ''.join(ch for ch in decomposed if ch.isalnum() and not unicodedata.combining(ch))
+
+
+class Place(object):
+    """ Place found in gazetteer
+    """
+
+    def __init__(self, name, lng, lat, population, time_zone):
+        self._name = name
+        self._lng = lng
+        self._lat = lat
+        self._population = population
+        self._time_zone = time_zone
+
+    def getName(self):
+        return self._name
+
+    def getLng(self):
+        """ Return longitude in degrees
+        """
+        return self._lng
+
+    def getLat(self):
+        """ Return latitude in degrees
+        """
+        return self._lat
+
+    def getPopulation(self):
+        return self._population
+
+    def getTimeZone(self):
+        """ Return name of time zone or None
+        """
+        return self._time_zone
+
+    def getInfo(self):
+        return self.getName() + ' [ ' + "%0.5f" % self.getLng() + ', ' + "%0.5f" % self.getLat() + ' ]'
+
+
+def _readPlaces(stream):
+    """ Yield (name, ascii name, alternate names, lng, lat, population, time zone)
+        of GeoNames dump lines
+    """
+    for line in stream:
+        if not line.strip() or line.startswith('#'):
+            continue
+        cols = line.rstrip('\n').split('\t')
+        if len(cols) <= _COL_TIMEZONE:
+            continue
+        try:
+            lat, lng = float(cols[_COL_LAT]), float(cols[_COL_LNG])
+        except ValueError:
+            continue
+        try:
+            population = int(cols[_COL_POPULATION] or 0)
+        except ValueError:
+            population = 0
+        alternatenames = cols[_COL_ALTERNATENAMES].split(',') if cols[_COL_ALTERNATENAMES] else []
+        yield cols[_COL_NAME], cols[_COL_ASCIINAME], alternatenames, lng, lat, population, cols[_COL_TIMEZONE] or None
+
+
+def buildIndex(tsv_path, index_path):
+    """ Build index file of GeoNames dump, return number of indexed keys
+    """
+    time_zones = {}
+    names = []
+    entries = []
+    grid = {}
+    with open(tsv_path, encoding='utf-8') as f:
+        for name, asciiname, alternatenames, lng, lat, population, time_zone in _readPlaces(f):
+            tz = time_zones.setdefault(time_zone, len(time_zones)) if time_zone is not None else 0xFFFF
+            if tz != 0xFFFF:
+                cell = _gridCell(lng, lat)
+                if cell not in grid or grid[cell][0] < population:
+                    grid[cell] = (population, tz)
+            name_index = len(names)
+            names.append(name.encode('utf-8'))
+            for key in set(normalize(key_name) for key_name in [name, asciiname] + alternatenames):
+                if key:
+                    entries.append((key.encode('utf-8'), -population, name_index, tz, lat, lng))
+    entries.sort()
+
+    # offsets in records are absolute in file
+    strings_offset = _HEADER_SIZE + _RECORD_SIZE * len(entries)
+    strings = bytearray()
+    name_offsets = []
+    for name in names:
+        name_offsets.append(strings_offset + len(strings))
+        strings += name
+    records = bytearray(_RECORD_SIZE * len(entries))
+    for i, (key, neg_population, name_index, tz, lat, lng) in enumerate(entries):
+        key_offset = strings_offset + len(strings)
+        strings += key
+        struct.pack_into(RECORD_FORMAT, records, i * _RECORD_SIZE, key_offset, len(key),
+                         name_offsets[name_index], len(names[name_index]), tz, lat, lng, -neg_population)
+    tz_blob = '\n'.join(sorted(time_zones, key=time_zones.get)).encode('utf-8')
+    zones = bytearray()
+    for cell in sorted(grid):
+        zones += struct.pack(GRID_FORMAT, cell, grid[cell][1])
+
+    tz_offset = strings_offset + len(strings)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(entries), strings_offset,
+                            tz_offset, len(tz_blob), tz_offset + len(tz_blob), len(grid)))
+        f.write(records)
+        f.write(strings)
+        f.write(tz_blob)
+        f.write(zones)
+    os.replace(tmp_path, index_path)
+    return len(entries)
+
+
+class Gazetteer(object):
+    """ Lookup of places by exact name or name prefix in memory mapped index.
+
+    Index is opened (and built if it is stale) on first lookup. Without index
+    path it is next to the dump or in user cache directory.
+    """
+
+    def __init__(self, tsv_path=DEFAULT_TSV, index_path=None):
+        self._tsv_path = tsv_path
+        self._index_path = index_path
+        self._lock = threading.Lock()
+        self._mm = None
+        self._count = 0
+        self._time_zones = None
+        self._grid_offset = 0
+        self._grid_count = 0
+
+    def _isStale(self):
+        if not os.path.exists(self._index_path):
+            return True
+        if os.path.getmtime(self._index_path) < os.path.getmtime(self._tsv_path):
+            return True
+        with open(self._index_path, 'rb') as f:
+            header = f.read(_HEADER_SIZE)
+        return len(header) < _HEADER_SIZE or struct.unpack(HEADER_FORMAT, header)[:2] != (MAGIC, VERSION)
+
+    def open(self):
+        """ Map index into memory, build it first if it is stale
+        """
+        if self._mm is not None:
+            return
+        with self._lock:
+            if self._mm is not None:
+                return
+            if self._index_path is None:
+                self._index_path = cachePath(self._tsv_path + INDEX_SUFFIX)
+            if self._isStale():
+                buildIndex(self._tsv_path, self._index_path)
+            with open(self._index_path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _, _, count, _, tz_offset, tz_length, self._grid_offset, self._grid_count = \
+                struct.unpack_from(HEADER_FORMAT, mm, 0)
+            tz_blob = mm[tz_offset:tz_offset + tz_length].decode('utf-8')
+            self._time_zones = tz_blob.split('\n') if tz_blob else []
+            self._count = count
+            self._mm = mm
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+
+    def __len__(self):
+        self.open()
+        return self._count
+
+    def _key(self, i):
+        key_offset, key_length = struct.unpack_from('<IH', self._mm, _HEADER_SIZE + i * _RECORD_SIZE)
+        return self._mm[key_offset:key_offset + key_length]
+
+    def _place(self, i):
+        _, _, name_offset, name_length, tz, lat, lng, population = \
+            struct.unpack_from(RECORD_FORMAT, self._mm, _HEADER_SIZE + i * _RECORD_SIZE)
+        return Place(self._mm[name_offset:name_offset + name_length].decode('utf-8'),
+                     lng, lat, population, self._time_zones[tz] if tz != 0xFFFF else None)
+
+    def _lowerBound(self, key):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, name):
+        """ Return most populated place of name or None
+        """
+        key = normalize(name).encode('utf-8')
+        if not key:
+            return None
+        self.open()
+        i = self._lowerBound(key)
+        if i < self._count and self._key(i) == key:
+            return self._place(i)
+        return None
+
+    def findPrefix(self, prefix, limit=10):
+        """ Return list of at most limit places whose name starts with prefix ordered by name
+        """
+        key = normalize(prefix).encode('utf-8')
+        if not key:
+            return []
+        self.open()
+        result = []
+        # place matching several of its names is listed once
+        seen = set()
+        i = self._lowerBound(key)
+        while i < self._count and len(result) < limit and self._key(i).startswith(key):
+            name_offset = struct.unpack_from('<I', self._mm, _HEADER_SIZE + i * _RECORD_SIZE + _NAME_OFFSET)[0]
+            if name_offset not in seen:
+                seen.add(name_offset)
+                result.append(self._place(i))
+            i += 1
+        return result
+
+    def _gridZone(self, cell):
+        lo, hi = 0, self._grid_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_cell, tz = struct.unpack_from(GRID_FORMAT, self._mm, self._grid_offset + mid * _GRID_SIZE)
+            if mid_cell == cell:
+                return tz
+            if mid_cell < cell:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def findZone(self, lng, lat):
+        """ Return time zone of most populated place in 1x1 degree cell of position,
+            or in nearest neighbouring cell, or None
+        """
+        self.open()
+        tz = self._gridZone(_gridCell(lng, lat))
+        if tz is None:
+            cos_lat = math.cos(math.radians(lat))
+            best = None
+            for dlat in (-1, 0, 1):
+                for dlng in (-1, 0, 1):
+                    cell_lat = math.floor(lat) + dlat
+                    if (dlat or dlng) and -90 <= cell_lat < 90:
+                        cell_tz = self._gridZone(_gridCell(lng + dlng, cell_lat))
+                        if cell_tz is not None:
+                            distance = (cell_lat + 0.5 - lat) ** 2 + ((math.floor(lng) + dlng + 0.5 - lng) * cos_lat) ** 2
+                            if best is None or distance < best[0]:
+                                best = (distance, cell_tz)
+            tz = best[1] if best is not None else None
+        return self._time_zones[tz] if tz is not None else None
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build and search skybber gazetteer index')
+    parser.add_argument('--tsv', default=DEFAULT_TSV, help='GeoNames dump')
+    parser.add_argument('--index', help='index file, default is next to dump or in user cache directory')
+    parser.add_argument('--prefix', action='store_true', help='search by name prefix')
+    parser.add_argument('name', nargs='?', help='name of place')
+    args = parser.parse_args(argv)
+
+    gazetteer = Gazetteer(args.tsv, args.index)
+    print('Indexed names: %d' % len(gazetteer))
+    if args.name:
+        places = gazetteer.findPrefix(args.name) if args.prefix else [p for p in (gazetteer.find(args.name),) if p]
+        for place in places:
+            print('%s  %s' % (place.getInfo(), place.getTimeZone() or ''))
+        return 0 if places else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
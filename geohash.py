@@ -0,0 +1,124 @@
+""" Geohash encoding and covering of circles by geohash cells
+"""
+
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = dict((ch, i) for i, ch in enumerate(BASE32))
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+# cell bits are interleaved in 64 bit words
+MAX_PRECISION = 12
+
+def _spread(x):
+    """ Move bits 0..31 of x to even bit positions
+    """
+    x &= 0xFFFFFFFF
+    x = (x | (x << 16)) & 0x0000FFFF0000FFFF
+    x = (x | (x << 8)) & 0x00FF00FF00FF00FF
+    x = (x | (x << 4)) & 0x0F0F0F0F0F0F0F0F
+    x = (x | (x << 2)) & 0x3333333333333333
+    return (x | (x << 1)) & 0x5555555555555555
+
+def _compact(x):
+    """ Inverse of _spread, collect even bits of x
+    """
+    x &= 0x5555555555555555
+    x = (x | (x >> 1)) & 0x3333333333333333
+    x = (x | (x >> 2)) & 0x0F0F0F0F0F0F0F0F
+    x = (x | (x >> 4)) & 0x00FF00FF00FF00FF
+    x = (x | (x >> 8)) & 0x0000FFFF0000FFFF
+    return (x | (x >> 16)) & 0xFFFFFFFF
+
+def _bits(precision):
+    """ Return (lat bits, lng bits) of cell of precision, longitude takes first bit
+    """
+    bits = 5 * precision
+    return (bits // 2, (bits + 1) // 2)
+
+def encode(lat, lng, precision):
+    """ Return geohash of precision (at most MAX_PRECISION) characters of point lat, lng (degrees)
+    """
+    lat_bits, lng_bits = _bits(precision)
+    lat_i = min(int((lat + 90.0) * (1 << lat_bits) / 180.0), (1 << lat_bits) - 1)
+    lng_i = min(int((lng + 180.0) * (1 << lng_bits) / 360.0), (1 << lng_bits) - 1)
+    if lat_bits == lng_bits:
+        code = (_spread(lng_i) << 1) | _spread(lat_i)
+    else:
+        code = _spread(lng_i) | (_spread(lat_i) << 1)
+    return ''.join([BASE32[(code >> shift) & 31] for shift in range(5 * (precision - 1), -1, -5)])
+
+def decode(cell):
+    """ Return (lat, lng) of center of cell
+    """
+    code = 0
+    for ch in cell:
+        code = (code << 5) | _DECODE[ch]
+    lat_bits, lng_bits = _bits(len(cell))
+    if lat_bits == lng_bits:
+        lat_i, lng_i = _compact(code), _compact(code >> 1)
+    else:
+        lat_i, lng_i = _compact(code >> 1), _compact(code)
+    return ((lat_i + 0.5) * 180.0 / (1 << lat_bits) - 90.0,
+            (lng_i + 0.5) * 360.0 / (1 << lng_bits) - 180.0)
+
+def cellSize(precision):
+    """ Return (height, width) of cell of precision in degrees
+    """
+    lat_bits, lng_bits = _bits(precision)
+    return (180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits))
+
+def prefixRange(prefix):
+    """ Return (low, high) bounds of cells starting with prefix, for 'cell >= low AND cell < high'
+    """
+    return (prefix, prefix + '~')
+
+def distanceKm(lat1, lng1, lat2, lng2):
+    """ Great circle distance of two points in km
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2.0) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def _steps(lo, hi, step):
+    result = []
+    value = lo
+    while value < hi:
+        result.append(value)
+        value += step
+    result.append(hi)
+    return result
+
+def coveringCells(lat, lng, radius_km, max_precision, max_cells=16):
+    """ Return set of cell prefixes covering circle of radius_km around lat, lng.
+
+    The longest prefixes (at most max_precision) are chosen so that no more than max_cells
+    prefixes are needed.
+    """
+    dlat = radius_km / KM_PER_DEG_LAT
+    lat_lo, lat_hi = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    cos_lat = min(math.cos(math.radians(lat_lo)), math.cos(math.radians(lat_hi)))
+    if cos_lat <= 0.0 or dlat / cos_lat >= 180.0:
+        lng_lo, lng_hi = -180.0, 180.0
+    else:
+        dlng = dlat / cos_lat
+        lng_lo, lng_hi = lng - dlng, lng + dlng
+
+    for precision in range(max_precision, 0, -1):
+        height, width = cellSize(precision)
+        rows = int((lat_hi - lat_lo) / height) + 2
+        cols = int((lng_hi - lng_lo) / width) + 2
+        if rows * cols <= max_cells or precision == 1:
+            break
+
+    cells = set()
+    for cell_lat in _steps(lat_lo, lat_hi, height):
+        for cell_lng in _steps(lng_lo, lng_hi, width):
+            # normalize longitude crossing antimeridian
+            cell_lng = (cell_lng + 180.0) % 360.0 - 180.0
+            cells.add(encode(cell_lat, cell_lng, precision))
+    return cells
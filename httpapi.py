@@ -0,0 +1,271 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Local HTTP/JSON API of the bot
+
+Commands of SkybberBot.REQUEST_COMMANDS are served as GET /<command> with
+query parameters lng and lat (degrees) or place, and date (YYYY-MM-DD):
+
+    GET /night?lng=14.42&lat=50.09&date=2024-03-01
+    GET /tw?place=prague&all=1
+    GET /overhead?lng=14.42&lat=50.09&minutes=30
+    GET /satpass?lng=14.42&lat=50.09&ids=25544,20580
+
+Reply is JSON of Reply.toJson, error is {"error": message} with status 400
+or 404. Requests are computed by SkybberBot.executeRequest in a pool of
+worker threads, so they share engines and response cache with chat commands.
+Connections are kept alive; asyncio loop runs in its own thread.
+
+    python -m skybber.httpapi --port 8080
+"""
+
+import asyncio
+import http
+import json
+import logging
+import sys
+import threading
+import urllib.parse
+
+from .commandrequest import CmdError, CommandRequest
+from .utils import lazyImport
+
+futures = lazyImport('concurrent.futures')
+
+
+class HttpApi(object):
+    """ asyncio HTTP/1.1 server of JSON replies of bot commands
+    """
+
+    CONCURRENCY = 8
+    MAX_CONNECTIONS = 1024
+    MAX_HEADER_BYTES = 8192
+    KEEPALIVE_TIMEOUT = 15.0
+    FLUSH_INTERVAL = 10.0
+    # requests are anonymous, they have no user context in db
+    JID = None
+
+    def __init__(self, bot, host='127.0.0.1', port=8080, concurrency=CONCURRENCY):
+        self._bot = bot
+        self._host = host
+        self._port = port
+        self._concurrency = concurrency
+        self._executor = None
+        self._loop = None
+        self._server = None
+        self._thread = None
+        # writers of open connections
+        self._writers = set()
+
+    def getPort(self):
+        """ Return listening port, it is chosen by system if port 0 was requested
+        """
+        return self._server.sockets[0].getsockname()[1] if self._server is not None else self._port
+
+    def start(self):
+        """ Start server in background thread, return when it listens
+        """
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self.serve, args=(ready, ), name='httpapi')
+        self._thread.daemon = True
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        """ Stop server started by start
+        """
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def serve(self, ready=None):
+        """ Serve requests in current thread until stop
+        """
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._executor = futures.ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix='httpapi')
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handleConnection, self._host, self._port, limit=self.MAX_HEADER_BYTES))
+            logging.info('HTTP API listening on %s:%d', self._host, self.getPort())
+        except OSError as e:
+            logging.error('HTTP API cannot listen on %s:%s: %s', self._host, self._port, e)
+            self._loop.close()
+            self._executor.shutdown(wait=False)
+            if ready is not None:
+                ready.set()
+            return
+        if ready is not None:
+            ready.set()
+        self._loop.call_later(self.FLUSH_INTERVAL, self._flush)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            # handlers of closed connections finish on end of stream
+            for writer in list(self._writers):
+                writer.close()
+            self._loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(self._loop), return_exceptions=True))
+            self._loop.close()
+            self._executor.shutdown(wait=False)
+
+    def _flush(self):
+        """ Write stored ephemerides by worker thread, there is no idle_proc without xmpp
+        """
+        self._loop.run_in_executor(self._executor, self._bot.flushEphemeris)
+        self._loop.call_later(self.FLUSH_INTERVAL, self._flush)
+
+    async def _handleConnection(self, reader, writer):
+        """ Serve requests of keep-alive connection
+        """
+        self._writers.add(writer)
+        try:
+            if len(self._writers) > self.MAX_CONNECTIONS:
+                self._writeResponse(writer, 503, {'error': 'Too many connections.'}, False)
+                await writer.drain()
+                return
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    self._writeResponse(writer, 431, {'error': 'Request header too large.'}, False)
+                    break
+                try:
+                    method, target, version, headers = self._parseHead(head)
+                except ValueError:
+                    self._writeResponse(writer, 400, {'error': 'Invalid request.'}, False)
+                    break
+                length = headers.get('content-length', '0')
+                if length != '0':
+                    if not length.isdigit() or int(length) > self.MAX_HEADER_BYTES:
+                        self._writeResponse(writer, 413, {'error': 'Request body not expected.'}, False)
+                        break
+                    await reader.readexactly(int(length))
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                status, result = await self._handleRequest(method, target)
+                self._writeResponse(writer, status, result, keep_alive, method == 'HEAD')
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _parseHead(head):
+        """ Return (method, target, version, {lower case name: value}) of request head
+        """
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+        if not version.startswith('HTTP/1.'):
+            raise ValueError(version)
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    async def _handleRequest(self, method, target):
+        """ Return (status, JSON text or dict) of request
+        """
+        if method not in ('GET', 'HEAD'):
+            return 405, {'error': 'Method not allowed.'}
+        url = urllib.parse.urlsplit(target)
+        cmd = url.path.strip('/')
+        if cmd == '':
+            return 200, {'commands': sorted(self._bot.REQUEST_COMMANDS)}
+        if cmd not in self._bot.REQUEST_COMMANDS:
+            return 404, {'error': 'Unknown command: ' + cmd}
+        params = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        try:
+            request = CommandRequest.fromParams(self.JID, params, self._requestFlags(cmd, params))
+            reply = await self._loop.run_in_executor(self._executor, self._execute, cmd, request)
+        except CmdError as e:
+            return 400, {'error': e.value}
+        except Exception:
+            logging.exception('HTTP API request failed: %s', target)
+            return 500, {'error': 'Internal error.'}
+        return 200, reply
+
+    @staticmethod
+    def _requestFlags(cmd, params):
+        """ Return flags of command from query parameters, they match command options of chat
+        """
+        if cmd == 'tw':
+            return 'all' if params.get('all', '0').lower() in ('1', 'true', 'yes') else ''
+        if cmd == 'overhead':
+            minutes = params.get('minutes', '')
+            if minutes and not minutes.isdigit():
+                raise CmdError('Invalid minutes: ' + minutes)
+            return minutes
+        if cmd == 'satpass':
+            return params.get('ids', '')
+        return ''
+
+    def _execute(self, cmd, request):
+        """ Return JSON text of reply, it is called by worker thread
+        """
+        reply = self._bot.executeRequest(cmd, request)
+        if isinstance(reply, str):
+            return json.dumps({'reply': 'message', 'text': reply}, ensure_ascii=False)
+        return reply.toJson()
+
+    @staticmethod
+    def _writeResponse(writer, status, result, keep_alive, head_only=False):
+        body = (result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)).encode('utf-8')
+        writer.write(('HTTP/1.1 %d %s\r\n'
+                      'Content-Type: application/json; charset=utf-8\r\n'
+                      'Content-Length: %d\r\n'
+                      'Connection: %s\r\n\r\n' % (status, http.HTTPStatus(status).phrase, len(body),
+                                                  'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+        if not head_only:
+            writer.write(body)
+
+
+def main(argv=None):
+    import argparse
+    from .skybberbot import SkybberBot, MasterDBConnection
+
+    parser = argparse.ArgumentParser(description='Serve HTTP/JSON API of skybber commands without xmpp connection')
+    parser.add_argument('--host', default='127.0.0.1', help='listening address')
+    parser.add_argument('--port', type=int, default=8080, help='listening port')
+    parser.add_argument('--concurrency', type=int, default=HttpApi.CONCURRENCY, help='number of worker threads')
+    parser.add_argument('--db', default=MasterDBConnection.SKYBBER_DB, help='skybber database')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    MasterDBConnection.SKYBBER_DB = args.db
+    bot = SkybberBot('skybber@localhost', '')
+    try:
+        HttpApi(bot, args.host, args.port, args.concurrency).serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bot.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -30,6 +30,7 @@ bot's operation completely. MUCs are also supported.
 
 import os
 import re
+import signal
 import sys
 import threading
 
@@ -43,11 +44,12 @@ except ImportError:
     sys.exit(-1)
 
 import time
-import inspect
 import logging
 import traceback
 import logging
 
+from .profiler import CommandProfiler
+
 # Will be parsed by setup.py to determine package metadata
 __author__ = 'Thomas Perl <m@thp.io>'
 __version__ = '0.16'
@@ -55,6 +57,24 @@ __website__ = 'http://thp.io/2007/python-jabberbot/'
 __license__ = 'GNU General Public License version 3 or later'
 
 
+def _collect_commands(cls):
+    """Return mapping of command name to method name of class cls.
+
+    Registries of base classes are inherited, a method overridden
+    without @botcmd is no longer a command."""
+    commands = {}
+    for base in reversed(cls.__bases__):
+        commands.update(getattr(base, '_jabberbot_commands', {}))
+    for name, command in list(commands.items()):
+        if command in cls.__dict__ and not getattr(cls.__dict__[command],
+                '_jabberbot_command', False):
+            del commands[name]
+    for attr, value in cls.__dict__.items():
+        if getattr(value, '_jabberbot_command', False):
+            commands[getattr(value, '_jabberbot_command_name')] = attr
+    return commands
+
+
 def botcmd(*args, **kwargs):
     """Decorator for bot command functions"""
 
@@ -92,6 +112,12 @@ class JabberBot(object):
 
     PING_FREQUENCY = 0  # Set to the number of seconds, e.g. 60.
     PING_TIMEOUT = 2  # Seconds to wait for a response.
+    PRESENCE_BATCH_WINDOW = 5  # Seconds of batching presences after login.
+
+    def __init_subclass__(cls, **kwargs):
+        """Build registry of @botcmd methods once per class"""
+        super(JabberBot, cls).__init_subclass__(**kwargs)
+        cls._jabberbot_commands = _collect_commands(cls)
 
     def __init__(self, username, password, res=None, debug=False,
             privatedomain=False, acceptownmsgs=False, handlers=None,
@@ -143,6 +169,8 @@ class JabberBot(object):
         self.__show = None
         self.__status = None
         self.__seen = {}
+        self.__presence_batch = None
+        self.__presence_batch_until = 0
         self.__threads = {}
         self.__lastping = time.time()
         self.__privatedomain = privatedomain
@@ -152,15 +180,15 @@ class JabberBot(object):
         self.handlers = (handlers or [('message', self.callback_message),
                     ('presence', self.callback_presence)])
 
-        # Collect commands from source
+        # Bind commands from class registry
         self.commands = {}
-        for name, value in inspect.getmembers(self, inspect.ismethod):
-            if getattr(value, '_jabberbot_command', False):
-                name = getattr(value, '_jabberbot_command_name')
-                logging.info('Registered command: %s' % name)
-                self.commands[self.__command_prefix + name] = value
+        for name, attr in self._jabberbot_commands.items():
+            self.commands[self.__command_prefix + name] = getattr(self, attr)
+        logging.info('Registered commands: %s', ', '.join(sorted(self.commands)))
 
         self.roster = None
+        self.profiler = None
+        self._dump_signal = None
 
 ################################
 
@@ -232,23 +260,59 @@ class JabberBot(object):
 
             # Connection established - save connection
             self.conn = conn
-
-            # Register given handlers (TODO move to own function)
-            for (handler, callback) in self.handlers:
-                self.conn.RegisterHandler(handler, callback)
-                logging.debug('Registered handler: %s' % handler)
-
-            # Send initial presence stanza (say hello to everyone)
-            self.conn.sendInitPresence()
-            # Save roster and log Items
-            self.roster = self.conn.Roster.getRoster()
-            logging.info('*** roster ***')
-            for contact in self.roster.getItems():
-                logging.info('  %s' % contact)
-            logging.info('*** roster ***')
+            self._init_session()
 
         return self.conn
 
+    def _init_session(self):
+        """Registers handlers, sends initial presence and loads roster
+        of the just established connection.
+
+        Presences of the login storm are collected in a batch and
+        applied at once, see _flush_presence_batch."""
+        for (handler, callback) in self.handlers:
+            self.conn.RegisterHandler(handler, callback)
+            logging.debug('Registered handler: %s', handler)
+
+        self.__presence_batch = {}
+        self.__presence_batch_until = time.time() + \
+            self.PRESENCE_BATCH_WINDOW
+
+        # Send initial presence stanza (say hello to everyone)
+        self.conn.sendInitPresence()
+        # Save roster and log Items
+        self.roster = self.conn.Roster.getRoster()
+        contacts = self.roster.getItems()
+        logging.info('*** roster: %d contacts ***', len(contacts))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for contact in contacts:
+                logging.debug('  %s', contact)
+
+    def _flush_presence_batch(self):
+        """Apply presences collected since login to the seen users"""
+        batch, self.__presence_batch = self.__presence_batch, None
+        if not batch:
+            return
+        available = {}
+        offline = []
+        for jid, state in batch.items():
+            old_show, old_status = self.__seen.get(jid, (self.OFFLINE, None))
+            if state is None:
+                if jid in self.__seen:
+                    offline.append(jid)
+                    self.status_type_changed(jid, self.OFFLINE)
+                continue
+            show, status = state
+            if old_show != show:
+                self.status_type_changed(jid, show)
+            if old_status != status:
+                self.status_message_changed(jid, status)
+            available[jid] = state
+        self.__seen.update(available)
+        for jid in offline:
+            del self.__seen[jid]
+        logging.info('Applied %d batched presences', len(batch))
+
 ### XEP-0045 Multi User Chat # prefix: muc # START ###
 
     def muc_join_room(self, room, username=None, password=None, prefix=""):
@@ -428,14 +492,14 @@ class JabberBot(object):
 
         self.send_message(mess)
 
-    def send_simple_reply(self, mess, text, private=False):
+    def send_simple_reply(self, mess, text, private=False, xhtml=None):
         """Send a simple response to a message"""
-        self.send_message(self.build_reply(mess, text, private))
+        self.send_message(self.build_reply(mess, text, private, xhtml))
 
-    def build_reply(self, mess, text=None, private=False):
+    def build_reply(self, mess, text=None, private=False, xhtml=None):
         """Build a message for responding to another message.
         Message is NOT sent"""
-        response = self.build_message(text)
+        response = self.build_message(text, xhtml)
         if private:
             response.setTo(mess.getFrom())
             response.setType('chat')
@@ -445,33 +509,35 @@ class JabberBot(object):
         response.setThread(mess.getThread())
         return response
 
-    def build_message(self, text):
+    def build_message(self, text, xhtml=None):
         """Builds an xhtml message without attributes.
+        If xhtml is given, text is the body for recipients without
+        xhtml-im, otherwise xhtml tags are detected in text.
         If input is not valid xhtml-im fallback to normal."""
-        message = None  # init message variable
-        # Try to determine if text has xhtml-tags - TODO needs improvement
-        text_plain = re.sub(r'<[^>]+>', '', text)
-        if text_plain != text:
-            # Create body w stripped tags for reciptiens w/o xhtml-abilities
-            # FIXME unescape &quot; etc.
-            message = xmpp.protocol.Message(body=text_plain)
+        body = text
+        if xhtml is None:
+            # Try to determine if text has xhtml-tags - TODO needs improvement
+            text_plain = re.sub(r'<[^>]+>', '', text)
+            if text_plain != text:
+                # Create body w stripped tags for reciptiens w/o xhtml-abilities
+                # FIXME unescape &quot; etc.
+                xhtml, body = text, text_plain
+        message = xmpp.protocol.Message(body=body)
+        if xhtml is not None:
             # Start creating a xhtml body
             html = xmpp.Node('html', \
                 {'xmlns': 'http://jabber.org/protocol/xhtml-im'})
             try:
                 html.addChild(node=xmpp.simplexml.XML2Node( \
                     "<body xmlns='http://www.w3.org/1999/xhtml'>" + \
-                    text.encode('utf-8') + "</body>"))
+                    xhtml + "</body>"))
                 message.addChild(node=html)
             except Exception as e:
                 # Didn't work, incorrect markup or something.
                 logging.debug('An error while building a xhtml message. '\
                 'Fallback to normal messagebody')
                 # Fallback - don't sanitize invalid input. User is responsible!
-                message = None
-        if message is None:
-            # Normal body
-            message = xmpp.protocol.Message(body=text)
+                message = xmpp.protocol.Message(body=text)
         return message
 
     def get_sender_username(self, mess):
@@ -498,18 +564,19 @@ class JabberBot(object):
 
     def status_type_changed(self, jid, new_status_type):
         """Callback for tracking status types (dnd, away, offline, ...)"""
-        logging.debug('user %s changed status to %s' % (jid, new_status_type))
+        logging.debug('user %s changed status to %s', jid, new_status_type)
 
     def status_message_changed(self, jid, new_status_message):
         """Callback for tracking status messages (the free-form status text)"""
-        logging.debug('user %s updated text to %s' %
-            (jid, new_status_message))
+        logging.debug('user %s updated text to %s', jid, new_status_message)
 
     def broadcast(self, message, only_available=False):
         """Broadcast a message to all users 'seen' by this bot.
 
         If the parameter 'only_available' is True, the broadcast
         will not go to users whose status is not 'Available'."""
+        if self.__presence_batch is not None:
+            self._flush_presence_batch()
         for jid, (show, status) in self.__seen.items():
             if not only_available or show is self.AVAILABLE:
                 self.send(jid, message)
@@ -531,20 +598,34 @@ class JabberBot(object):
                 # Ignore our own presence messages
                 return
 
-        if type_ is None:
-            # Keep track of status message and type changes
-            old_show, old_status = self.__seen.get(jid, (self.OFFLINE, None))
-            if old_show != show:
-                self.status_type_changed(jid, show)
-
-            if old_status != status:
-                self.status_message_changed(jid, status)
+        if type_ is None or type_ == self.OFFLINE:
+            if self.__presence_batch is not None:
+                # Login storm, collect the last state of each jid
+                self.__presence_batch[jid] = \
+                    None if type_ == self.OFFLINE else (show, status)
+                return
+            if type_ is None:
+                # Keep track of status message and type changes
+                old_show, old_status = self.__seen.get(jid,
+                    (self.OFFLINE, None))
+                if old_show != show:
+                    self.status_type_changed(jid, show)
+
+                if old_status != status:
+                    self.status_message_changed(jid, status)
+
+                self.__seen[jid] = (show, status)
+            elif jid in self.__seen:
+                # Notify of user offline status change
+                del self.__seen[jid]
+                self.status_type_changed(jid, self.OFFLINE)
+            logging.debug('Got presence: %s (type: %s, show: %s, '\
+                'status: %s)', jid, type_, show, status)
+            # Availability changes need no subscription handling
+            return
 
-            self.__seen[jid] = (show, status)
-        elif type_ == self.OFFLINE and jid in self.__seen:
-            # Notify of user offline status change
-            del self.__seen[jid]
-            self.status_type_changed(jid, self.OFFLINE)
+        if type_ == 'error':
+            logging.error(presence.getError())
 
         try:
             subscription = self.roster.getSubscription(jid.__str__())
@@ -555,11 +636,8 @@ class JabberBot(object):
             # Recieved presence update before roster built
             return
 
-        if type_ == 'error':
-            logging.error(presence.getError())
-
         logging.debug('Got presence: %s (type: %s, show: %s, status: %s, '\
-            'subscription: %s)' % (jid, type_, show, status, subscription))
+            'subscription: %s)', jid, type_, show, status, subscription)
 
         # If subscription is private,
         # disregard anything not from the private domain
@@ -605,15 +683,14 @@ class JabberBot(object):
         # Prepare to handle either private chats or group chats
         type = mess.getType()
         jid = mess.getFrom()
-        props = mess.getProperties()
         text = mess.getBody()
-        username = self.get_sender_username(mess)
 
         if type not in ("groupchat", "chat"):
-            logging.debug("unhandled message type: %s" % type)
+            logging.debug("unhandled message type: %s", type)
             return
 
         # Ignore messages from before we joined
+        props = mess.getProperties()
         if xmpp.NS_DELAY in props:
             return
 
@@ -621,11 +698,12 @@ class JabberBot(object):
         if self.jid.bareMatch(jid):
             return
 
-        logging.debug("*** props = %s" % props)
-        logging.debug("*** jid = %s" % jid)
-        logging.debug("*** username = %s" % username)
-        logging.debug("*** type = %s" % type)
-        logging.debug("*** text = %s" % text)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("*** props = %s", props)
+            logging.debug("*** jid = %s", jid)
+            logging.debug("*** username = %s", self.get_sender_username(mess))
+            logging.debug("*** type = %s", type)
+            logging.debug("*** text = %s", text)
 
         # If a message format is not supported (eg. encrypted),
         # txt will be None
@@ -633,6 +711,8 @@ class JabberBot(object):
             return
 
         # Ignore messages from users not seen by this bot
+        if self.__presence_batch is not None:
+            self._flush_presence_batch()
         if jid not in self.__seen:
             logging.info('Ignoring message from unseen guest: %s' % jid)
             logging.debug("I've seen: %s" %
@@ -648,7 +728,7 @@ class JabberBot(object):
         else:
             command, args = text, ''
         cmd = command.lower()
-        logging.debug("*** cmd = %s" % cmd)
+        logging.debug("*** cmd = %s", cmd)
 
         if cmd in self.commands:
             def execute_and_send():
@@ -664,7 +744,7 @@ class JabberBot(object):
             # Experimental!
             # if command should be executed in a seperate thread do it
             if self.commands[cmd]._jabberbot_command_thread:
-                thread.start_new_thread(execute_and_send, ())
+                threading.Thread(target=execute_and_send).start()
             else:
                 execute_and_send()
         else:
@@ -690,8 +770,50 @@ class JabberBot(object):
         Override this method in derived class if you
         want to hadle command execution by your way.
         """
+        if self.profiler is not None:
+            with self.profiler.profile(cmd):
+                return self.commands[cmd](mess, args)
         return self.commands[cmd](mess, args)
 
+    def enable_profiling(self, threshold=1.0, rate=0, interval=0.005,
+            dump_path=None, dump_signal=None, **kwargs):
+        """Enable sampling profiler of command dispatch.
+
+        Stacks of commands running longer than threshold seconds and
+        of every rate-th command (if rate > 0) are aggregated in
+        self.profiler, see CommandProfiler for other kwargs.
+
+        If dump_signal (e.g. signal.SIGUSR1) and dump_path are given,
+        receiving the signal writes collapsed stacks to dump_path.
+        Must be called from the main thread if dump_signal is used.
+        """
+        self.disable_profiling()
+        profiler = CommandProfiler(threshold=threshold, rate=rate,
+            interval=interval, **kwargs)
+        profiler.start()
+        self.profiler = profiler
+        if dump_signal is not None and dump_path is not None:
+            def dump_handler(signum, frame):
+                try:
+                    profiler.dump(dump_path)
+                    logging.info('Profile dumped to %s', dump_path)
+                except IOError as e:
+                    logging.error('Error dumping profile to %s: %s',
+                        dump_path, e)
+            previous = signal.signal(dump_signal, dump_handler)
+            self._dump_signal = (dump_signal, previous)
+
+    def disable_profiling(self):
+        """Stop sampling profiler of command dispatch and restore
+        previous handler of dump signal"""
+        if self._dump_signal is not None:
+            dump_signal, previous = self._dump_signal
+            signal.signal(dump_signal, previous)
+            self._dump_signal = None
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+
     def unknown_command(self, mess, cmd, args):
         """Default handler for unknown commands
 
@@ -761,6 +883,9 @@ class JabberBot(object):
 
     def idle_proc(self):
         """This function will be called in the main loop."""
+        if self.__presence_batch is not None and \
+                time.time() > self.__presence_batch_until:
+            self._flush_presence_batch()
         self._idle_ping()
 
     def _idle_ping(self):
@@ -825,5 +950,7 @@ class JabberBot(object):
 
     def check_role(self, allowed_roles, mess):
         return True
-    
+
+JabberBot._jabberbot_commands = _collect_commands(JabberBot)
+
 # vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4
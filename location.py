@@ -1,12 +1,18 @@
+from .site import Site
+
 class Location(object):
     """ Location class
     """
-    def __init__(self, location_id, user_id, name, lng, lat):
+
+    SQL_BY_ID = 'SELECT location_id, user_id, name, long, lat, site_id FROM locations WHERE location_id=?'
+
+    def __init__(self, location_id, user_id, name, lng, lat, site_id=None):
         self._location_id = location_id
         self._user_id = user_id
         self._name = name
         self._lng = lng
         self._lat = lat
+        self._site_id = site_id
     
     def getLocationId(self):
         """ Return Location ID
@@ -33,6 +39,16 @@ class Location(object):
         """
         return self._name
 
+    def getSiteId(self):
+        """ Return id of site containing location or None
+        """
+        return self._site_id
+
+    def getCell(self):
+        """ Return site cell of location, locations with same cell share precomputed data
+        """
+        return Site.cellOf(self._lng, self._lat) if self._lng is not None and self._lat is not None else None
+
     def getInfo(self):
         return self.getName() + ' [ '+ "%0.5f" % self.getLng() + ', '+ "%0.5f" % self.getLat() + ' ]'
     
@@ -42,8 +58,8 @@ class Location(object):
     @staticmethod
     def getLocationById(c, location_id):
         loc = None
-        rs = c.execute('SELECT location_id, user_id, name, long, lat FROM locations WHERE location_id=?', (location_id,)).fetchone()
+        rs = c.execute(Location.SQL_BY_ID, (location_id,)).fetchone()
         if rs is not None:
-            loc = Location(rs[0], rs[1], rs[2], rs[3], rs[4])
+            loc = Location(rs[0], rs[1], rs[2], rs[3], rs[4], rs[5])
         return loc
     
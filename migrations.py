@@ -0,0 +1,186 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Versioned schema of skybber.db
+
+Schema version is kept in PRAGMA user_version. Each migration is a list of
+SQL statements or callables taking cursor, applied in one transaction.
+Databases created by the old createdb.py have user_version 0, the first
+migration therefore only creates missing objects.
+
+    python -m skybber.migrations [--db skybber.db] [--check-plans]
+"""
+
+import sys
+
+from .ephemstore import EphemerisStore
+from .location import Location
+from .site import Site
+from .user import User
+from .usercontext import UserContext
+from .utils import lazyImport
+
+sqlite3 = lazyImport('sqlite3')
+
+
+def _assignSites(c):
+    """ Create sites of existing locations and link locations to them
+    """
+    rows = c.execute('SELECT location_id, long, lat FROM locations WHERE site_id IS NULL').fetchall()
+    cells = [Site.cellOf(lng, lat) for location_id, lng, lat in rows]
+    sites = Site.getOrCreateIds(c, cells)
+    c.executemany('UPDATE locations SET site_id=? WHERE location_id=?',
+                  ((sites[cell], row[0]) for row, cell in zip(rows, cells)))
+
+
+MIGRATIONS = (
+    (1, (
+        'CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY AUTOINCREMENT, jid TEXT, descr TEXT, default_location_id INTEGER, time_zone TEXT)',
+        'CREATE TABLE IF NOT EXISTS locations (location_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT, lat real, long real)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_user_jid ON users (jid)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_location_user_id_name ON locations (user_id, name)',
+    )),
+    # covering indexes of hot queries
+    (2, (
+        'CREATE INDEX IF NOT EXISTS idx_locations_user_cover ON locations (user_id, location_id, name, long, lat)',
+        'CREATE INDEX IF NOT EXISTS idx_users_jid_cover ON users (jid, user_id, descr, default_location_id, time_zone)',
+    )),
+    # sites shared by nearby locations, spatial index by geohash cell
+    (3, (
+        'CREATE TABLE sites (site_id INTEGER PRIMARY KEY AUTOINCREMENT, cell TEXT NOT NULL, long real, lat real)',
+        'CREATE UNIQUE INDEX idx_sites_cell ON sites (cell)',
+        'ALTER TABLE locations ADD COLUMN site_id INTEGER',
+        _assignSites,
+        'CREATE INDEX idx_locations_site ON locations (site_id, user_id)',
+        'DROP INDEX idx_locations_user_cover',
+        'CREATE INDEX idx_locations_user_cover ON locations (user_id, location_id, name, long, lat, site_id)',
+    )),
+    # multi user chat rooms with room default location
+    (4, (
+        'CREATE TABLE rooms (room_id INTEGER PRIMARY KEY AUTOINCREMENT, jid TEXT NOT NULL, nick TEXT, password TEXT, '
+        'loc_name TEXT, long real, lat real, time_zone TEXT)',
+        'CREATE UNIQUE INDEX idx_rooms_jid ON rooms (jid)',
+    )),
+    # persistent store of computed ephemerides, compacted by day
+    (5, (
+        'CREATE TABLE ephemeris (kind TEXT NOT NULL, key TEXT NOT NULL, day real NOT NULL, value TEXT, '
+        'PRIMARY KEY (kind, key)) WITHOUT ROWID',
+        'CREATE INDEX idx_ephemeris_day ON ephemeris (day)',
+    )),
+)
+
+# (name, statement, parameters) of statements executed by every command
+HOT_QUERIES = (
+    ('user by jid', User.SQL_BY_JID, ('a@b',)),
+    ('user context', UserContext.SQL_LOAD, ('home', 'a@b')),
+    ('user context default', UserContext.SQL_LOAD, (None, 'a@b')),
+    ('location by name', User.SQL_LOCATION_BY_NAME, (1, 'home')),
+    ('location list', User.SQL_LOCATION_LIST, (1,)),
+    ('location list by jid', User.SQL_LOCATION_LIST_BY_JID, ('a@b',)),
+    ('location by id', Location.SQL_BY_ID, (1,)),
+    ('site by cell', Site.SQL_BY_CELL, ('u2fkbd',)),
+    ('sites in cell range', Site.SQL_IN_CELL_RANGE, ('u2fk', 'u2fk~')),
+    ('ephemeris load', EphemerisStore.SQL_LOAD, (46000.0, 46032.0, 100000)),
+    ('ephemeris compaction', EphemerisStore.SQL_COMPACT, (46000.0, 46032.0)),
+)
+
+
+def getVersion(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def getLatestVersion():
+    return MIGRATIONS[-1][0]
+
+
+def upgrade(conn):
+    """ Apply missing migrations, return number of applied migrations
+    """
+    version = getVersion(conn)
+    applied = 0
+    for migration_version, steps in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        c = conn.cursor()
+        c.execute('BEGIN')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            c.execute('PRAGMA user_version = %d' % migration_version)
+            c.execute('COMMIT')
+        except:
+            c.execute('ROLLBACK')
+            raise
+        applied += 1
+    return applied
+
+
+def prepareDatabase(path):
+    """ Switch database to WAL, upgrade schema and refresh planner statistics
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        if upgrade(conn):
+            conn.execute('ANALYZE')
+        else:
+            conn.execute('PRAGMA optimize')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def explainQueries(conn):
+    """ Return list of (name, plan, ok) of HOT_QUERIES, ok is False if plan scans a table
+    """
+    result = []
+    for name, sql, params in HOT_QUERIES:
+        details = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        ok = not any(detail.startswith('SCAN') for detail in details)
+        result.append((name, '; '.join(details), ok))
+    return result
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Upgrade skybber database schema')
+    parser.add_argument('--db', default='skybber.db', help='path of skybber database')
+    parser.add_argument('--check-plans', action='store_true', help='verify query plans of hot statements')
+    args = parser.parse_args(argv)
+
+    prepareDatabase(args.db)
+    conn = sqlite3.connect(args.db)
+    try:
+        print('Schema version: %d' % getVersion(conn))
+        if args.check_plans:
+            failed = 0
+            for name, plan, ok in explainQueries(conn):
+                print('%-4s %-22s %s' % ('OK' if ok else 'SCAN', name, plan))
+                failed += 0 if ok else 1
+            return 1 if failed else 0
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,16 @@
-import re 
+import re
 from .jabberbot import JabberBot
 
 
+class MUCRoom(object):
+    ''' Multi user chatroom joined by the bot. '''
+
+    def __init__(self, jid, nick=None, password=None):
+        self.jid = jid
+        self.nick = nick
+        self.password = password
+
+
 class MUCJabberBot(JabberBot):
     ''' Add features in JabberBot to allow it to handle specific
     caractheristics of multiple users chatroom (MUC). '''
@@ -16,20 +25,69 @@ class MUCJabberBot(JabberBot):
         except KeyError:
             pass
 
+        # object with count(room, handled) method counting groupchat messages
+        self.room_stats = kwargs.pop('room_stats', None)
+
+        # rooms joined after every (re)connect, room jid: MUCRoom
+        self.rooms = {}
+
         # initialize jabberbot
         super(MUCJabberBot, self).__init__(*args, **kwargs)
 
         # create a regex to check if a message is a direct message
         user, domain = str(self.jid).split('@')
         self.direct_message_re = re.compile('^%s(@%s)?[^\w]? ' % (user, domain))
-    
+        self._direct_prefix = user
+        self.update_command_filter()
+
+    def update_command_filter(self):
+        ''' Precompute first characters and max length of commands used by
+        pre-filter of groupchat messages. Call it after changing self.commands. '''
+        self._command_initials = frozenset(c for name in self.commands for c in (name[:1].lower(), name[:1].upper()))
+        self._command_max_len = max([len(name) for name in self.commands] or [0])
+        # unknown_command may answer any message, filter is safe only if it is not overridden
+        self._command_filter = type(self).unknown_command is JabberBot.unknown_command
+
+    def _is_command(self, text, start):
+        ''' Return True if text starting at start begins with a command '''
+        if len(text) <= start or text[start] not in self._command_initials:
+            return False
+        end = text.find(' ', start, start + self._command_max_len + 1)
+        if end < 0:
+            if len(text) - start > self._command_max_len:
+                return False
+            end = len(text)
+        return text[start:end].lower() in self.commands
+
+    def _init_session(self):
+        ''' Overridden from JabberBot, rejoin rooms on the new connection '''
+        super(MUCJabberBot, self)._init_session()
+        for room in list(self.rooms.values()):
+            self.muc_join_room(room.jid, room.nick, room.password)
+
+    def muc_add_room(self, room):
+        ''' Register MUCRoom and join it if the bot is connected '''
+        self.rooms[room.jid] = room
+        if self.conn is not None:
+            self.muc_join_room(room.jid, room.nick, room.password)
+
+    def muc_remove_room(self, jid, message=None):
+        ''' Unregister and leave room of jid, return removed MUCRoom or None '''
+        room = self.rooms.pop(jid, None)
+        if room is not None and self.conn is not None:
+            self.muc_part_room(room.jid, room.nick, message)
+        return room
+
     def _process_message(self, mess):
         pass
-    
+
     def callback_message(self, conn, mess):
         ''' Changes the behaviour of the JabberBot in order to allow
         it to answer direct messages. This is used often when it is
-        connected in MUCs (multiple users chatroom). '''
+        connected in MUCs (multiple users chatroom).
+
+        Groupchat messages which do not start with a command are dropped
+        before any other processing. '''
 
         message = mess.getBody()
 
@@ -38,7 +96,19 @@ class MUCJabberBot(JabberBot):
 
         self._process_message(mess)
 
-        if self.direct_message_re.match(message):
+        direct = message.startswith(self._direct_prefix) and self.direct_message_re.match(message)
+
+        if self._command_filter and mess.getType() == 'groupchat':
+            if direct:
+                handled = self._is_command(message, message.find(' ') + 1)
+            else:
+                handled = not self.only_direct and self._is_command(message, 0)
+            if self.room_stats is not None:
+                self.room_stats.count(mess.getFrom().getStripped(), handled)
+            if not handled:
+                return
+
+        if direct:
             mess.setBody(' '.join(message.split(' ', 1)[1:]))
             return super(MUCJabberBot, self).callback_message(conn, mess)
         elif not self.only_direct:
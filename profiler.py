@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# JabberBot: A simple jabber/xmpp bot framework
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Sampling profiler for bot commands
+
+A background thread samples stacks of threads executing commands. Samples of
+an execution are kept only if the command ran longer than the threshold or
+if the execution was picked by the 1-in-N rate. Kept samples are aggregated
+per command as collapsed stacks ("cmd;frame;frame count") which can be fed
+directly to flamegraph.pl or speedscope.
+"""
+
+import os
+import sys
+import threading
+import time
+
+
+class _Execution(object):
+    """One profiled command execution"""
+
+    def __init__(self, profiler, cmd):
+        self.profiler = profiler
+        self.cmd = cmd
+        self.samples = []
+        self.root = None
+        self.start = None
+
+    def __enter__(self):
+        self.root = sys._getframe(1)
+        self.start = time.perf_counter()
+        self.profiler._begin(self)
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.profiler._end(self, time.perf_counter() - self.start)
+        self.root = None
+
+
+class CommandProfiler(object):
+    """Sampling profiler with bounded memory.
+
+    threshold - keep samples of executions longer than threshold seconds
+    rate - additionally keep every rate-th execution (0 disables)
+    interval - sampling interval in seconds
+    max_stacks - maximum number of distinct stacks per command
+    max_samples - maximum number of samples of one execution
+    max_depth - maximum depth of sampled stack
+    """
+
+    TRUNCATED = '[truncated]'
+
+    def __init__(self, threshold=1.0, rate=0, interval=0.005, max_stacks=1000,
+            max_samples=2000, max_depth=64):
+        self.threshold = threshold
+        self.rate = rate
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_samples = max_samples
+        self.max_depth = max_depth
+        self._lock = threading.RLock()
+        self._active = {}
+        self._wakeup = threading.Event()
+        self._executions = 0
+        self._stacks = {}
+        self._thread = None
+        self._finished = False
+
+    def start(self):
+        """Start sampler thread"""
+        if self._thread is None:
+            self._finished = False
+            self._thread = threading.Thread(target=self._run,
+                name='CommandProfiler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop sampler thread"""
+        self._finished = True
+        self._wakeup.set()
+        self._thread = None
+
+    def profile(self, cmd):
+        """Return context manager profiling execution of cmd"""
+        return _Execution(self, cmd)
+
+    def reset(self):
+        """Forget aggregated stacks"""
+        with self._lock:
+            self._stacks = {}
+
+    def format_collapsed(self):
+        """Return aggregated stacks in collapsed (flamegraph) format"""
+        with self._lock:
+            lines = []
+            for cmd in sorted(self._stacks):
+                for stack, count in sorted(self._stacks[cmd].items()):
+                    lines.append('%s;%s %d' % (cmd, stack, count))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def dump(self, path):
+        """Write aggregated stacks in collapsed format to path"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.format_collapsed())
+        os.replace(tmp_path, path)
+
+    def _begin(self, execution):
+        with self._lock:
+            self._active[threading.get_ident()] = execution
+        self._wakeup.set()
+
+    def _end(self, execution, elapsed):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            self._executions += 1
+            keep = elapsed >= self.threshold or \
+                (self.rate and self._executions % self.rate == 0)
+            if not keep or not execution.samples:
+                return
+            stacks = self._stacks.setdefault(execution.cmd, {})
+            for stack in execution.samples:
+                if stack not in stacks and len(stacks) >= self.max_stacks:
+                    stack = self.TRUNCATED
+                stacks[stack] = stacks.get(stack, 0) + 1
+
+    def _stack_key(self, frame, root):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append('%s:%s' % (os.path.basename(code.co_filename),
+                code.co_name))
+            if frame is root:
+                break
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
+
+    def _run(self):
+        while not self._finished:
+            if not self._active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, execution in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and \
+                            len(execution.samples) < self.max_samples:
+                        execution.samples.append(
+                            self._stack_key(frame, execution.root))
+            del frames
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4
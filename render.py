@@ -0,0 +1,224 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Rendering of command replies
+
+Commands compute Reply objects - template name and values - which are
+rendered as plain text, XHTML-IM or JSON. Templates use str.format
+replacement fields, they are compiled once into literal and field parts and
+rendered by join. Section ((...)) of template is rendered only if none of
+its fields is None. Value of type Rows is rendered by template of rows,
+nested Reply by its own template.
+Times are local naive datetimes, the zone is kept in Reply.
+"""
+
+import datetime
+import html
+import json
+import string
+
+OPTIONAL_START = '(('
+OPTIONAL_END = '))'
+
+UNICODE_RISE = u'\u21E7'
+UNICODE_SET = u'\u21E9'
+UNICODE_SUN = u'\u2600'
+
+
+class Rows(object):
+    """ List of values dicts rendered by template name and joined by separator
+    """
+    def __init__(self, name, items, separator=''):
+        self.name = name
+        self.items = items
+        self.separator = separator
+
+
+class Template(object):
+    """ Reply template compiled into sections of (literal, field, format spec) parts
+    """
+
+    _formatter = string.Formatter()
+
+    def __init__(self, text, xhtml=None):
+        self._text = self._compile(text, False)
+        # without own markup xhtml is the escaped text with line breaks
+        self._xhtml = self._compile(xhtml, False) if xhtml is not None else self._compile(text, True)
+
+    @classmethod
+    def _compileParts(cls, text, escape):
+        parts = []
+        for literal, field, spec, conversion in cls._formatter.parse(text):
+            if escape:
+                literal = html.escape(literal, quote=False).replace('\n', '<br/>')
+            if conversion:
+                raise ValueError('Conversion is not supported in template: ' + text)
+            parts.append((literal, field, spec))
+        return tuple(parts)
+
+    @classmethod
+    def _compile(cls, text, escape):
+        """ Return tuple of (optional, parts) sections
+        """
+        sections = []
+        pos = 0
+        while pos < len(text):
+            start = text.find(OPTIONAL_START, pos)
+            if start < 0:
+                sections.append((False, cls._compileParts(text[pos:], escape)))
+                break
+            if start > pos:
+                sections.append((False, cls._compileParts(text[pos:start], escape)))
+            end = text.find(OPTIONAL_END, start)
+            if end < 0:
+                raise ValueError('Unterminated optional section in template: ' + text)
+            sections.append((True, cls._compileParts(text[start + len(OPTIONAL_START):end], escape)))
+            pos = end + len(OPTIONAL_END)
+        return tuple(sections)
+
+    def render(self, values, xhtml=False):
+        """ Return text or XHTML-IM of values, values are escaped in XHTML-IM
+        """
+        out = []
+        for optional, parts in (self._xhtml if xhtml else self._text):
+            if optional and any(field and values.get(field) is None for _, field, _ in parts):
+                continue
+            for literal, field, spec in parts:
+                if literal:
+                    out.append(literal)
+                if field:
+                    out.append(_renderValue(values.get(field), spec, xhtml))
+        return ''.join(out)
+
+
+def _renderValue(value, spec, xhtml):
+    if value is None:
+        return ''
+    if isinstance(value, Rows):
+        template = TEMPLATES[value.name]
+        return value.separator.join([template.render(item, xhtml) for item in value.items])
+    if isinstance(value, Reply):
+        return TEMPLATES[value.getName()].render(value.getValues(), xhtml)
+    result = format(value, spec)
+    return html.escape(result, quote=False).replace('\n', '<br/>') if xhtml else result
+
+
+def _jsonValue(value):
+    if isinstance(value, Rows):
+        return [_jsonValues(item) for item in value.items]
+    if isinstance(value, Reply):
+        return _jsonValues(value.getValues())
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(timespec='seconds')
+    return value
+
+
+def _jsonValues(values):
+    return dict((key, _jsonValue(value)) for key, value in values.items())
+
+
+class Reply(object):
+    """ Result of command rendered by template
+    """
+
+    def __init__(self, name, values, zone=None):
+        self._name = name
+        self._values = values
+        self._zone = zone
+        self._text = None
+        self._xhtml = None
+        self._json = None
+
+    @staticmethod
+    def message(text):
+        """ Return reply of plain message
+        """
+        return Reply('message', {'text': text})
+
+    def getName(self):
+        return self._name
+
+    def getValues(self):
+        return self._values
+
+    def getZone(self):
+        return self._zone
+
+    def toText(self):
+        if self._text is None:
+            self._text = TEMPLATES[self._name].render(self._values)
+        return self._text
+
+    def toXhtml(self):
+        """ Return content of XHTML-IM body
+        """
+        if self._xhtml is None:
+            self._xhtml = TEMPLATES[self._name].render(self._values, xhtml=True)
+        return self._xhtml
+
+    def toJson(self):
+        if self._json is None:
+            result = {'reply': self._name, 'zone': self._zone}
+            result.update(_jsonValues(self._values))
+            self._json = json.dumps(result, ensure_ascii=False)
+        return self._json
+
+    def __str__(self):
+        return self.toText()
+
+
+_INTERVAL = UNICODE_SET + '{start:%H:%M:%S}  -  ' + UNICODE_RISE + '{end:%H:%M:%S}'
+_BODY_TAIL = '(({message}))((  Phase {phase:0.1f}))((  Elong {elong:0.2f}))((  {mag}m))((  [ {constellation} ]))'
+_SAT_POINT = '{time:%H:%M:%S}  [ {alt} / {az} ]'
+
+TEMPLATES = {
+    'message': Template('{text}'),
+    'tw': Template(_INTERVAL),
+    'interval': Template(_INTERVAL),
+    'night': Template('{intervals}'),
+    'body': Template('{symbol} ((' + UNICODE_RISE + '{rising:%H:%M:%S}  ' + UNICODE_SET + '{setting:%H:%M:%S}))' + _BODY_TAIL),
+    'sun': Template('{symbol} ((' + UNICODE_SET + '{setting:%H:%M:%S}  ' + UNICODE_RISE + '{rising:%H:%M:%S}))' + _BODY_TAIL),
+    'inner': Template('{symbol} ((' + UNICODE_RISE + '{time:%H:%M:%S}))' + _BODY_TAIL),
+    'lsloc': Template('\nUser locations : \n{locations}', '<strong>User locations</strong><table>{locations}</table>'),
+    'location': Template('{name} [ {lng:0.5f}, {lat:0.5f} ]((  {default}))\n',
+                         '<tr><td>{name}</td><td>{lng:0.5f}, {lat:0.5f}</td><td>(({default}))</td></tr>'),
+    'passes': Template('\n{passes}', '<table>{passes}</table>'),
+    'satpass': Template('(({satellite}  )){date:%d/%m} (({meter}  {mag: }m  ))((' + UNICODE_RISE + '{start}  ))((' + UNICODE_SUN + '{max}  ))((' +
+                        UNICODE_SET + '{end}\n))',
+                        '<tr>((<td>{satellite}</td>))<td>{date:%d/%m}</td><td>(({meter}  {mag: }m))</td><td>((' + UNICODE_RISE +
+                        '{start}))</td><td>((' + UNICODE_SUN + '{max}))</td><td>((' + UNICODE_SET + '{end}))</td></tr>'),
+    'satpoint': Template(_SAT_POINT),
+    'flares': Template('\nFlares brighter than {max_mag:.0f}m in next {hours} h{passes}',
+                       'Flares brighter than {max_mag:.0f}m in next {hours} h{passes}'),
+    'overhead': Template('\n{count} sunlit satellites above the horizon in {minutes} min((, first {shown} shown)){passes}',
+                         '{count} sunlit satellites above the horizon in {minutes} min((, first {shown} shown)){passes}'),
+    'twilights': Template('\n{twilights}', '<table>{twilights}</table>'),
+    'twilight': Template('{name:<13}((' + UNICODE_SET + '{dusk:%H:%M:%S}  ' + UNICODE_RISE + '{dawn:%H:%M:%S}))(({message}))\n',
+                         '<tr><td>{name}</td>((<td>' + UNICODE_SET + '{dusk:%H:%M:%S}</td><td>' + UNICODE_RISE +
+                         '{dawn:%H:%M:%S}</td>))((<td>{message}</td>))</tr>'),
+    'phases': Template('\n{phases}', '<table>{phases}</table>'),
+    'phase': Template('{symbol} {date:%Y-%m-%d %H:%M}  {name}\n',
+                      '<tr><td>{symbol}</td><td>{date:%Y-%m-%d %H:%M}</td><td>{name}</td></tr>'),
+    'seasons': Template('\n{seasons}', '<table>{seasons}</table>'),
+    'season': Template('{date:%Y-%m-%d %H:%M}  {name}\n', '<tr><td>{date:%Y-%m-%d %H:%M}</td><td>{name}</td></tr>'),
+    'whatsup': Template('\nAbove {min_alt:0.0f}\u00B0 at {time:%H:%M}\n{objects}',
+                        'Above {min_alt:0.0f}\u00B0 at {time:%H:%M}<table>{objects}</table>'),
+    'skyobject': Template('{name} ({kind})  {mag:0.1f}m  [ {alt:0.0f} / {az:0.0f} ]  [ {constellation} ]\n',
+                          '<tr><td>{name}</td><td>{kind}</td><td>{mag:0.1f}m</td><td>{alt:0.0f} / {az:0.0f}</td>'
+                          '<td>{constellation}</td></tr>'),
+}
@@ -0,0 +1,115 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" LRU cache of command replies bounded by size in bytes
+
+Entries expire at given time. Entries derived from data of one user (e.g.
+resolved location of the user) have owner and are invalidated together
+when the user changes their data.
+"""
+
+import collections
+import threading
+import time
+
+
+class ResponseCache(object):
+    """ LRU cache of values with expiration, bounded by sum of entry sizes
+    """
+
+    # estimated bytes of key, entry tuple and dict slots
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key: (value, size, expires, owner)
+        self._entries = collections.OrderedDict()
+        # owner: set of keys
+        self._owners = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key, now=None):
+        """ Return value of key or None if it is missing or expired
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= now:
+                if entry is not None:
+                    self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, expires, owner=None):
+        """ Store value of size bytes valid until expires (unix time)
+        """
+        size += self.ENTRY_OVERHEAD
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires, owner)
+            self._bytes += size
+            if owner is not None:
+                self._owners.setdefault(owner, set()).add(key)
+            while self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _remove(self, key):
+        _, size, _, owner = self._entries.pop(key)
+        self._bytes -= size
+        if owner is not None:
+            keys = self._owners.get(owner)
+            keys.discard(key)
+            if not keys:
+                del self._owners[owner]
+
+    def invalidate(self, owner):
+        """ Remove entries of owner, return number of removed entries
+        """
+        with self._lock:
+            keys = list(self._owners.get(owner, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owners.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def getBytes(self):
+        return self._bytes
+
+    def formatText(self):
+        with self._lock:
+            return '\nresponse cache  entries %d  bytes %d / %d  hits %d  misses %d  evictions %d\n' % (
+                len(self._entries), self._bytes, self._max_bytes, self._hits, self._misses, self._evictions)
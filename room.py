@@ -0,0 +1,73 @@
+from .location import Location
+from .mucjabberbot import MUCRoom
+
+class Room(MUCRoom):
+    """ Multi user chat room with room default location
+    """
+
+    SQL_ALL = 'SELECT room_id, jid, nick, password, loc_name, long, lat, time_zone FROM rooms ORDER BY jid'
+    SQL_BY_JID = 'SELECT room_id, jid, nick, password, loc_name, long, lat, time_zone FROM rooms WHERE jid=?'
+
+    def __init__(self, room_id, jid, nick=None, password=None, loc_name=None, lng=None, lat=None, time_zone=None):
+        MUCRoom.__init__(self, jid, nick, password)
+        self._room_id = room_id
+        self._loc_name = loc_name
+        self._lng = lng
+        self._lat = lat
+        self._time_zone = time_zone
+
+    def getRoomId(self):
+        return self._room_id
+
+    def getJID(self):
+        return self.jid
+
+    def getNick(self):
+        return self.nick
+
+    def getLocation(self):
+        """ Return room default location or None
+        """
+        if self._lng is None or self._lat is None:
+            return None
+        return Location(None, None, self._loc_name, self._lng, self._lat)
+
+    def getTimeZone(self):
+        """ Return name of time zone of room location or None
+        """
+        return self._time_zone
+
+    def getInfo(self):
+        result = self.jid + (' (' + self.nick + ')' if self.nick else '')
+        location = self.getLocation()
+        if location is not None:
+            result += '  ' + location.getInfo()
+        if self._time_zone is not None:
+            result += '  ' + self._time_zone
+        return result
+
+    def setLocation(self, c, loc_name, lng, lat, time_zone):
+        c.execute('UPDATE rooms SET loc_name=?, long=?, lat=?, time_zone=? WHERE room_id=?',
+                  (loc_name, lng, lat, time_zone, self._room_id))
+        self._loc_name, self._lng, self._lat, self._time_zone = loc_name, lng, lat, time_zone
+
+    def delete(self, c):
+        c.execute('DELETE FROM rooms WHERE room_id=?', (self._room_id, ))
+
+    @staticmethod
+    def _fromRow(rs):
+        return Room(rs[0], rs[1], rs[2], rs[3], rs[4], rs[5], rs[6], rs[7])
+
+    @staticmethod
+    def getRooms(c):
+        return [Room._fromRow(rs) for rs in c.execute(Room.SQL_ALL)]
+
+    @staticmethod
+    def getRoomByJID(c, jid):
+        rs = c.execute(Room.SQL_BY_JID, (jid, )).fetchone()
+        return Room._fromRow(rs) if rs is not None else None
+
+    @staticmethod
+    def create(c, jid, nick=None, password=None):
+        c.execute('INSERT INTO rooms(jid, nick, password) VALUES (?,?,?)', (jid, nick, password))
+        return Room.getRoomByJID(c, jid)
@@ -1,6 +1,7 @@
-import xml.etree.ElementTree as etree
-import ephem
 from .utils import *
+from .render import Reply, Rows
+
+etree = lazyImport('xml.etree.ElementTree')
 
 
 class TimeAltAz(object):
@@ -9,16 +10,21 @@ class TimeAltAz(object):
         self.alt = None
         self.az = None
 
-    def format(self):
-        result = formatLocalTime(self.tm) + '  [ ' + self.alt + ' / ' + self.az + ' ]'
-        return result
+    def toValues(self, zone=None):
+        """ Return values of 'satpoint' reply template
+        """
+        return {'time': toLocalDateTime(self.tm, zone), 'alt': self.alt, 'az': self.az}
 
 class SatellitePassInfo(object):
 
     UNICODE_RISE = u'\u21E7'
     UNICODE_SET = u'\u21E9'
 
-    def __init__(self):
+    # brightest, faintest magnitude and step of meter
+    MAG_METER = (-3.0, 1.0, 0.5)
+
+    def __init__(self, satid=None):
+        self.satid = satid
         self.mag = ''
         self.start = None
         self.max = None
@@ -33,15 +39,21 @@ class SatellitePassInfo(object):
             return self.end.tm
         return None
 
-    def format(self):
-        result = magMeter(self.mag, -3.0, 1.0, 0.5) + '  '  + formatSign(self.mag) + 'm  '
-        if self.start is not None:
-            result += SatellitePassInfo.UNICODE_RISE + self.start.format() + '  '
-        if self.max is not None:
-            result += u'\u2600' + self.max.format() + '  '
-        if self.end is not None:
-            result += SatellitePassInfo.UNICODE_SET + self.end.format() + '\n'
-        return result
+    def toValues(self, zone=None, with_satellite=False):
+        """ Return values of 'satpass' reply template, times are converted to zone once
+        """
+        mag = float(self.mag) if self.mag else None
+        values = {'date': None, 'mag': mag, 'meter': magMeter(mag, *self.MAG_METER) if mag is not None else None,
+                  'satellite': self.satid if with_satellite else None}
+        for key, point in (('start', self.start), ('max', self.max), ('end', self.end)):
+            if point is None:
+                values[key] = None
+                continue
+            point_values = point.toValues(zone)
+            if values['date'] is None:
+                values['date'] = point_values['time']
+            values[key] = Reply('satpoint', point_values)
+        return values
 
 
 class SatellitePasses(object):
@@ -49,25 +61,47 @@ class SatellitePasses(object):
     UNICODE_RISE = u'\u21E7'
     UNICODE_SET = u'\u21E9'
 
-    def __init__(self):
+    def __init__(self, satid=None):
+        self._satid = satid
         self._observer = None
         self._from = ''
         self._to = ''
         self._passInfos = ()
 
-    def format(self):
-        #result = '\nFrom: ' + formatLocalDateTime(self._from) + ' To: ' + formatLocalDateTime(self._to) + '\n'
-        result = ''
-        for satpass in self._passInfos:
-            date = formatLocalDateDDMM(satpass.getDate())
-            result += date + ' ' + satpass.format()
-
-        if len(result) == 0:
-            result = 'No visible satellite pass.'
-        else:
-            result = '\n' + result
-
-        return result
+    @staticmethod
+    def fromPassInfos(infos):
+        """ Return SatellitePasses of SatellitePassInfo list
+        """
+        passes = SatellitePasses()
+        passes._passInfos = tuple(infos)
+        return passes
+
+    @staticmethod
+    def merge(passes_list):
+        """ Return SatellitePasses with passes of all satellites ordered by time
+        """
+        infos = [info for passes in passes_list for info in passes._passInfos]
+        return SatellitePasses.fromPassInfos(sorted(infos, key=lambda info: (info.getDate() is None, info.getDate() or 0.0)))
+
+    def toReply(self, zone=None):
+        """ Return reply of passes in time zone, server time is used if zone is None.
+            Passes are labelled by satellite id if there are passes of more satellites
+        """
+        if len(self._passInfos) == 0:
+            return Reply.message('No visible satellite pass.')
+        with_satellite = len(set(info.satid for info in self._passInfos)) > 1
+        return Reply('passes', {'passes': Rows('satpass', [info.toValues(zone, with_satellite) for info in self._passInfos])}, zone)
+
+    def getFirstPassDate(self):
+        """ Return ephem date of the earliest pass or None
+        """
+        dates = [info.getDate() for info in self._passInfos if info.getDate() is not None]
+        return min(dates) if dates else None
+
+    def format(self, zone=None):
+        """ Format passes in time zone, server time is used if zone is None
+        """
+        return self.toReply(zone).toText()
 
     def parseFromXml(self, xml_passes):
 
@@ -91,7 +125,7 @@ class SatellitePasses(object):
                 self._passInfos += (self._parseOnePass(xml_node),)
 
     def _parseOnePass(self, passn):
-        pass_info = SatellitePassInfo()
+        pass_info = SatellitePassInfo(self._satid)
         for xml_node in passn:
             if xml_node.tag == 'magnitude':
                 pass_info.mag = xml_node.text
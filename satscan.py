@@ -0,0 +1,478 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Scan of TLE catalog for satellites above horizon
+
+Mean elements of all satellites are parsed into column arrays. The catalog
+is screened in two passes over the columns at middle of the time window,
+orbits are propagated by Kepler motion with J2 secular drift of node and
+perigee:
+
+    plane    angular distance of observer from orbital plane must be less
+             than horizon radius of satellite at apogee (one sine per object)
+    track    argument of latitude swept during the window must come close
+             to the observer's position projected to the orbital plane
+    shadow   optionally, the arc swept during the window must not lie whole
+             in the cylinder of Earth's shadow
+
+Margins cover Earth rotation during the window and the simplified model.
+Remaining candidates are refined by SGP4 of ephem sampled every minute,
+satellites above horizon and sunlit are returned as SatellitePassInfo.
+Refinement computes every second minute first and the minutes between only
+where they may change the result. Scan counts satellites by their first
+visible minute and refines maximum and end only of the listed passes.
+
+TLE file has optional name line followed by the two element lines, e.g.
+active.txt of celestrak.org.
+
+    python -m skybber.satscan [--tle satellites.tle] --lng LNG --lat LAT [--minutes 10]
+"""
+
+import array
+import functools
+import math
+import os
+import sys
+import threading
+
+from .satellitepass import SatellitePassInfo, TimeAltAz
+from .utils import lazyImport
+
+ephem = lazyImport('ephem')
+
+DEFAULT_TLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'satellites.tle')
+
+EARTH_RADIUS = 6378.137
+# km^3 / day^2
+EARTH_MU = 398600.4418 * 86400.0 ** 2
+J2 = 1.08262668e-3
+EARTH_ROTATION = 2.0 * math.pi * 1.00273790935
+TWO_PI = 2.0 * math.pi
+
+SCREEN_MARGIN = math.radians(2.0)
+# shadow cylinder is narrowed to cover umbra cone and penumbra
+SHADOW_RADIUS = EARTH_RADIUS - 150.0
+# along-track error of mean elements grows with square of their age (drag of low orbits)
+SHADOW_DRIFT = math.radians(5.0)
+REFINE_STEP = 60.0
+# states of refined samples
+_BELOW, _DARK, _SUNLIT = range(3)
+
+# parsed columns, angles in radians, rates per day
+_COLUMNS = ('epoch', 'n', 'e', 'raan', 'raan_dot', 'argp', 'argp_dot', 'm', 'sin_i', 'cos_i', 'rho')
+
+
+def _checksum(line):
+    return sum(int(c) if c.isdigit() else 1 if c == '-' else 0 for c in line[:68]) % 10
+
+
+@functools.lru_cache(maxsize=None)
+def _yearStart(year):
+    return float(ephem.Date('%d/1/1' % year))
+
+
+def _epochDate(field):
+    """ Return ephem date of TLE epoch field YYDDD.DDDDDDDD
+    """
+    year = int(field[:2])
+    return _yearStart(year + (1900 if year >= 57 else 2000)) + float(field[2:]) - 1.0
+
+
+def readTle(f):
+    """ Yield (name, line1, line2) of TLE file, name is catalog number if name line is missing
+    """
+    name = None
+    line1 = None
+    for line in f:
+        line = line.rstrip()
+        if line.startswith('1 ') and len(line) >= 69:
+            line1 = line
+        elif line.startswith('2 ') and len(line) >= 69 and line1 is not None:
+            yield (name or line1[2:7].strip(), line1, line)
+            name = line1 = None
+        elif line:
+            name = line.strip()
+            line1 = None
+
+
+def _point(sample):
+    """ Return TimeAltAz of (date, alt, az) sample
+    """
+    point = TimeAltAz()
+    point.tm = ephem.Date(sample[0])
+    point.alt = '%.0f' % math.degrees(sample[1])
+    point.az = '%.0f' % math.degrees(sample[2])
+    return point
+
+
+class SatelliteCatalog(object):
+    """ TLE catalog loaded into column arrays, reloaded when the file changes
+    """
+
+    def __init__(self, path=DEFAULT_TLE):
+        self._path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._names = []
+        self._tles = []
+        self._columns = None
+        # name prefixes: indexes of matching satellites
+        self._found = {}
+
+    def _load(self):
+        names, tles = [], []
+        columns = dict((name, array.array('d')) for name in _COLUMNS)
+        with open(self._path) as f:
+            for name, line1, line2 in readTle(f):
+                if _checksum(line1) != int(line1[68]) or _checksum(line2) != int(line2[68]):
+                    continue
+                try:
+                    epoch = _epochDate(line1[18:32])
+                    inc = math.radians(float(line2[8:16]))
+                    raan = math.radians(float(line2[17:25]))
+                    e = float('.' + line2[26:33])
+                    argp = math.radians(float(line2[34:42]))
+                    m = math.radians(float(line2[43:51]))
+                    n = float(line2[52:63]) * TWO_PI
+                except ValueError:
+                    continue
+                if n <= 0.0 or e >= 1.0:
+                    continue
+                a = (EARTH_MU / (n * n)) ** (1.0 / 3.0)
+                p = a * (1.0 - e * e)
+                k = 0.75 * n * J2 * (EARTH_RADIUS / p) ** 2
+                cos_i = math.cos(inc)
+                apogee = a * (1.0 + e)
+                for column, value in (('epoch', epoch), ('n', n), ('e', e), ('raan', raan),
+                                      ('raan_dot', -2.0 * k * cos_i), ('argp', argp),
+                                      ('argp_dot', k * (5.0 * cos_i * cos_i - 1.0)), ('m', m),
+                                      ('sin_i', math.sin(inc)), ('cos_i', cos_i),
+                                      ('rho', math.acos(min(1.0, EARTH_RADIUS / apogee)))):
+                    columns[column].append(value)
+                names.append(name)
+                tles.append((line1, line2))
+        self._names, self._tles, self._columns = names, tles, columns
+        self._found = {}
+
+    def open(self):
+        """ Load catalog if it is not loaded or if file was modified, raise IOError if it is missing
+        """
+        mtime = os.path.getmtime(self._path)
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime != self._mtime:
+                self._load()
+                self._mtime = mtime
+
+    def __len__(self):
+        self.open()
+        return len(self._names)
+
+    def getName(self, i):
+        return self._names[i]
+
+    def getSatellite(self, i):
+        """ Return ephem body of satellite i, raise ValueError if elements are invalid
+        """
+        line1, line2 = self._tles[i]
+        return ephem.readtle(self._names[i], line1, line2)
+
+    def getOrbit(self, i):
+        """ Return (semi-major axis km, eccentricity, mean motion radians per day) of satellite i
+        """
+        n = self._columns['n'][i]
+        return ((EARTH_MU / (n * n)) ** (1.0 / 3.0), self._columns['e'][i], n)
+
+    def getPlane(self, i, date):
+        """ Return unit normal of orbital plane of satellite i at ephem date in equatorial frame of date
+        """
+        c = self._columns
+        raan = c['raan'][i] + c['raan_dot'][i] * (date - c['epoch'][i])
+        return (c['sin_i'][i] * math.sin(raan), -c['sin_i'][i] * math.cos(raan), c['cos_i'][i])
+
+    def find(self, prefixes):
+        """ Return tuple of indexes of satellites with name starting with one of prefixes (case insensitive)
+        """
+        self.open()
+        found = self._found.get(prefixes)
+        if found is None:
+            upper = tuple(prefix.upper() for prefix in prefixes)
+            found = tuple(i for i, name in enumerate(self._names) if name.upper().startswith(upper))
+            self._found[prefixes] = found
+        return found
+
+    def screen(self, lst, lat, date, minutes, indexes=None, sunlit=False):
+        """ Return indexes of satellites which may be above horizon of observer at
+            latitude lat and local sidereal time lst (radians) of ephem date, the
+            middle of window of minutes. Only satellites of indexes are screened if
+            they are given. If sunlit is True satellites in Earth's shadow during
+            the whole window are left out
+        """
+        self.open()
+        c = self._columns
+        cos_lat, sin_lat = math.cos(lat), math.sin(lat)
+        half = minutes / 2880.0
+        # angle of observer's motion in inertial frame during half of window
+        margin = EARTH_ROTATION * half * cos_lat + SCREEN_MARGIN
+        sin_margin, cos_margin = math.sin(margin), math.cos(margin)
+        if sunlit:
+            sun = ephem.Sun(ephem.Date(date))
+            sun_x, sun_y, sun_z = (math.cos(sun.g_dec) * math.cos(sun.g_ra), math.cos(sun.g_dec) * math.sin(sun.g_ra),
+                                   math.sin(sun.g_dec))
+
+        if indexes is None:
+            indexes = range(len(c['n']))
+            rows = zip(indexes, c['epoch'], c['raan'], c['raan_dot'], c['sin_i'], c['cos_i'], c['rho'])
+        else:
+            rows = ((i, c['epoch'][i], c['raan'][i], c['raan_dot'][i], c['sin_i'][i], c['cos_i'][i], c['rho'][i])
+                    for i in indexes)
+
+        # distance of observer from orbital plane: sin d = sin i cos lat sin(raan - lst) + cos i sin lat
+        planes = [(i, s) for i, s, rho in (
+                      (i, sin_i * cos_lat * math.sin(raan + raan_dot * (date - epoch) - lst) + cos_i * sin_lat, rho)
+                      for i, epoch, raan, raan_dot, sin_i, cos_i, rho in rows)
+                  if rho + margin >= math.pi / 2.0 or abs(s) <= math.sin(rho) * cos_margin + math.cos(rho) * sin_margin]
+
+        result = []
+        for i, s in planes:
+            dt = date - c['epoch'][i]
+            e = c['e'][i]
+            m = c['m'][i] + c['n'][i] * dt
+            big_e = m + e * math.sin(m)
+            for _ in range(3):
+                big_e -= (big_e - e * math.sin(big_e) - m) / (1.0 - e * math.cos(big_e))
+            u = c['argp'][i] + c['argp_dot'][i] * dt + \
+                2.0 * math.atan2(math.sqrt(1.0 + e) * math.sin(big_e / 2.0), math.sqrt(1.0 - e) * math.cos(big_e / 2.0))
+            # observer projected to orbital plane, angle from ascending node
+            angle = c['raan'][i] + c['raan_dot'][i] * dt - lst
+            phi = math.atan2(cos_lat * c['cos_i'][i] * math.sin(-angle) + sin_lat * c['sin_i'][i], cos_lat * math.cos(angle))
+            # half width of arc of the track above horizon
+            cos_d = math.sqrt(max(0.0, 1.0 - s * s))
+            reach = c['rho'][i] + margin
+            if reach >= math.pi or cos_d <= math.cos(reach):
+                width = math.pi
+            else:
+                width = math.acos(math.cos(reach) / cos_d)
+            sep = math.fmod(u - phi, TWO_PI)
+            if sep > math.pi:
+                sep -= TWO_PI
+            elif sep < -math.pi:
+                sep += TWO_PI
+            if abs(sep) > width + c['n'][i] * half:
+                continue
+            if sunlit:
+                # sun direction in orbital plane: s.r = amplitude cos(u - alpha), position r is in
+                # shadow if s.r < -sqrt(1 - (R/r)^2), i.e. on arc of half width beta around alpha + pi
+                raan = c['raan'][i] + c['raan_dot'][i] * dt
+                sun_n = sun_x * math.cos(raan) + sun_y * math.sin(raan)
+                sun_q = (-sun_x * math.sin(raan) + sun_y * math.cos(raan)) * c['cos_i'][i] + sun_z * c['sin_i'][i]
+                amplitude = math.hypot(sun_n, sun_q)
+                apogee = EARTH_RADIUS / math.cos(c['rho'][i])
+                depth = math.sqrt(max(0.0, 1.0 - (SHADOW_RADIUS / apogee) ** 2))
+                if amplitude > depth:
+                    sep = math.fmod(u - math.atan2(sun_q, sun_n) - math.pi, TWO_PI)
+                    if sep > math.pi:
+                        sep -= TWO_PI
+                    elif sep < -math.pi:
+                        sep += TWO_PI
+                    # fastest motion of true anomaly is at perigee
+                    sweep = c['n'][i] * half * (1.0 + e) ** 2 / (1.0 - e * e) ** 1.5
+                    if abs(sep) + sweep + SCREEN_MARGIN + SHADOW_DRIFT * dt * dt < math.acos(depth / amplitude):
+                        continue
+            result.append(i)
+        return result
+
+    def refine(self, i, observer, start, minutes, step=REFINE_STEP, skip=True):
+        """ Return SatellitePassInfo of satellite i above horizon and sunlit from ephem
+            date start during minutes, or None. Positions are sampled every step
+            seconds. If skip is True, every second sample is computed first, the
+            others only next to changes of visibility and to the highest position,
+            and samples are left out while the satellite is too far below horizon
+        """
+        try:
+            sampler = _PassSampler(self, i, observer, start, minutes, step, skip)
+            if skip:
+                sampler.complete()
+            else:
+                for k in range(sampler.samples):
+                    sampler.state(k)
+        except (ValueError, RuntimeError):
+            # invalid, decayed or diverging elements
+            return None
+        return sampler.toPassInfo()
+
+    def scan(self, observer, minutes, limit=None):
+        """ Return (count, list of SatellitePassInfo) of satellites above horizon and
+            sunlit during minutes from observer.date, the list is ordered by time and
+            altitude of the first position. Only the first limit passes are refined
+            to their maximum and end if limit is given
+        """
+        start = float(observer.date)
+        middle = ephem.Observer()
+        middle.long, middle.lat, middle.date = observer.long, observer.lat, start + minutes / 2880.0
+        candidates = self.screen(float(middle.sidereal_time()), float(observer.lat), float(middle.date), minutes,
+                                 sunlit=True)
+        # (date, -altitude in whole degrees) of the first position, sampler
+        firsts = []
+        for i in candidates:
+            try:
+                sampler = _PassSampler(self, i, observer, start, minutes, REFINE_STEP, True)
+                first = sampler.first()
+            except (ValueError, RuntimeError):
+                continue
+            if first is not None:
+                firsts.append(((first[0], -round(math.degrees(first[1]))), sampler))
+        firsts.sort(key=lambda item: item[0])
+        count = len(firsts)
+        result = []
+        for _, sampler in firsts:
+            if limit is not None and len(result) >= limit:
+                break
+            try:
+                sampler.complete()
+            except RuntimeError:
+                count -= 1
+                continue
+            result.append(sampler.toPassInfo())
+        observer.date = start
+        return count, result
+
+
+class _PassSampler(object):
+    """ Positions of satellite of catalog sampled every step seconds from ephem date start,
+        computed samples are kept
+    """
+
+    def __init__(self, catalog, i, observer, start, minutes, step, skip):
+        self._name = catalog.getName(i)
+        self._satellite = catalog.getSatellite(i)
+        self._observer = observer
+        self._start = start
+        self._step = step
+        self._skip = skip
+        c = catalog._columns
+        e = c['e'][i]
+        self._rho = c['rho'][i]
+        # largest geocentric angle covered by satellite and observer in step
+        self._sweep = (c['n'][i] * (1.0 + e) ** 2 / (1.0 - e * e) ** 1.5 + EARTH_ROTATION) * step / 86400.0
+        self.samples = int(minutes * 60.0 / step) + 1
+        self._coarse = list(range(0, self.samples, 2))
+        if self._coarse[-1] != self.samples - 1:
+            self._coarse.append(self.samples - 1)
+        self._states = {}
+        # sample: (date, alt, az) of samples above horizon and sunlit
+        self._visible = {}
+
+    def state(self, k):
+        """ Return state of sample k, raise RuntimeError if elements cannot be propagated
+        """
+        states = self._states
+        if k in states:
+            return states[k]
+        date = self._start + k * self._step / 86400.0
+        self._observer.date = date
+        satellite = self._satellite
+        satellite.compute(self._observer)
+        alt = satellite.alt
+        if alt > 0.0:
+            if satellite.eclipsed:
+                states[k] = _DARK
+            else:
+                states[k] = _SUNLIT
+                self._visible[k] = (date, alt, satellite.az)
+        else:
+            states[k] = _BELOW
+            if self._skip:
+                # geocentric angle of satellite from observer must shrink to horizon radius at apogee
+                distance = satellite.range / 1000.0
+                angle = math.atan2(distance * math.cos(alt), EARTH_RADIUS + distance * math.sin(alt))
+                for below in range(k + 1, min(self.samples, k + 1 + int((angle - self._rho - SCREEN_MARGIN) / self._sweep))):
+                    states.setdefault(below, _BELOW)
+        return states[k]
+
+    def first(self):
+        """ Return (date, alt, az) of the first visible sample or None. Every second sample is
+            computed in order and the samples between where visibility changes or
+            the satellite may rise, visible part of pass is one interval
+        """
+        states = self._states
+        k0 = None
+        for k1 in self._coarse:
+            self.state(k1)
+            if k0 is not None and k1 - k0 == 2 and \
+                    (states[k0] != states[k1] or k0 + 1 not in states and states[k0] == _BELOW):
+                self.state(k0 + 1)
+            if self._visible:
+                return self._visible[min(self._visible)]
+            k0 = k1
+        return None
+
+    def complete(self):
+        """ Compute the samples needed for the first, highest and last visible sample
+        """
+        states = self._states
+        for k in self._coarse:
+            self.state(k)
+        for k0, k1 in zip(self._coarse, self._coarse[1:]):
+            if k1 - k0 == 2 and (states[k0] != states[k1] or k0 + 1 not in states and states[k0] == _BELOW):
+                self.state(k0 + 1)
+        visible = self._visible
+        if visible:
+            # altitude has one maximum, the highest sample is next to the highest computed one
+            top = max(sorted(visible), key=lambda k: visible[k][1])
+            rising = top + 1 < self.samples and self.state(top + 1) == _SUNLIT and visible[top + 1][1] > visible[top][1]
+            if not rising and top > 0:
+                self.state(top - 1)
+
+    def toPassInfo(self):
+        """ Return SatellitePassInfo of visible samples or None
+        """
+        if not self._visible:
+            return None
+        points = [self._visible[k] for k in sorted(self._visible)]
+        info = SatellitePassInfo(self._name)
+        info.start = _point(points[0])
+        info.max = _point(max(points, key=lambda sample: sample[1]))
+        info.end = _point(points[-1])
+        return info
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Scan TLE catalog for satellites above horizon')
+    parser.add_argument('--tle', default=DEFAULT_TLE, help='TLE catalog file')
+    parser.add_argument('--lng', type=float, required=True, help='longitude of observer in degrees')
+    parser.add_argument('--lat', type=float, required=True, help='latitude of observer in degrees')
+    parser.add_argument('--minutes', type=int, default=10, help='length of window')
+    args = parser.parse_args(argv)
+
+    catalog = SatelliteCatalog(args.tle)
+    observer = ephem.Observer()
+    observer.long, observer.lat = math.radians(args.lng), math.radians(args.lat)
+    count, infos = catalog.scan(observer, args.minutes)
+    print('Satellites: %d  visible: %d' % (len(catalog), count))
+    for info in infos:
+        print('%-24s %s  %3s  %s' % (info.satid, ephem.localtime(info.getDate()).strftime('%H:%M'), info.max.alt,
+                                     ephem.localtime(info.max.tm).strftime('%H:%M')))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+from . import geohash
+
+class Site(object):
+    """ Site class - quantized geographic cell shared by nearby user locations.
+
+    Sites are keyed by geohash cell of SITE_PRECISION characters (about 1.2 x 0.6 km),
+    position of site is center of the cell.
+    """
+
+    SITE_PRECISION = 6
+
+    SQL_BY_CELL = 'SELECT site_id, cell, long, lat FROM sites WHERE cell=?'
+    SQL_IN_CELL_RANGE = 'SELECT site_id FROM sites WHERE cell>=? AND cell<?'
+
+    def __init__(self, site_id, cell, lng, lat):
+        self._site_id = site_id
+        self._cell = cell
+        self._lng = lng
+        self._lat = lat
+
+    def getSiteId(self):
+        return self._site_id
+
+    def getCell(self):
+        return self._cell
+
+    def getLng(self):
+        """ Return longitude of site center in degrees
+        """
+        return self._lng
+
+    def getLat(self):
+        """ Return latitude of site center in degrees
+        """
+        return self._lat
+
+    @staticmethod
+    def cellOf(lng, lat):
+        """ Return site cell of position
+        """
+        return geohash.encode(lat, lng, Site.SITE_PRECISION)
+
+    @staticmethod
+    def getOrCreate(c, lng, lat):
+        """ Return site containing position, create it if it does not exist
+        """
+        cell = Site.cellOf(lng, lat)
+        rs = c.execute(Site.SQL_BY_CELL, (cell, )).fetchone()
+        if rs is None:
+            center_lat, center_lng = geohash.decode(cell)
+            c.execute('INSERT INTO sites(cell, long, lat) VALUES (?,?,?)', (cell, center_lng, center_lat))
+            rs = c.execute(Site.SQL_BY_CELL, (cell, )).fetchone()
+        return Site(rs[0], rs[1], rs[2], rs[3])
+
+    @staticmethod
+    def _getIds(c, cells, result):
+        cells = list(cells)
+        for i in range(0, len(cells), 500):
+            chunk = cells[i:i + 500]
+            for site_id, cell in c.execute('SELECT site_id, cell FROM sites WHERE cell IN (' + ','.join('?' * len(chunk)) + ')', chunk):
+                result[cell] = site_id
+
+    @staticmethod
+    def getOrCreateIds(c, cells):
+        """ Return {cell: site_id} of cells, missing sites are created in bulk
+        """
+        cells = set(cells)
+        result = {}
+        Site._getIds(c, cells, result)
+        missing = cells.difference(result)
+        if missing:
+            rows = []
+            for cell in missing:
+                center_lat, center_lng = geohash.decode(cell)
+                rows.append((cell, center_lng, center_lat))
+            c.executemany('INSERT INTO sites(cell, long, lat) VALUES (?,?,?)', rows)
+            Site._getIds(c, missing, result)
+        return result
+
+    @staticmethod
+    def getLocationsWithinRadius(c, lng, lat, radius_km):
+        """ Return list of (distance km, jid, location name) of locations within radius_km,
+            candidates are found by cell range search of sites index
+        """
+        site_ids = []
+        for prefix in geohash.coveringCells(lat, lng, radius_km, Site.SITE_PRECISION):
+            site_ids.extend(row[0] for row in c.execute(Site.SQL_IN_CELL_RANGE, geohash.prefixRange(prefix)))
+        result = []
+        for i in range(0, len(site_ids), 500):
+            chunk = site_ids[i:i + 500]
+            rs = c.execute('SELECT u.jid, l.name, l.long, l.lat FROM locations l JOIN users u ON u.user_id=l.user_id '
+                           'WHERE l.site_id IN (' + ','.join('?' * len(chunk)) + ')', chunk)
+            for jid, name, loc_lng, loc_lat in rs:
+                distance = geohash.distanceKm(lat, lng, loc_lat, loc_lng)
+                if distance <= radius_km:
+                    result.append((distance, jid, name))
+        result.sort()
+        return result
@@ -17,41 +17,63 @@
 #
 
 import datetime
+import functools
+import logging
 import time
-import ephem
 import math
 import re
-import sqlite3
-import urllib.request
+import threading
 from .utils import *
 from .jabberbot import botcmd
 from .mucjabberbot import MUCJabberBot
 from .satellitepass import SatellitePasses
+from .commandrequest import CmdError, CommandRequest
 from .user import User
 from .typedetector import TypeDetector
-from .location import Location
-
-class CmdError(Exception):
-    """ Help class for handling command arguments errors
-    """
-    def __init__(self, value):
-        self.value = value
-        def __str__(self):
-            return repr(self.value)
+from .room import Room
+from .site import Site
+from .usercontext import UserContext
+from .render import Reply, Rows
+from .responsecache import ResponseCache
+from .ephemstore import EphemerisStore
+from . import geohash
+from . import twilight
+from .migrations import prepareDatabase
+from .stats import commandStats, roomStats, CommandStats
+
+ephem = lazyImport('ephem')
+sqlite3 = lazyImport('sqlite3')
+# modules of data files are loaded by the first command using them
+almanac = lazyImport(__package__ + '.almanac')
+catalog = lazyImport(__package__ + '.catalog')
+flares = lazyImport(__package__ + '.flares')
+gazetteer = lazyImport(__package__ + '.gazetteer')
+satscan = lazyImport(__package__ + '.satscan')
+urllib_error = lazyImport('urllib.error')
+urllib_request = lazyImport('urllib.request')
+futures = lazyImport('concurrent.futures')
 
 class MasterDBConnection():
     """ Help class keeping DB connection
     """
     SKYBBER_DB = 'skybber.db'
 
+    # called with every executed SQL statement if set (e.g. by benchmark)
+    TRACE_CALLBACK = None
+
     def __init__(self):
         self.dbcon = None
 
     def __enter__(self):
+        self._timing = commandStats.timing('db').__enter__()
         self.dbcon = sqlite3.connect(self.SKYBBER_DB)
+        trace_callback = type(self).TRACE_CALLBACK
+        if trace_callback is not None:
+            self.dbcon.set_trace_callback(trace_callback)
         return self.dbcon.cursor()
 
     def __exit__(self, type, value, tb):
+        self._timing.__exit__(type, value, tb)
         if tb is None:
             self.dbcon.commit()
             self.dbcon.close()
@@ -79,20 +101,106 @@ class SkybberBot(MUCJabberBot):
     PING_FREQUENCY = 60  # Set to the number of seconds, e.g. 60.
     PING_TIMEOUT = 2  # Seconds to wait for a response.
 
-    MAX_USER_LOCATIONS = 10
+    STATS_FILE_FREQUENCY = 60  # Seconds between writes of stats file.
 
-    RISET_OK = 0
-    NEVER_RISING = 1
-    NEVER_SETTING = 2
+    MAX_USER_LOCATIONS = 10
+    MAX_PLACES = 10
+
+    WHATSUP_MIN_ALT = 10.0
+    MAX_WHATSUP = 15
+    # catalog is screened once per site cell and bucket of seconds, screening margin
+    # in degrees covers motion of the sky during the bucket and missing precession
+    WHATSUP_BUCKET = 600
+    WHATSUP_MARGIN = 4.0
+    MAX_PHASES = 8
+    OVERHEAD_MINUTES = 10
+    MAX_OVERHEAD_MINUTES = 60
+    MAX_OVERHEAD = 30
+    FLARE_HOURS = 24
+    FLARE_MAX_MAG = -1.0
+    # new moon, first quarter, full moon, last quarter
+    PHASE_SYMBOLS = (u'\u25CF', u'\u25D1', u'\u25CB', u'\u25D0')
+
+    WHATSUP_BODIES = (('Moon', 'moon'), ('Mercury', 'planet'), ('Venus', 'planet'), ('Mars', 'planet'),
+                      ('Jupiter', 'planet'), ('Saturn', 'planet'))
+
+    SATELLITE_SERVICE_URL = 'http://uhaapi-skybber.rhcloud.com/satellites/'
+    # satellites of one satpass command, their passes are fetched concurrently
+    MAX_SATELLITES = 8
+
+    # body commands: (symbol, ephem body, inner planet, options of body ephemeris)
+    BODY_COMMANDS = {'sun': (u'\u2609', 'Sun', False, {'with_mag': False, 'with_constellation': False, 'rising_first': False}),
+                     'moon': (u'\u263D', 'Moon', False, {'with_mag': False, 'with_phase': True}),
+                     'mer': (u'\u263F', 'Mercury', True, {}),
+                     'ven': (u'\u2640', 'Venus', True, {}),
+                     'mar': (u'\u2642', 'Mars', False, {}),
+                     'jup': (u'\u2643', 'Jupiter', False, {}),
+                     'sat': (u'\u2644', 'Saturn', False, {})}
+    # commands of transport neutral requests (chat and HTTP API), commands showing now have no date
+    REQUEST_COMMANDS = frozenset(('night', 'tw', 'phases', 'whatsup', 'overhead', 'satpass', 'iss', 'iri')) | frozenset(BODY_COMMANDS)
+    UNDATED_COMMANDS = frozenset(('whatsup', 'overhead', 'satpass', 'iss', 'iri'))
+
+    # replies are cached by command, site cell, zone and time bucket of the rule:
+    # day - night from 06:00 to 06:00, hour/minute - the day and hour/minute of now,
+    # pass - until start of the first satellite pass
+    RESPONSE_CACHE_RULES = {'tw': 'day', 'night': 'day', 'sun': 'day',
+                            'mer': 'hour', 'ven': 'hour', 'mar': 'hour', 'jup': 'hour', 'sat': 'hour',
+                            'moon': 'minute', 'whatsup': 'minute', 'overhead': 'minute', 'iss': 'pass', 'iri': 'pass'}
+    RESPONSE_CACHE_PERIODS = {'day': 86400, 'hour': 3600, 'minute': 60}
+    RESPONSE_CACHE_BYTES = 8 * 1024 * 1024
+    # commands changing location or zone of user, cached resolutions of the user are dropped
+    MUTATING_COMMANDS = frozenset(('reg', 'unregister', 'tz', 'addloc', 'rmloc', 'loc'))
+    OBSERVER_CACHE_TTL = 600
+    SATELLITE_CACHE_TTL = 3600
+
+    RISET_OK = twilight.RISET_OK
+    NEVER_RISING = twilight.NEVER_RISING
+    NEVER_SETTING = twilight.NEVER_SETTING
 
     UNICODE_RISE = u'\u21E7'
     UNICODE_SET = u'\u21E9'
 
     def __init__(self, *args, **kwargs):
+        # jids allowed to run admin commands
+        self._admin_jids = frozenset(kwargs.pop('admin_jids', ()))
+        # path of periodically written Prometheus text file
+        self._stats_file = kwargs.pop('stats_file', None)
+        self._stats_file_written = time.time()
+        # data files are opened by the first command using them
+        self._data = {}
+        self._data_lock = threading.RLock()
+        # GeoNames dump used for place names which are not user locations
+        self._gazetteer_path = kwargs.pop('gazetteer', None)
+        self._gazetteer_index = kwargs.pop('gazetteer_index', None)
+        # star and deep-sky catalog of whatsup command
+        self._catalog_path = kwargs.pop('catalog', None)
+        self._catalog_index = kwargs.pop('catalog_index', None)
+        self._screenCatalog = functools.lru_cache(maxsize=1024)(self._screenCatalogCell)
+        # TLE catalog of overhead and iri commands
+        self._satellites_path = kwargs.pop('satellites', None)
+        # precomputed lunar phases and seasons
+        self._almanac_path = kwargs.pop('almanac', None)
+        # replies and resolved observers, 0 bytes disables the cache
+        response_cache_bytes = kwargs.pop('response_cache_bytes', self.RESPONSE_CACHE_BYTES)
+        self._response_cache = ResponseCache(response_cache_bytes) if response_cache_bytes > 0 else None
+
+        # HTTP/JSON API served with the bot, None disables it
+        self._http_address = (kwargs.pop('http_host', '127.0.0.1'), kwargs.pop('http_port', None))
+        self._http_api = None
+
+        # rooms joined at start, 'room@server[/nick]'
+        config_rooms = kwargs.pop('rooms', ())
+
+        kwargs.setdefault('room_stats', roomStats)
         MUCJabberBot.__init__(self, *args, **kwargs)
-        self._obsr_default = ephem.Observer()
-        self._obsr_default.long, self._obsr_default.lat = '15.05728', '50.76111'
-        self._obsr_default.elevation = 400
+        prepareDatabase(MasterDBConnection.SKYBBER_DB)
+        # rise/set times, twilights and satellite passes surviving restarts
+        self._ephemeris = EphemerisStore(MasterDBConnection.SKYBBER_DB)
+        self._loadRooms(config_rooms)
+        self._obsr_default = None
+        self._satellite_executor = None
+        # state of command executed by current thread
+        self._request = threading.local()
         self._arg_re = re.compile('[ \t]+')
 
     def top_of_help_message(self):
@@ -105,7 +213,7 @@ class SkybberBot(MUCJabberBot):
             u'LOCATION FORMATS: \n' + \
             u'   - angular, example : 14.86524 50.78461\n' + \
             u'   - geographic coordinations, example : 50°46\'1.105"N 15°3\'52.885"E\n' + \
-            u'   - user location, example: prague'
+            u'   - user location or place name, example: prague'
 
     @botcmd(thread=True)
     def satinfo(self, mess, args):
@@ -114,65 +222,119 @@ class SkybberBot(MUCJabberBot):
         (satid, _, reply) = self._checkArgSatId(args)
         if satid is not None:
             try:
-                req = urllib.request.Request('http://uhaapi-skybber.rhcloud.com/satellites/' + str(satid))
-                req.addheader('Accept', 'application/xml')
-                reply = urllib.request.urlopen(req).read()
-            except urllib2.URLError:
+                req = urllib_request.Request(self.SATELLITE_SERVICE_URL + str(satid))
+                req.add_header('Accept', 'application/xml')
+                with commandStats.timing('http'):
+                    reply = urllib_request.urlopen(req).read().decode('utf-8')
+            except urllib_error.URLError:
                 reply = 'Service disconnected.'
         return reply
 
     @botcmd(thread=True)
     def satpass(self, mess, args):
-        """satpass - show satellite passes identified by satellite id
+        """satpass <id>[,<id>...] [location] - show passes of satellites identified by satellite ids, example: satpass 25544,20580
         """
-        (satid, next_args, reply) = self._checkArgSatId(args)
-        if satid is not None:
-            reply = self._satteliteRequest(mess, next_args, str(satid))
-        else:
-            reply = 'Satellite ID missing.'
-        return reply
+        return self._dispatchRequest('satpass', self._parseRequest(mess, 'satpass', args))
 
     @botcmd(thread=True)
     def iss(self, mess, args):
         """iss - show ISS passes
         """
-        return self._satteliteRequest(mess, args, '25544')
+        return self._dispatchRequest('iss', self._parseRequest(mess, 'iss', args))
+
+    @botcmd(thread=True)
+    def iri(self, mess, args):
+        """iri [location] - show Iridium flares in next 24 hours
+        """
+        return self._dispatchRequest('iri', self._parseRequest(mess, 'iri', args))
+
+    def _iri(self, jid, loc):
+        """ Return Reply with flares of FLARE_HOURS from now
+        """
+        observer, zone = self._getObserver(jid, loc)
+        observer.date = ephem.now()
+        try:
+            with commandStats.timing('ephem'):
+                found = self._getFlares().predict(observer, self.FLARE_HOURS)
+        except (IOError, OSError) as e:
+            logging.error('Satellite catalog lookup failed: %s', e)
+            return Reply.message('Satellite catalog is not available.')
+        if not found:
+            return Reply.message('No flare brighter than %.0fm in next %d hours.' % (self.FLARE_MAX_MAG, self.FLARE_HOURS))
+        # cached reply expires when the first flare begins
+        self._request.expires = toUnixTime(found[0].getDate())
+        return Reply('flares', {'max_mag': self.FLARE_MAX_MAG, 'hours': self.FLARE_HOURS,
+                                'passes': SatellitePasses.fromPassInfos(found).toReply(zone)}, zone)
 
     @botcmd
     def tw(self, mess, args):
-        """tw [date] [location]  - show begin/end of current twilight
+        """tw [all] [date] [location]  - show begin/end of current twilight, all - sunset, civil, nautical and astronomical twilight
         """
-        jid, loc, dt = self._parseJidLocTime(mess, args)
-
-        # Set noon of if date is set
-        if dt != None:
-            dt = self._getNoonDateTimeFrom6To6ByDate(dt)
+        return self._dispatchRequest('tw', self._parseRequest(mess, 'tw', args))
 
-        next_rising, next_setting, riset = self._getNextRiseSetting(jid, ephem.Sun(), dt=dt, loc=loc, horizon='-18.0')
+    def _tw(self, jid, loc, dt):
+        """ Return Reply with begin/end of astronomical twilight
+        """
+        observer, zone = self._getObserver(jid, loc)
+        tw = self._getTwilights(observer, self._getNoon(dt, zone))[twilight.ASTRONOMICAL]
 
-        if riset == SkybberBot.RISET_OK:
-            reply = SkybberBot.UNICODE_SET + formatLocalTime(next_setting) + '  -  ' + SkybberBot.UNICODE_RISE + formatLocalTime(next_rising)
-        elif riset == SkybberBot.NEVER_SETTING:
-            reply = SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT
+        if tw.getRiset() == SkybberBot.RISET_OK:
+            reply = Reply('tw', {'start': toLocalDateTime(tw.getDusk(), zone), 'end': toLocalDateTime(tw.getDawn(), zone)}, zone)
+        elif tw.getRiset() == SkybberBot.NEVER_SETTING:
+            reply = Reply.message(SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT)
         else:
-            reply = SkybberBot.MSG_FULL_ASTRONOMICAL_NIGHT
+            reply = Reply.message(SkybberBot.MSG_FULL_ASTRONOMICAL_NIGHT)
         return reply
 
+    def _twAll(self, jid, loc, dt):
+        """ Return Reply with sunset/sunrise and dusk/dawn of civil, nautical and astronomical twilight
+        """
+        observer, zone = self._getObserver(jid, loc)
+        rows = []
+        for tw in self._getTwilights(observer, self._getNoon(dt, zone)):
+            row = {'name': tw.getName()}
+            if tw.getRiset() == SkybberBot.RISET_OK:
+                row['dusk'] = toLocalDateTime(tw.getDusk(), zone)
+                row['dawn'] = toLocalDateTime(tw.getDawn(), zone)
+            elif tw.getRiset() == SkybberBot.NEVER_SETTING:
+                row['message'] = 'Sun above all night.'
+            else:
+                row['message'] = 'Sun below all day.'
+            rows.append(row)
+        return Reply('twilights', {'twilights': Rows('twilight', rows)}, zone)
+
+    def _getTwilights(self, observer, noon):
+        """ Return tuple of twilight.Twilight of night following UTC noon
+        """
+        lng, lat, noon = float(observer.long), float(observer.lat), float(ephem.Date(noon))
+        # night of site cell is shared by nearby locations
+        key = '%s %r' % (Site.cellOf(todegrees(lng), todegrees(lat)), noon)
+        stored = self._ephemeris.get('twilight', key)
+        if stored is not None:
+            return twilight.fromValues(stored)
+        with commandStats.timing('ephem'):
+            twilights = twilight.solveTwilights(lng, lat, noon)
+        self._ephemeris.put('twilight', key, noon, twilight.toValues(twilights))
+        return twilights
+
     @botcmd
     def night(self, mess, args):
         """night [date] [location] - show the real night, taking into consideration the Moon rising/setting
         """
-        jid, loc, dt = self._parseJidLocTime(mess, args)
+        return self._dispatchRequest('night', self._parseRequest(mess, 'night', args))
 
-        # Set noon of if date is set
-        if dt != None:
-            dt = self._getNoonDateTimeFrom6To6ByDate(dt)
+    def _night(self, jid, loc, dt):
+        """ Return Reply with intervals of astronomical night without the Moon
+        """
+        observer, zone = self._getObserver(jid, loc)
+        dt = self._getNoon(dt, zone)
 
-        next_sun_rising, next_sun_setting, riset_sun = self._getNextRiseSetting(jid, ephem.Sun(), dt=dt, loc=loc, horizon='-18.0')
-        next_moon_rising, next_moon_setting, riset_moon = self._getNextRiseSetting(jid, ephem.Moon(), dt=dt, loc=loc)
+        astronomical = self._getTwilights(observer, dt)[twilight.ASTRONOMICAL]
+        next_sun_rising, next_sun_setting, riset_sun = astronomical.getDawn(), astronomical.getDusk(), astronomical.getRiset()
+        next_moon_rising, next_moon_setting, riset_moon, _ = self._getNextRiseSetting(observer, ephem.Moon(), dt)
 
         if riset_sun == SkybberBot.NEVER_SETTING:
-            return SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT
+            return Reply.message(SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT)
 
         full_night = False
 
@@ -196,7 +358,7 @@ class SkybberBot(MUCJabberBot):
                         if next_moon_setting < next_sun_rising:
                             tw_start = next_moon_setting # MR - SS - MS - SR
                         else:
-                            return SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT # MR - SS - SR - MS
+                            return Reply.message(SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT) # MR - SS - SR - MS
                     else:
                         pass  # MR - MS - SS - SR
                 else:
@@ -217,7 +379,7 @@ class SkybberBot(MUCJabberBot):
                         else:
                             pass # MS - SS - SR - MR
                     else:
-                        return SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT # MS - MR - SS - SR
+                        return Reply.message(SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT) # MS - MR - SS - SR
                 else:
                     if next_moon_setting < next_sun_rising:
                         if next_moon_rising < next_sun_rising:
@@ -227,66 +389,198 @@ class SkybberBot(MUCJabberBot):
                         else:
                             tw_start = next_moon_setting # SS - MS - SR - MR
                     else:
-                        return SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT # SS - SR - MS - MR
+                        return Reply.message(SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT) # SS - SR - MS - MR
         else:
             if riset_moon == SkybberBot.NEVER_SETTING:
-                return SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT
+                return Reply.message(SkybberBot.MSG_NO_ASTRONOMICAL_NIGHT)
             elif full_night:
-                return SkybberBot.MSG_FULL_ASTRONOMICAL_NIGHT
+                return Reply.message(SkybberBot.MSG_FULL_ASTRONOMICAL_NIGHT)
 
         if tw_middle_start is None:
-            reply = SkybberBot.UNICODE_SET + formatLocalTime(tw_start) + '  -  ' + SkybberBot.UNICODE_RISE + formatLocalTime(tw_end)
+            intervals = ((tw_start, tw_end), )
         else:
-            reply = SkybberBot.UNICODE_SET + formatLocalTime(tw_start) + '  -  ' + SkybberBot.UNICODE_RISE + formatLocalTime(tw_middle_end) + ' , ' + \
-                    SkybberBot.UNICODE_SET + formatLocalTime(tw_middle_end) + '  -  ' + SkybberBot.UNICODE_RISE + formatLocalTime(tw_end)
+            intervals = ((tw_start, tw_middle_end), (tw_middle_end, tw_end))
 
-        return reply
+        return Reply('night', {'intervals': Rows('interval', [{'start': toLocalDateTime(start, zone), 'end': toLocalDateTime(end, zone)}
+                                                              for start, end in intervals], ' , ')}, zone)
 
     @botcmd
     def sun(self, mess, args):
         """sun [date] [location] - show sun info
         """
-        return self._doBodyEphem(mess, args, u'\u2609', ephem.Sun(), with_constell_mag=False, rising_first=False)
+        return self._dispatchRequest('sun', self._parseRequest(mess, 'sun', args))
 
     @botcmd
     def moon(self, mess, args):
         """moon [date] [location] - show Moon ephemeris
         """
-        body = ephem.Moon()
-        reply = self._doBodyEphem(mess, args, u'\u263D', body, with_constell_mag=False)
-        reply += '  Phase ' +  ("%0.1f" % body.phase)
-        reply += '  [ ' +  ephem.constellation(body)[1] + ' ]'
-        return reply
+        return self._dispatchRequest('moon', self._parseRequest(mess, 'moon', args))
 
     @botcmd
     def mer(self, mess, args):
         """mer [date] [location] - show Mercury ephemeris
         """
-        return self._doInnerBodyEphem(mess, args, u'\u263F', ephem.Mercury())
+        return self._dispatchRequest('mer', self._parseRequest(mess, 'mer', args))
 
     @botcmd
     def ven(self, mess, args):
         """ven [date] [location] - show Venus ephemeris
         """
-        return self._doInnerBodyEphem(mess, args, u'\u2640', ephem.Venus())
+        return self._dispatchRequest('ven', self._parseRequest(mess, 'ven', args))
 
     @botcmd
     def mar(self, mess, args):
         """mar [date] [location] - show Mars ephemeris
         """
-        return self._doBodyEphem(mess, args, u'\u2642', ephem.Mars())
+        return self._dispatchRequest('mar', self._parseRequest(mess, 'mar', args))
 
     @botcmd
     def jup(self, mess, args):
         """jup [date] [location] - show Jupiter ephemeris
         """
-        return self._doBodyEphem(mess, args, u'\u2643', ephem.Jupiter())
+        return self._dispatchRequest('jup', self._parseRequest(mess, 'jup', args))
 
     @botcmd
     def sat(self, mess, args):
         """sat [date] [location] - show Saturn ephemeris
         """
-        return self._doBodyEphem(mess, args, u'\u2644', ephem.Saturn())
+        return self._dispatchRequest('sat', self._parseRequest(mess, 'sat', args))
+
+    @botcmd
+    def phases(self, mess, args):
+        """phases [date] [location] - show next new moons, quarters and full moons
+        """
+        return self._dispatchRequest('phases', self._parseRequest(mess, 'phases', args))
+
+    def _phases(self, jid, loc, dt):
+        """ Return Reply with lunar phases after start of date or after now
+        """
+        _, zone = self._getObserver(jid, loc)
+        if dt is None:
+            start = ephem.now()
+        else:
+            start = ephem.Date(localToUtc(datetime.datetime.combine(dt, datetime.time(0, 0)), zone))
+        table = self._getAlmanac()
+        try:
+            if not table.isInRange(start):
+                return Reply.message('Lunar phases are known from %d to %d.' % table.getYearRange())
+            events = table.nextPhases(start, self.MAX_PHASES)
+        except (IOError, OSError) as e:
+            logging.error('Almanac lookup failed: %s', e)
+            raise CmdError('Almanac is not available.')
+        rows = [{'symbol': self.PHASE_SYMBOLS[event.getKind()], 'name': event.getName(),
+                 'date': toLocalDateTime(event.getDate(), zone)} for event in events]
+        return Reply('phases', {'phases': Rows('phase', rows)}, zone)
+
+    @botcmd
+    def seasons(self, mess, args):
+        """seasons [year] - show equinoxes and solstices of year
+        """
+        jid = mess.getFrom().getStripped()
+        args = args.strip()
+        year = None
+        if args:
+            try:
+                year = int(args)
+            except ValueError:
+                raise CmdError('Invalid argument: ' + args)
+        return self._seasons(jid, year)
+
+    def _seasons(self, jid, year):
+        """ Return Reply with equinoxes and solstices of year or of current year
+        """
+        _, zone = self._getObserver(jid, None)
+        if year is None:
+            year = localNow(zone).year
+        table = self._getAlmanac()
+        try:
+            events = table.seasons(year)
+            if not events:
+                return Reply.message('Seasons are known from %d to %d.' % table.getYearRange())
+        except (IOError, OSError) as e:
+            logging.error('Almanac lookup failed: %s', e)
+            raise CmdError('Almanac is not available.')
+        rows = [{'name': event.getName(), 'date': toLocalDateTime(event.getDate(), zone)} for event in events]
+        return Reply('seasons', {'seasons': Rows('season', rows)}, zone)
+
+    @botcmd
+    def whatsup(self, mess, args):
+        """whatsup [location] - show planets, bright stars and deep-sky objects above the horizon now
+        """
+        return self._dispatchRequest('whatsup', self._parseRequest(mess, 'whatsup', args))
+
+    def _whatsup(self, jid, loc):
+        """ Return Reply with brightest bodies and catalog objects higher than WHATSUP_MIN_ALT
+        """
+        observer, zone = self._getObserver(jid, loc)
+        now = time.time()
+        observer.date = ephem.Date(datetime.datetime.utcfromtimestamp(now))
+        rows = []
+
+        def append(body, kind, mag=None, constellation=None):
+            with commandStats.timing('ephem'):
+                body.compute(observer)
+            alt = math.degrees(body.alt)
+            if alt >= self.WHATSUP_MIN_ALT:
+                rows.append({'name': body.name, 'kind': kind, 'mag': body.mag if mag is None else mag, 'alt': alt,
+                             'az': math.degrees(body.az),
+                             'constellation': constellationName(body) if constellation is None else constellation})
+
+        for name, kind in self.WHATSUP_BODIES:
+            append(getattr(ephem, name)(), kind)
+        rows.sort(key=lambda row: row['mag'])
+
+        cell = Site.cellOf(todegrees(observer.long), todegrees(observer.lat))
+        try:
+            screened = self._screenCatalog(cell, int(now // self.WHATSUP_BUCKET))
+            sky_catalog = self._getCatalog()
+            objects = [sky_catalog.getObject(i) for i in screened]
+        except (IOError, OSError) as e:
+            logging.error('Catalog lookup failed: %s', e)
+            objects = []
+        for sky_object in objects:
+            if len(rows) >= self.MAX_WHATSUP:
+                break
+            append(sky_object.toBody(), sky_object.getKind(), sky_object.getMag(), sky_object.getConstellation())
+
+        if not rows:
+            return Reply.message('Nothing above %d\u00B0.' % self.WHATSUP_MIN_ALT)
+        return Reply('whatsup', {'time': toLocalDateTime(observer.date, zone), 'min_alt': self.WHATSUP_MIN_ALT,
+                                 'objects': Rows('skyobject', rows)}, zone)
+
+    @botcmd(thread=True)
+    def overhead(self, mess, args):
+        """overhead [minutes] [location] - show sunlit satellites above the horizon in next minutes (default 10)
+        """
+        return self._dispatchRequest('overhead', self._parseRequest(mess, 'overhead', args))
+
+    def _overhead(self, jid, loc, minutes):
+        """ Return Reply with satellites of TLE catalog above horizon and sunlit from now during minutes
+        """
+        observer, zone = self._getObserver(jid, loc)
+        observer.date = ephem.now()
+        try:
+            with commandStats.timing('ephem'):
+                count, shown = self._getSatellites().scan(observer, minutes, self.MAX_OVERHEAD)
+        except (IOError, OSError) as e:
+            logging.error('Satellite catalog lookup failed: %s', e)
+            return Reply.message('Satellite catalog is not available.')
+        if not shown:
+            return Reply.message('No sunlit satellite above the horizon.')
+        return Reply('overhead', {'count': count, 'minutes': minutes,
+                                  'shown': len(shown) if len(shown) < count else None,
+                                  'passes': SatellitePasses.fromPassInfos(shown).toReply(zone)}, zone)
+
+    def _screenCatalogCell(self, cell, bucket):
+        """ Return indexes of catalog objects above horizon of cell center at start of time bucket
+        """
+        lat, lng = geohash.decode(cell)
+        observer = ephem.Observer()
+        observer.long, observer.lat = toradians(lng), toradians(lat)
+        observer.date = ephem.Date(datetime.datetime.utcfromtimestamp(bucket * self.WHATSUP_BUCKET))
+        with commandStats.timing('ephem'):
+            return tuple(self._getCatalog().above(observer.sidereal_time(), observer.lat,
+                                             self.WHATSUP_MIN_ALT - self.WHATSUP_MARGIN, 2 * self.MAX_WHATSUP))
 
     @botcmd
     def reg(self, mess, args):
@@ -318,14 +612,39 @@ class SkybberBot(MUCJabberBot):
     def prof(self, mess, args):
         """prof - show user profile
         """
+        ctx = self._getUserContext(mess.getFrom().getStripped())
+        user = self._checkRegistered(ctx)
+        reply = '\nJID :' + user.getJID() + '\nDescription: ' + user.getProfileDescription() + '\nDefault location: '
+        loc = ctx.getDefaultLocation()
+        if loc is None:
+            reply += 'undefined.'
+        else:
+            reply += loc.getName()
+        reply += '\nTime zone: ' + (user.getTimeZone() or 'auto')
+        return reply
+
+    @botcmd(allowed_roles={'registered'})
+    def tz(self, mess, args):
+        """tz [zone|auto] - show or set time zone, example: tz Europe/Prague. auto - zone of location
+        """
+        strjid = mess.getFrom().getStripped()
+        zone = args.strip()
+        if not zone:
+            user = self._checkRegistered(self._getUserContext(strjid))
+            if user.getTimeZone() is not None:
+                return 'Time zone: ' + user.getTimeZone()
+            _, inferred = self._getObserver(strjid, None)
+            return 'Time zone: auto (' + (inferred or 'server time') + ')'
         with MasterDBConnection() as c:
-            user = self._getUser(c, mess.getFrom().getStripped())
-            reply = '\nJID :' + user.getJID() + '\nDescription: ' + user.getProfileDescription() + '\nDefault location: '
-            loc = user.getDefaultLocation(c)
-            if loc is None:
-                reply += 'undefined.'
+            user = self._getUser(c, strjid)
+            if zone == 'auto':
+                user.setTimeZone(c, None)
+                reply = 'Time zone will be taken from location.'
+            elif isValidZone(zone):
+                user.setTimeZone(c, zone)
+                reply = 'Time zone set to ' + zone + '.'
             else:
-                reply += loc.getName()
+                reply = 'Unknown time zone: ' + zone
         return reply
 
     @botcmd(allowed_roles={'registered'})
@@ -378,20 +697,34 @@ class SkybberBot(MUCJabberBot):
         return reply
 
 
+    @botcmd
+    def place(self, mess, args):
+        """place <name> - find places starting with name, places can be used as location
+        """
+        name = args.strip()
+        if not name:
+            return 'Argument  - place name - expected.'
+        try:
+            places = self._getGazetteer().findPrefix(name, self.MAX_PLACES)
+        except (IOError, OSError) as e:
+            logging.error('Gazetteer lookup failed: %s', e)
+            return 'Gazetteer is not available.'
+        if not places:
+            return 'No place found: ' + name
+        return '\n' + '\n'.join(place.getInfo() for place in places)
+
     @botcmd(allowed_roles={'registered'})
     def lsloc(self, mess, args):
         """lsloc - show the list of locations
         """
+        strjid = mess.getFrom().getStripped()
         with MasterDBConnection() as c:
-            user = self._getUser(c, mess.getFrom().getStripped())
-            def_loc = user.getDefaultLocation(c)
-            reply = '\nUser locations : \n'
-            for loc in user.getUserLocationList(c):
-                reply += loc.getInfo()
-                if def_loc is not None and def_loc.getLocationId() == loc.getLocationId():
-                    reply += '  *'
-                reply += '\n'
-        return reply
+            user, locations = User.getUserLocationListByJID(c, strjid)
+        if user is None:
+            raise CmdError('User ' + strjid + ' is not registered.')
+        rows = [{'name': loc.getName(), 'lng': loc.getLng(), 'lat': loc.getLat(),
+                 'default': '*' if user.getDefaultLocationId() == loc.getLocationId() else None} for loc in locations]
+        return Reply('lsloc', {'locations': Rows('location', rows)})
 
     def check_role(self, allowed_roles, mess):
         """Overridden from JabberBot
@@ -407,30 +740,503 @@ class SkybberBot(MUCJabberBot):
                 permit = not user_roles.isdisjoint(allowed_roles)
         return permit
 
+    @botcmd(hidden=True, allowed_roles={'admin'})
+    def stats(self, mess, args):
+        """stats - show per-command latency and per-room message statistics
+        """
+        self._checkAdmin(mess, 'stats')
+        reply = commandStats.formatText() + roomStats.formatText() + self._ephemeris.formatText()
+        if self._response_cache is not None:
+            reply += self._response_cache.formatText()
+        return reply
+
+    @botcmd(hidden=True, allowed_roles={'admin'})
+    def profdump(self, mess, args):
+        """profdump [file] - show or write collapsed stacks of profiled commands
+        """
+        self._checkAdmin(mess, 'profdump')
+        if self.profiler is None:
+            return 'Profiling is disabled.'
+        path = args.strip()
+        if path:
+            self.profiler.dump(path)
+            return 'Profile written to ' + path
+        return self.profiler.format_collapsed() or 'No slow command profiled.'
+
+    @botcmd(hidden=True, name='dbimport', allowed_roles={'admin'})
+    def dbimport(self, mess, args):
+        """dbimport <file> - import users and locations from CSV/JSONL file
+        """
+        self._checkAdmin(mess, 'dbimport')
+        from .bulkdata import importLocations, detectFormat
+        path = args.strip()
+        if not path:
+            return 'Argument  - file name - expected.'
+        conn = sqlite3.connect(MasterDBConnection.SKYBBER_DB)
+        try:
+            with open(path, newline='') as f:
+                result = importLocations(conn, f, detectFormat(path), self.MAX_USER_LOCATIONS)
+        except IOError as e:
+            raise CmdError('Import failed: ' + str(e))
+        finally:
+            conn.close()
+            if self._response_cache is not None:
+                self._response_cache.clear()
+        return result.format()
+
+    @botcmd(hidden=True, name='dbexport', allowed_roles={'admin'})
+    def dbexport(self, mess, args):
+        """dbexport <file> - export users and locations to CSV/JSONL file
+        """
+        self._checkAdmin(mess, 'dbexport')
+        from .bulkdata import exportLocations, detectFormat
+        path = args.strip()
+        if not path:
+            return 'Argument  - file name - expected.'
+        conn = sqlite3.connect(MasterDBConnection.SKYBBER_DB)
+        try:
+            with open(path, 'w', newline='') as f:
+                count = exportLocations(conn, f, detectFormat(path))
+        except IOError as e:
+            raise CmdError('Export failed: ' + str(e))
+        finally:
+            conn.close()
+        return 'Exported rows: ' + str(count)
+
+    @botcmd(hidden=True, allowed_roles={'admin'})
+    def join(self, mess, args):
+        """join <room> [nick] [password] - join multi user chat room, the room is rejoined after restart
+        """
+        self._checkAdmin(mess, 'join')
+        sargs = args.split()
+        if len(sargs) not in (1, 2, 3):
+            return 'Arguments  - room [nick] [password] - expected.'
+        jid = sargs[0]
+        with MasterDBConnection() as c:
+            if Room.getRoomByJID(c, jid) is not None:
+                return 'Room ' + jid + ' already joined.'
+            room = Room.create(c, jid, sargs[1] if len(sargs) > 1 else None, sargs[2] if len(sargs) > 2 else None)
+        self.muc_add_room(room)
+        return 'Room ' + jid + ' joined.'
+
+    @botcmd(hidden=True, allowed_roles={'admin'})
+    def part(self, mess, args):
+        """part <room> - leave multi user chat room
+        """
+        self._checkAdmin(mess, 'part')
+        jid = args.strip()
+        with MasterDBConnection() as c:
+            room = Room.getRoomByJID(c, jid)
+            if room is None:
+                return 'Unknown room: ' + jid
+            room.delete(c)
+        self.muc_remove_room(jid)
+        return 'Room ' + jid + ' left.'
+
+    @botcmd(hidden=True, name='rooms', allowed_roles={'admin'})
+    def lsrooms(self, mess, args):
+        """rooms - list joined multi user chat rooms
+        """
+        self._checkAdmin(mess, 'rooms')
+        if not self.rooms:
+            return 'No room joined.'
+        return '\n' + '\n'.join(self.rooms[jid].getInfo() for jid in sorted(self.rooms))
+
+    @botcmd(hidden=True, allowed_roles={'admin'})
+    def roomloc(self, mess, args):
+        """roomloc <room> <longitude> <latitude> | <room> <place> - set default location of room
+        """
+        self._checkAdmin(mess, 'roomloc')
+        sargs = args.split()
+        if len(sargs) == 3:
+            lng, lat, error = TypeDetector.parseCoordinates(sargs[1], sargs[2])
+            if error is not None:
+                return error
+            loc_name, zone = None, None
+        elif len(sargs) == 2:
+            place = self._findPlace(sargs[1])
+            if place is None:
+                return 'No place found: ' + sargs[1]
+            loc_name, lng, lat, zone = place.getName(), place.getLng(), place.getLat(), place.getTimeZone()
+        else:
+            return 'Arguments  - room longitude latitude or room place - expected.'
+        room = self.rooms.get(sargs[0])
+        if room is None:
+            return 'Unknown room: ' + sargs[0]
+        if zone is None:
+            try:
+                zone = self._getGazetteer().findZone(lng, lat)
+            except (IOError, OSError) as e:
+                logging.error('Gazetteer lookup failed: %s', e)
+        with MasterDBConnection() as c:
+            room.setLocation(c, loc_name, lng, lat, zone)
+        return 'Room location set: ' + room.getInfo()
+
+    @botcmd(hidden=True, allowed_roles={'admin'})
+    def near(self, mess, args):
+        """near <lng> <lat> [km] - list user locations within radius (default 50 km)
+        """
+        self._checkAdmin(mess, 'near')
+        sargs = args.split()
+        if len(sargs) not in (2, 3):
+            return 'Arguments  - longitude latitude [km] - expected.'
+        lng, lat, error = TypeDetector.parseCoordinates(sargs[0], sargs[1])
+        if error is not None:
+            return error
+        try:
+            radius = float(sargs[2]) if len(sargs) == 3 else 50.0
+        except ValueError:
+            return 'Radius in km expected.'
+        with MasterDBConnection() as c:
+            found = Site.getLocationsWithinRadius(c, lng, lat, radius)
+        if not found:
+            return 'No location within ' + str(radius) + ' km.'
+        reply = ''
+        for distance, jid, name in found:
+            reply += '\n' + '%7.2f km  ' % distance + jid + ' : ' + name
+        return reply
+
     def execute_command(self, mess, cmd, args):
-        """ Overridden from JabberBot
+        """ Overridden from JabberBot, return Reply or text of command
         """
+        commandStats.begin()
+        self._request.contexts = {}
+        self._request.expires = None
+        outcome = CommandStats.ERROR
         try:
-            reply = MUCJabberBot.execute_command(self, mess, cmd, args)
+            key = self._responseCacheKey(mess, cmd, args)
+            reply = self._getReply(key, lambda: MUCJabberBot.execute_command(self, mess, cmd, args))
+            outcome = CommandStats.OK
         except CmdError as e:
             reply = e.value
+            outcome = CommandStats.CMD_ERROR
+        finally:
+            self._request.contexts = None
+            if cmd in self.MUTATING_COMMANDS and self._response_cache is not None:
+                self._response_cache.invalidate(mess.getFrom().getStripped())
+            commandStats.end(cmd, outcome)
+        return reply
+
+    def send_simple_reply(self, mess, text, private=False, xhtml=None):
+        """ Overridden from JabberBot, Reply is sent as text with its XHTML-IM
+        """
+        if isinstance(text, Reply):
+            text, xhtml = text.toText(), text.toXhtml()
+        MUCJabberBot.send_simple_reply(self, mess, text, private, xhtml)
+
+    def executeRequest(self, cmd, request):
+        """ Return Reply of command of REQUEST_COMMANDS for transport neutral CommandRequest,
+            used by HTTP API. Replies are shared with chat commands by response cache.
+            Raise CmdError if request is invalid
+        """
+        if cmd not in self.REQUEST_COMMANDS:
+            raise CmdError('Unknown command: ' + cmd)
+        commandStats.begin()
+        self._request.contexts = {}
+        self._request.expires = None
+        outcome = CommandStats.ERROR
+        try:
+            reply = self._getReply(self._requestCacheKey(cmd, request), lambda: self._dispatchRequest(cmd, request))
+            outcome = CommandStats.OK
+            return reply
+        except CmdError:
+            outcome = CommandStats.CMD_ERROR
+            raise
+        finally:
+            self._request.contexts = None
+            commandStats.end(cmd, outcome)
+
+    def _getReply(self, key, compute):
+        """ Return cached reply of key or reply returned by compute, Reply is cached
+        """
+        reply = self._response_cache.get(key) if key is not None else None
+        if reply is None:
+            reply = compute()
+            if key is not None and isinstance(reply, Reply):
+                self._putResponse(key, reply)
         return reply
 
-    def _satteliteRequest(self, mess, args, satid):
-        """ TODO:
+    def _parseRequest(self, mess, cmd, args):
+        """ Return CommandRequest of arguments of chat command, options preceding date
+            and location are kept as flags
         """
-        jid, loc, _ = self._parseJidLocTime(mess, args)
-        lng, lat = self._getObserverStrCoord(jid, loc)
-        req = urllib.request.Request('http://uhaapi-skybber.rhcloud.com/satellites/' + satid + '/passes?lat=' + lat + '&lng=' + lng, None, {})
-        req.addheader('Accept', 'application/xml')
+        flags, args = self._splitCommandFlags(cmd, args)
+        return CommandRequest.parse(mess.getFrom().getStripped(), args, parse_date=cmd not in self.UNDATED_COMMANDS,
+                                    flags=flags)
 
+    def _dispatchRequest(self, cmd, request):
+        """ Return Reply of command of REQUEST_COMMANDS computed for request
+        """
+        jid, loc, dt, flags = request.getJID(), request.getLocation(), request.getDate(), request.getFlags()
+        if cmd in self.BODY_COMMANDS:
+            return self._bodyCommand(cmd, jid, loc, dt)
+        if cmd == 'night':
+            return self._night(jid, loc, dt)
+        if cmd == 'tw':
+            return self._twAll(jid, loc, dt) if flags else self._tw(jid, loc, dt)
+        if cmd == 'phases':
+            return self._phases(jid, loc, dt)
+        if cmd == 'whatsup':
+            return self._whatsup(jid, loc)
+        if cmd == 'overhead':
+            minutes = int(flags) if flags else self.OVERHEAD_MINUTES
+            if not 0 < minutes <= self.MAX_OVERHEAD_MINUTES:
+                raise CmdError('Minutes from 1 to %d expected.' % self.MAX_OVERHEAD_MINUTES)
+            return self._overhead(jid, loc, minutes)
+        if cmd == 'satpass':
+            satids, _, error = self._checkArgSatIds(flags)
+            if error is not None:
+                raise CmdError(error)
+            return self._satteliteRequest(jid, loc, satids)
+        if cmd == 'iss':
+            return self._satteliteRequest(jid, loc, ['25544'])
+        if cmd == 'iri':
+            return self._iri(jid, loc)
+        raise CmdError('Unknown command: ' + cmd)
+
+    def _responseCacheKey(self, mess, cmd, args):
+        """ Return key of cached reply of chat command or None if reply is not cached
+        """
+        if self.RESPONSE_CACHE_RULES.get(cmd) is None or self._response_cache is None:
+            return None
+        try:
+            request = self._parseRequest(mess, cmd, args)
+        except CmdError:
+            return None
+        return self._requestCacheKey(cmd, request)
+
+    def _requestCacheKey(self, cmd, request):
+        """ Return key of cached reply of command or None if reply is not cached.
+            Location is resolved to site cell and zone.
+        """
+        rule = self.RESPONSE_CACHE_RULES.get(cmd)
+        if rule is None or self._response_cache is None:
+            return None
+        try:
+            observer, zone = self._getObserver(request.getJID(), request.getLocation())
+        except CmdError:
+            return None
+        dt, flags = request.getDate(), request.getFlags()
+        cell = Site.cellOf(todegrees(observer.long), todegrees(observer.lat))
+        if rule == 'pass':
+            bucket = None
+        else:
+            bucket = self._getNoon(dt, zone)
+            if rule != 'day':
+                bucket = (bucket, int(time.time() // self.RESPONSE_CACHE_PERIODS[rule]))
+        return (cmd, flags, cell, observer.elevation, zone, bucket)
+
+    def _splitCommandFlags(self, cmd, args):
+        """ Return (flags, rest of args) of command options preceding date and location:
+            'all' of tw, minutes of overhead, satellite ids of satpass
+        """
+        pargs = args.strip().split(None, 1)
+        rest = pargs[1] if len(pargs) > 1 else ''
+        if cmd == 'tw' and pargs and pargs[0].lower() == 'all':
+            return 'all', rest
+        if cmd == 'satpass':
+            return (pargs[0], rest) if pargs else ('', '')
+        # number followed by single number are coordinates
+        if cmd == 'overhead' and pargs and pargs[0].isdigit() and not (len(rest.split()) == 1 and is_number(rest)):
+            return pargs[0], rest
+        return '', args
+
+    def _putResponse(self, key, reply):
+        """ Cache reply until end of time bucket of key or until expiration set by command
+        """
+        now = time.time()
+        rule = self.RESPONSE_CACHE_RULES[key[0]]
+        if rule == 'pass':
+            expires = now + self.SATELLITE_CACHE_TTL
+        else:
+            period = self.RESPONSE_CACHE_PERIODS[rule]
+            expires = (now // period + 1) * period if rule != 'day' else now + period
+        if self._request.expires is not None:
+            expires = min(expires, self._request.expires)
+        if expires > now:
+            self._response_cache.put(key, reply, len(reply.toText().encode('utf-8')), expires)
+
+    def serve_forever(self, connect_callback=None, disconnect_callback=None):
+        """ Overridden from JabberBot, stored ephemerides and satellite catalog are loaded in background
+        """
+        thread = threading.Thread(target=self._warmup, name='warmup')
+        thread.daemon = True
+        thread.start()
+        if self._http_address[1] is not None:
+            from .httpapi import HttpApi
+            self._http_api = HttpApi(self, *self._http_address)
+            self._http_api.start()
+        MUCJabberBot.serve_forever(self, connect_callback, disconnect_callback)
+
+    def _getData(self, name, create):
+        """ Return data object of name, it is created by create on first use
+        """
+        data = self._data.get(name)
+        if data is None:
+            with self._data_lock:
+                data = self._data.get(name)
+                if data is None:
+                    data = self._data[name] = create()
+        return data
+
+    def _getGazetteer(self):
+        return self._getData('gazetteer', lambda: gazetteer.Gazetteer(self._gazetteer_path or gazetteer.DEFAULT_TSV,
+                                                                      self._gazetteer_index))
+
+    def _getCatalog(self):
+        return self._getData('catalog', lambda: catalog.Catalog(self._catalog_path or catalog.DEFAULT_TSV,
+                                                                self._catalog_index))
+
+    def _getSatellites(self):
+        return self._getData('satellites', lambda: satscan.SatelliteCatalog(self._satellites_path or satscan.DEFAULT_TLE))
+
+    def _getFlares(self):
+        return self._getData('flares', lambda: flares.FlarePredictor(self._getSatellites(), max_mag=self.FLARE_MAX_MAG))
+
+    def _getAlmanac(self):
+        return self._getData('almanac', lambda: almanac.Almanac(self._almanac_path or almanac.DEFAULT_PATH))
+
+    def preload(self):
+        """ Open gazetteer, catalog, almanac, stored ephemerides and satellite catalog,
+            used before forking workers of batch runs, so that they share loaded data
+        """
+        for data in (self._getGazetteer(), self._getCatalog()):
+            try:
+                data.open()
+            except (IOError, OSError) as e:
+                logging.warning('Data file not loaded: %s', e)
+        self._warmup()
+
+    def _warmup(self):
+        self._ephemeris.open()
+        # almanac table is built here, not by the first phases command
+        try:
+            self._getAlmanac().open()
+        except (IOError, OSError) as e:
+            logging.warning('Almanac not loaded: %s', e)
+        try:
+            self._getSatellites().open()
+        except (IOError, OSError) as e:
+            logging.warning('Satellite catalog not loaded: %s', e)
+
+    def shutdown(self):
+        """ Overridden from JabberBot
+        """
+        if self._http_api is not None:
+            self._http_api.stop()
+        self.flushEphemeris(force=True)
+        if self._satellite_executor is not None:
+            self._satellite_executor.shutdown(wait=False)
+
+    def flushEphemeris(self, force=False):
+        """ Write stored ephemerides if enough of them are pending, xmpp loop calls it
+            from idle_proc, HTTP API and batch runs call it themselves
+        """
+        return self._ephemeris.flush(force)
+
+    def idle_proc(self):
+        """ Overridden from JabberBot
+        """
+        MUCJabberBot.idle_proc(self)
+        self.flushEphemeris()
+        if self._stats_file and time.time() - self._stats_file_written > self.STATS_FILE_FREQUENCY:
+            self._stats_file_written = time.time()
+            try:
+                commandStats.writePrometheus(self._stats_file, roomStats.formatPrometheus())
+            except IOError as e:
+                logging.error('Error writing stats file %s: %s', self._stats_file, e)
+
+    def _checkAdmin(self, mess, cmd):
+        """ Pretend unknown command if sender is not admin
+        """
+        if not self.check_role({'admin'}, mess):
+            raise CmdError(self.MSG_UNKNOWN_COMMAND % {'command': cmd, 'helpcommand': 'help'})
+
+    def _satteliteRequest(self, jid, loc, satids):
+        """ Return Reply with passes of satellites ordered by time, passes of more
+            satellites are fetched concurrently
+        """
+        lng, lat, zone = self._getObserverStrCoord(jid, loc)
+        with commandStats.timing('http'):
+            if len(satids) == 1:
+                sp = self._getSatellitePasses(satids[0], lat, lng)
+            else:
+                sp = SatellitePasses.merge(list(self._getSatelliteExecutor().map(
+                    lambda satid: self._getSatellitePasses(satid, lat, lng), satids)))
+        first_pass = sp.getFirstPassDate()
+        if first_pass is not None:
+            # cached reply expires when the first pass begins
+            self._request.expires = toUnixTime(first_pass)
+        return sp.toReply(zone)
+
+    def _getSatellitePasses(self, satid, lat, lng):
+        """ Return SatellitePasses of satellite from ephemeris store or from satellite service
+        """
+        key = satid + ' ' + lat + ' ' + lng
+        stored = self._ephemeris.get('passes', key)
+        if stored is not None:
+            sp = SatellitePasses(satid)
+            sp.parseFromXml(stored.encode('utf-8'))
+            first_pass = sp.getFirstPassDate()
+            if first_pass is not None and first_pass > ephem.now():
+                return sp
+        req = urllib_request.Request(self.SATELLITE_SERVICE_URL + satid + '/passes?lat=' + lat + '&lng=' + lng, None, {})
+        req.add_header('Accept', 'application/xml')
         try:
-            reply = urllib.request.urlopen(req).read()
-            sp = SatellitePasses()
-            sp.parseFromXml(reply)
-            return sp.format()
-        except urllib2.URLError:
-            return 'Service disconnected.'
+            reply = urllib_request.urlopen(req).read()
+        except urllib_error.URLError:
+            raise CmdError('Service disconnected.')
+        sp = SatellitePasses(satid)
+        sp.parseFromXml(reply)
+        first_pass = sp.getFirstPassDate()
+        if first_pass is not None:
+            self._ephemeris.put('passes', key, first_pass, reply.decode('utf-8'))
+        return sp
+
+    def _getSatelliteExecutor(self):
+        """ Return thread pool fetching passes of satellites, created on first use
+        """
+        if self._satellite_executor is None:
+            self._satellite_executor = futures.ThreadPoolExecutor(max_workers=self.MAX_SATELLITES,
+                                                                  thread_name_prefix='satellite')
+        return self._satellite_executor
+
+    def _loadRooms(self, config_rooms):
+        """ Register rooms stored in database and rooms of config missing in database
+        """
+        with MasterDBConnection() as c:
+            rooms = dict((room.getJID(), room) for room in Room.getRooms(c))
+            for spec in config_rooms:
+                jid, _, nick = spec.partition('/')
+                if jid not in rooms:
+                    rooms[jid] = Room.create(c, jid, nick or None)
+        for room in rooms.values():
+            self.muc_add_room(room)
+
+    def _getUserContext(self, jid, loc_name=None):
+        """ Return UserContext of jid. Contexts are remembered during execution of a command,
+            so that role check and observer lookups share one DB query. Anonymous
+            requester (jid None) of HTTP API has no user.
+        """
+        if jid is None:
+            return UserContext(None, loc_name, None, None, None, None)
+        contexts = getattr(self._request, 'contexts', None)
+        if contexts is not None:
+            ctx = contexts.get(jid)
+            if ctx is not None and (loc_name is None or ctx.getLocName() == loc_name):
+                return ctx
+        with MasterDBConnection() as c:
+            ctx = UserContext.load(c, jid, loc_name)
+        if contexts is not None:
+            contexts[jid] = ctx
+        return ctx
+
+    def _checkRegistered(self, ctx):
+        """ Return registered user of context
+        """
+        if ctx.getUser() is None:
+            raise CmdError('User ' + ctx.getJID() + ' is not registered.')
+        return ctx.getUser()
 
     def _getUser(self, c, strjid, reg_check=True):
         """ Return registered user
@@ -441,55 +1247,98 @@ class SkybberBot(MUCJabberBot):
         return user
 
     def _getObserverByName(self, jid, loc_name = None):
-        """Create observer object initialized from location
+        """Create observer object initialized from location, return (observer, zone)
 
         1. It looks for location by location_name for given user(jid)
-        2. if not exists  then it looks for user default location
-        3. if not exists then returns first user location
+        2. if not exists then it looks for place of location_name in gazetteer
+        3. if not exists then it looks for user default location
+        4. if not exists then returns first user location
         """
         observer = None
-        with MasterDBConnection() as c:
-            user = self._getUser(c, jid, reg_check=False)
-            if user is not None:
-                if loc_name is not None:
-                    loc = user.getLocationByName(c, loc_name)
-                    # TODO : return message if loc is None
-                else:
-                    loc = user.getDefaultLocation(c)
-                    if loc is None:
-                        loc = user.getUserLocationList(c, 1)
-                if loc is not None:
-                    observer = ephem.Observer()
-                    observer.long, observer.lat = toradians(loc.getLng()), toradians(loc.getLat())
-                    observer.elevation = 0
+        place_zone = None
+        # TODO : return message if named location is None
+        ctx = self._getUserContext(jid, loc_name)
+        loc = ctx.getObserverLocation()
+        if loc is None and loc_name is not None:
+            loc = self._findPlace(loc_name)
+            if loc is not None:
+                place_zone = loc.getTimeZone()
+        if loc is not None:
+            observer = ephem.Observer()
+            observer.long, observer.lat = toradians(loc.getLng()), toradians(loc.getLat())
+            observer.elevation = 0
         if observer is None:
-            observer = self._obsr_default
-        return observer
+            observer = self._getDefaultObserver()
+        return observer, self._getZone(ctx, observer, place_zone)
+
+    def _getZone(self, ctx, observer, place_zone=None):
+        """Return time zone of user: zone set by tz command, zone of gazetteer place,
+           zone inferred from observer's position or None (server time)
+        """
+        user = ctx.getUser()
+        if user is not None and user.getTimeZone() is not None:
+            return user.getTimeZone()
+        if place_zone is not None:
+            return place_zone
+        try:
+            return self._getGazetteer().findZone(todegrees(observer.long), todegrees(observer.lat))
+        except (IOError, OSError) as e:
+            logging.error('Gazetteer lookup failed: %s', e)
+            return None
+
+    def _findPlace(self, loc_name):
+        """Return gazetteer place of name or None
+        """
+        try:
+            return self._getGazetteer().find(loc_name)
+        except (IOError, OSError) as e:
+            logging.error('Gazetteer lookup failed: %s', e)
+            return None
+
+    def _getDefaultObserver(self):
+        """Return observer used when user has no location, created on first use
+        """
+        if self._obsr_default is None:
+            observer = ephem.Observer()
+            observer.long, observer.lat = '15.05728', '50.76111'
+            observer.elevation = 400
+            self._obsr_default = observer
+        return self._obsr_default
 
     def _getObserver(self, jid, loc):
-        """Return copy of observer object
+        """Return (copy of observer object, time zone of observer)
         """
         obsrv =  ephem.Observer()
 
-        if loc is not None:
-            if loc.getName() is not None:
-                co = self._getObserverByName(jid, loc_name=loc.getName())
-                obsrv.long, obsrv.lat, obsrv.elevation = co.long, co.lat, co.elevation
-            else:
-                obsrv.long, obsrv.lat = loc.getLng(), loc.getLat()
-        else:
-            co = self._getObserverByName(jid)
-            obsrv.long, obsrv.lat, obsrv.elevation = co.long, co.lat, co.elevation
-
-        return obsrv
+        room = self.rooms.get(jid) if loc is None else None
+        if room is not None and room.getLocation() is not None:
+            location = room.getLocation()
+            obsrv.long, obsrv.lat = toradians(location.getLng()), toradians(location.getLat())
+            return obsrv, room.getTimeZone()
+
+        if loc is not None and loc.getName() is None:
+            obsrv.long, obsrv.lat = toradians(loc.getLng()), toradians(loc.getLat())
+            return obsrv, self._getZone(self._getUserContext(jid), obsrv)
+
+        # resolution of user location or place name is cached until the user changes it
+        loc_name = loc.getName() if loc is not None else None
+        key = ('observer', jid, loc_name)
+        resolved = self._response_cache.get(key) if self._response_cache is not None else None
+        if resolved is None:
+            co, zone = self._getObserverByName(jid, loc_name=loc_name)
+            resolved = (co.long, co.lat, co.elevation, zone)
+            if self._response_cache is not None:
+                self._response_cache.put(key, resolved, 0, time.time() + self.OBSERVER_CACHE_TTL, owner=jid)
+        obsrv.long, obsrv.lat, obsrv.elevation, zone = resolved
+        return obsrv, zone
 
     def _getObserverStrCoord(self, jid, loc):
-        """Get observer's coordinations in string form
+        """Get observer's coordinations in string form and observer's time zone
         """
-        observer = self._getObserver(jid, loc)
+        observer, zone = self._getObserver(jid, loc)
         lng = todegrees(observer.long)
         lat = todegrees(observer.lat)
-        return ("%0.3f" % lng), ("%0.3f" % lat)
+        return ("%0.3f" % lng), ("%0.3f" % lat), zone
 
     def _checkArgSatId(self, args):
         satid = None
@@ -506,45 +1355,39 @@ class SkybberBot(MUCJabberBot):
                 reply = 'Argument expected. Please specify satellite ID.'
         return (satid, next_args, reply)
 
+    def _checkArgSatIds(self, args):
+        """ Return (list of satellite ids, rest of args, error reply) of 'id[,id...] ...' arguments
+        """
+        pargs = args.strip().split(None, 1)
+        if not pargs:
+            return (None, None, 'Argument expected. Please specify satellite ID.')
+        satids = []
+        for sval in pargs[0].split(','):
+            try:
+                satid = str(int(sval))
+            except ValueError:
+                return (None, None, 'Invalid satellite ID: ' + sval)
+            if satid not in satids:
+                satids.append(satid)
+        if len(satids) > self.MAX_SATELLITES:
+            return (None, None, 'At most %d satellites expected.' % self.MAX_SATELLITES)
+        return (satids, pargs[1] if len(pargs) > 1 else '', None)
+
     def _getUserRoles(self, jid):
         """Return list of user's roles
         """
-        with MasterDBConnection() as c:
-            user = self._getUser(c, jid, reg_check=False)
-            if user is not None:
-                return {'registered'}
-        return None
+        roles = self._getUserContext(jid).getRoles()
+        if jid in self._admin_jids:
+            roles.add('admin')
+        return roles or None
 
     def _doAddLoc(self, c, user, loc_name, sval1, sval2):
         """ Add location to list of locations. It reads geographic position in angle or geo format
         """
 
-        val1 = TypeDetector(sval1)
-        val2 = TypeDetector(sval2)
-
-        lng = 0.0
-        lat = 0.0
-
-        if val1.getType() == TypeDetector.FLOAT:
-            if val2.getType() == TypeDetector.FLOAT:
-                lng = val1.getTypeValue()
-                lat = val2.getTypeValue()
-            else:
-                return 'Invalid argument: "' + sval2 + '".  Number is expected.'
-        elif val1.getType() == TypeDetector.LOCATION_LONG:
-            if val2.getType() == TypeDetector.LOCATION_LAT:
-                lng = val1.getTypeValue()
-                lat = val2.getTypeValue()
-            else:
-                return 'Invalid argument: "' + sval2 + u'". Latitude expected. Example: 15??3\'53.856"E'
-        elif val1.getType() == TypeDetector.LOCATION_LAT:
-            if val2.getType() == TypeDetector.LOCATION_LONG:
-                lat = val1.getTypeValue()
-                lng = val2.getTypeValue()
-            else:
-                return 'Invalid argument: "' + sval2 + u'". Longitude expected. Example: 50??46\'1.655"N'
-        else:
-            return 'Invalid format of argument value: "' + sval1 + '". Use help for .'
+        lng, lat, error = TypeDetector.parseCoordinates(sval1, sval2)
+        if error is not None:
+            return error
 
         loc = user.getLocationByName(c, loc_name)
 
@@ -558,7 +1401,7 @@ class SkybberBot(MUCJabberBot):
                     user.setDefaultLocation(c, loc)
                     reply += ' Location set as default location.'
             else:
-                reply = 'Add location failed. Number of user locations exceeded limit ' + self.MAX_USER_LOCATIONS
+                reply = 'Add location failed. Number of user locations exceeded limit ' + str(self.MAX_USER_LOCATIONS)
         else:
             reply = 'Location "' + loc.getInfo() + '" already exists.'
 
@@ -570,64 +1413,85 @@ class SkybberBot(MUCJabberBot):
             result += 'never rising.'
         else:
             result += 'never setting.'
+        return result
 
-    def _doInnerBodyEphem(self, mess, args, unic_symb, body, with_constell_mag=True):
-        body.compute()
-
-        elong = math.degrees(body.elong)
+    def _bodyCommand(self, cmd, jid, loc, dt):
+        """ Return Reply of body command of BODY_COMMANDS
+        """
+        unic_symb, name, inner, options = self.BODY_COMMANDS[cmd]
+        body = getattr(ephem, name)()
+        if inner:
+            return self._innerBodyEphem(jid, loc, dt, unic_symb, body, **options)
+        return self._bodyEphem(jid, loc, dt, unic_symb, body, **options)
+
+    def _innerBodyEphem(self, jid, loc, dt, unic_symb, body, with_constell_mag=True):
+        """ Return Reply with next setting (evening elongation) or rising (morning elongation) of inner planet
+        """
+        observer, zone = self._getObserver(jid, loc)
+        if dt is None:
+            dt = self._getNoonDateTimeFrom6To6(zone)
+        next_rising, next_setting, riset, state = self._getNextRiseSetting(observer, body, dt, horizon='0.0')
 
-        jid, loc, dt = self._parseJidLocTime(mess, args)
-        next_rising, next_setting, riset = self._getNextRiseSetting(jid, body, dt=dt, loc=loc, horizon='0.0')
+        elong = state['elong']
+        values = {'symbol': unic_symb, 'elong': elong}
+        if with_constell_mag:
+            values['mag'] = state['mag']
+            values['constellation'] = state['constellation']
 
         if riset == SkybberBot.RISET_OK:
-            if elong > 0.0:
-                result = unic_symb + ' ' + SkybberBot.UNICODE_RISE + formatLocalTime(next_setting)
-            else:
-                result = unic_symb + ' ' + SkybberBot.UNICODE_RISE + formatLocalTime(next_rising)
+            values['time'] = toLocalDateTime(next_setting if elong > 0.0 else next_rising, zone)
         else:
-            result = self._fmtRiSetFailMsg(body, riset)
+            values['message'] = self._fmtRiSetFailMsg(body, riset)
+        return Reply('inner', values, zone)
 
-        result += '  Elong ' + ("%0.2f" % elong)
-
-        if with_constell_mag:
-            result += '  ' + str(body.mag) + 'm'
-            result += '  [ ' +  ephem.constellation(body)[1] + ' ]'
-        return result
-
-    def _doBodyEphem(self, mess, args, unic_symb, body, with_constell_mag=True, rising_first=True):
-        """ Return next rise/setting for specified body.
+    def _bodyEphem(self, jid, loc, dt, unic_symb, body, with_mag=True, with_constellation=True, with_phase=False, rising_first=True):
+        """ Return Reply with next rise/setting for specified body.
         """
-        body.compute()
-
-        jid, loc, dt = self._parseJidLocTime(mess, args)
-        next_rising, next_setting, riset = self._getNextRiseSetting(jid, body, dt=dt, loc=loc, horizon='0.0')
+        observer, zone = self._getObserver(jid, loc)
+        if dt is None:
+            dt = self._getNoonDateTimeFrom6To6(zone)
+        next_rising, next_setting, riset, state = self._getNextRiseSetting(observer, body, dt, horizon='0.0')
+
+        values = {'symbol': unic_symb}
+        if with_phase:
+            values['phase'] = state['phase']
+        if with_mag:
+            values['mag'] = state['mag']
+        if with_constellation:
+            values['constellation'] = state['constellation']
 
         if riset == SkybberBot.RISET_OK:
-            if rising_first:
-                result = unic_symb + ' ' + SkybberBot.UNICODE_RISE + formatLocalTime(next_rising) + '  ' + SkybberBot.UNICODE_SET + formatLocalTime(next_setting)
-            else:
-                result = unic_symb + ' ' + SkybberBot.UNICODE_SET + formatLocalTime(next_setting) + '  ' + SkybberBot.UNICODE_RISE + formatLocalTime(next_rising)
+            values['rising'] = toLocalDateTime(next_rising, zone)
+            values['setting'] = toLocalDateTime(next_setting, zone)
         else:
-            result = self._fmtRiSetFailMsg(body, riset)
-        if with_constell_mag:
-            result += '  ' + str(body.mag) + 'm'
-            result += '  [ ' +  ephem.constellation(body)[1] + ' ]'
-        return result
+            values['message'] = self._fmtRiSetFailMsg(body, riset)
+        return Reply('body' if rising_first else 'sun', values, zone)
 
-    def _getNextRiseSetting(self, jid, body, loc=None, dt=None, horizon = '0.0'):
-        """ Return next rising/setting time for given body, horizont and date
+    def _getNextRiseSetting(self, observer, body, dt, horizon = '0.0'):
+        """ Return next rising/setting time for given body, horizont and date, and dict
+            of phase, mag, constellation and elong of body at the date
         """
-        observer = self._getObserver(jid, loc)
         observer.horizon = horizon
-
-        if dt == None:
-            dt = self._getNoonDateTimeFrom6To6()
-
         observer.date = ephem.Date(dt)
 
+        key = '%s %s %s %r' % (body.name, Site.cellOf(todegrees(observer.long), todegrees(observer.lat)),
+                               horizon, float(observer.date))
+        stored = self._ephemeris.get('riset', key)
+        # entries stored without state of body are computed again
+        if stored is not None and len(stored) == 4:
+            next_rising, next_setting, riset, state = stored
+            return (None if next_rising is None else ephem.Date(next_rising),
+                    None if next_setting is None else ephem.Date(next_setting), riset, state)
+
+        with commandStats.timing('ephem'):
+            # rise/set search recomputes body
+            body.compute(observer)
+            state = {'phase': body.phase, 'mag': body.mag, 'constellation': constellationName(body),
+                     'elong': math.degrees(body.elong)}
         try:
-            next_rising = observer.next_rising(body)
-            next_setting = observer.next_setting(body)
+            with commandStats.timing('ephem'):
+                next_rising = observer.next_rising(body)
+                next_setting = observer.next_setting(body)
             riset = SkybberBot.RISET_OK
         except ephem.NeverUpError:
             next_rising = None
@@ -638,76 +1502,35 @@ class SkybberBot(MUCJabberBot):
             next_setting = None
             riset = SkybberBot.NEVER_SETTING
 
-        return (next_rising, next_setting, riset)
+        self._ephemeris.put('riset', key, observer.date, [None if next_rising is None else float(next_rising),
+                                                          None if next_setting is None else float(next_setting), riset,
+                                                          state])
+        return (next_rising, next_setting, riset, state)
 
-    def _getNoonDateTimeFrom6To6(self):
-        """ Return noon of day beetween 06:00 of that day to next day 06:00
+    def _getNoon(self, date, zone):
+        """ Return UTC noon of date or of current day beetween 06:00 to next day 06:00 in zone
         """
-        date = datetime.date.today()
-        if datetime.datetime.now().hour < 6:
-            date -= datetime.timedelta(1)
+        if date is None:
+            return self._getNoonDateTimeFrom6To6(zone)
+        return self._getNoonDateTimeFrom6To6ByDate(date, zone)
 
-        dt = datetime.datetime.combine(datetime.date.today(), datetime.time(12,0))
-        dt = dt + datetime.timedelta(0, time.timezone)
+    def _getNoonDateTimeFrom6To6(self, zone=None):
+        """ Return UTC noon of day beetween 06:00 of that day to next day 06:00 in zone
+        """
+        now = localNow(zone)
+        date = now.date()
+        if now.hour < 6:
+            date -= datetime.timedelta(1)
 
-        return dt
+        return self._getNoonDateTimeFrom6To6ByDate(date, zone)
 
-    def _getNoonDateTimeFrom6To6ByDate(self, date):
-        """ Return noon of day beetween 06:00 of that day to next day 06:00
+    def _getNoonDateTimeFrom6To6ByDate(self, date, zone=None):
+        """ Return UTC noon of date in zone
         """
-        dt = datetime.datetime.combine(date, datetime.time(12,0))
-        dt = dt + datetime.timedelta(0, time.timezone)
-
-        return dt
+        return localToUtc(datetime.datetime.combine(date, datetime.time(12,0)), zone)
 
     def _parseJidLocTime(self, mess, args, parse_date = True):
-        jid = mess.getFrom().getStripped()
-
-        args = args.strip()
-
-        if args is None or len(args) == 0:
-            return (jid, None, None)
-
-        loc = None
-        dt = None
-        lng = None
-        lat = None
-        loc_name = None
-
-        pargs = self._arg_re.split(args.strip())
-
-        if pargs is not None:
-            for arg in pargs:
-                parsed_arg = TypeDetector(arg)
-                if parse_date and parsed_arg.getType() == TypeDetector.DATE:
-                    if dt is not None:
-                        raise CmdError('Invalid double date argument: ' + arg)
-                    dt = parsed_arg.getTypeValue()
-                elif parsed_arg.getType() == TypeDetector.LOCATION_LONG:
-                    if lng is not None:
-                        raise CmdError('Invalid double longitude argument: ' + arg)
-                    lng = parsed_arg.getTypeValue()
-                elif parsed_arg.getType() == TypeDetector.LOCATION_LAT:
-                    if lat is not None:
-                        raise CmdError('Invalid double latitude argument: ' + arg)
-                    lat = parsed_arg.getTypeValue()
-                elif parsed_arg.getType() == TypeDetector.STRING:
-                    if loc_name is not None:
-                        raise CmdError('Invalid double location name argument: ' + arg)
-                    loc_name = parsed_arg.getValue()
-                else:
-                    raise CmdError('Invalid argument: ' + arg)
-
-            if (lng is not None or lat is not None) and loc_name is not None:
-                raise CmdError('Invalid arguments. Please specify only one of longitude/latitude or location name.')
-            if lng is not None and lat is None:
-                raise CmdError('Invalid argument. Latitude missing.')
-            if lng is None and lat is not None:
-                raise CmdError('Invalid argument. Latitude missing.')
-            if lng is not None:
-                loc = Location(None, None, None, lng, lat)
-            elif loc_name is not None:
-                loc = Location(None, None, loc_name, None, None)
-
-        return (jid, loc, dt)
-
+        """ Return (jid, Location or None, date or None) of '[date] [location]' arguments
+        """
+        request = CommandRequest.parse(mess.getFrom().getStripped(), args, parse_date)
+        return (request.getJID(), request.getLocation(), request.getDate())
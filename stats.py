@@ -0,0 +1,243 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Per-command latency histograms and counters, per-room message counters
+
+Time of one command is split into parts: 'db', 'ephem' and 'http' are measured
+by timing() blocks inside the command, 'total' is the whole command.
+"""
+
+import bisect
+import os
+import threading
+import time
+
+
+class Histogram(object):
+    """ Fixed bucket latency histogram (seconds)
+    """
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._counts = [0] * (len(Histogram.BUCKETS) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(Histogram.BUCKETS, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def getCount(self):
+        return self._count
+
+    def getSum(self):
+        return self._sum
+
+    def getCumulativeCounts(self):
+        """ Return list of (upper bound, cumulative count), last bound is '+Inf'
+        """
+        result = []
+        total = 0
+        for bound, count in zip(Histogram.BUCKETS + ('+Inf',), self._counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def getQuantile(self, q):
+        """ Return upper bound of bucket containing quantile q
+        """
+        rank = q * self._count
+        for bound, total in self.getCumulativeCounts():
+            if total >= rank:
+                return bound
+        return '+Inf'
+
+
+class _Timing(object):
+    """ Context manager adding elapsed time to part of the current command
+    """
+    __slots__ = ('_parts', '_part', '_start')
+
+    def __init__(self, parts, part):
+        self._parts = parts
+        self._part = part
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, tb):
+        if self._parts is not None:
+            self._parts[self._part] = self._parts.get(self._part, 0.0) + time.perf_counter() - self._start
+
+
+class _CommandStat(object):
+
+    def __init__(self):
+        self.histograms = {}
+        self.errors = 0
+        self.cmd_errors = 0
+
+
+class CommandStats(object):
+    """ Collects per-command histograms of total/db/ephem/http time and error counters
+    """
+
+    PARTS = ('total', 'db', 'ephem', 'http')
+
+    OK = 'ok'
+    ERROR = 'error'
+    CMD_ERROR = 'cmd_error'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._commands = {}
+
+    def begin(self):
+        """ Start measuring command executed by current thread
+        """
+        self._local.parts = {}
+        self._local.start = time.perf_counter()
+
+    def end(self, cmd, outcome=OK):
+        """ Finish measuring of command executed by current thread
+        """
+        parts = getattr(self._local, 'parts', None)
+        if parts is None:
+            return
+        parts['total'] = time.perf_counter() - self._local.start
+        self._local.parts = None
+        with self._lock:
+            stat = self._commands.get(cmd)
+            if stat is None:
+                stat = self._commands[cmd] = _CommandStat()
+            for part, value in parts.items():
+                hist = stat.histograms.get(part)
+                if hist is None:
+                    hist = stat.histograms[part] = Histogram()
+                hist.observe(value)
+            if outcome == CommandStats.ERROR:
+                stat.errors += 1
+            elif outcome == CommandStats.CMD_ERROR:
+                stat.cmd_errors += 1
+
+    def getErrorCounts(self):
+        """ Return (errors, command errors) of all commands
+        """
+        with self._lock:
+            return (sum(stat.errors for stat in self._commands.values()),
+                    sum(stat.cmd_errors for stat in self._commands.values()))
+
+    def timing(self, part):
+        """ Return context manager measuring part ('db', 'ephem', 'http') of current command
+        """
+        return _Timing(getattr(self._local, 'parts', None), part)
+
+    def formatText(self):
+        """ Return human readable table of collected statistics
+        """
+        result = '\ncommand  count  err  cmderr  total ms  db ms  ephem ms  http ms  p95 ms\n'
+        with self._lock:
+            for cmd in sorted(self._commands):
+                stat = self._commands[cmd]
+                total = stat.histograms['total']
+                count = total.getCount()
+                means = []
+                for part in CommandStats.PARTS:
+                    hist = stat.histograms.get(part)
+                    means.append(0.0 if hist is None else 1000.0 * hist.getSum() / count)
+                p95 = total.getQuantile(0.95)
+                result += '%s  %d  %d  %d  %0.2f  %0.2f  %0.2f  %0.2f  %s\n' % (
+                    cmd, count, stat.errors, stat.cmd_errors, means[0], means[1], means[2], means[3],
+                    '>10000' if p95 == '+Inf' else '%g' % (1000.0 * p95))
+        return result
+
+    def formatPrometheus(self):
+        """ Return statistics in Prometheus text exposition format
+        """
+        lines = ['# HELP skybber_command_duration_seconds Time spent in bot commands by part.',
+                 '# TYPE skybber_command_duration_seconds histogram']
+        counters = ['# HELP skybber_command_errors_total Failed bot commands.',
+                    '# TYPE skybber_command_errors_total counter']
+        with self._lock:
+            for cmd in sorted(self._commands):
+                stat = self._commands[cmd]
+                for part in CommandStats.PARTS:
+                    hist = stat.histograms.get(part)
+                    if hist is None:
+                        continue
+                    labels = 'command="%s",part="%s"' % (cmd, part)
+                    for bound, total in hist.getCumulativeCounts():
+                        lines.append('skybber_command_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, total))
+                    lines.append('skybber_command_duration_seconds_sum{%s} %r' % (labels, hist.getSum()))
+                    lines.append('skybber_command_duration_seconds_count{%s} %d' % (labels, hist.getCount()))
+                counters.append('skybber_command_errors_total{command="%s",kind="error"} %d' % (cmd, stat.errors))
+                counters.append('skybber_command_errors_total{command="%s",kind="cmd_error"} %d' % (cmd, stat.cmd_errors))
+        return '\n'.join(lines + counters) + '\n'
+
+    def writePrometheus(self, path, extra=''):
+        """ Atomically write statistics in Prometheus text format and extra text to path
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.formatPrometheus())
+            f.write(extra)
+        os.replace(tmp_path, path)
+
+
+class RoomStats(object):
+    """ Counters of multi user chat messages dropped by command pre-filter and handled by bot, per room
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}
+
+    def count(self, room, handled):
+        counts = self._rooms.get(room)
+        if counts is None:
+            with self._lock:
+                counts = self._rooms.setdefault(room, [0, 0])
+        counts[handled] += 1
+
+    def getCounts(self):
+        """ Return dict of room: (filtered, handled)
+        """
+        with self._lock:
+            return dict((room, tuple(counts)) for room, counts in self._rooms.items())
+
+    def formatText(self):
+        result = '\nroom  filtered  handled\n'
+        for room, (filtered, handled) in sorted(self.getCounts().items()):
+            result += '%s  %d  %d\n' % (room, filtered, handled)
+        return result
+
+    def formatPrometheus(self):
+        lines = ['# HELP skybber_room_messages_total Multi user chat messages by outcome.',
+                 '# TYPE skybber_room_messages_total counter']
+        for room, (filtered, handled) in sorted(self.getCounts().items()):
+            lines.append('skybber_room_messages_total{room="%s",outcome="filtered"} %d' % (room, filtered))
+            lines.append('skybber_room_messages_total{room="%s",outcome="handled"} %d' % (room, handled))
+        return '\n'.join(lines) + '\n'
+
+
+commandStats = CommandStats()
+roomStats = RoomStats()
@@ -0,0 +1,17 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# modules use relative imports, the repository is imported as package of its directory name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+PACKAGE = os.path.basename(ROOT)
+
+
+@pytest.fixture
+def skybber():
+    """ Return function importing module of skybber package
+    """
+    return lambda name: importlib.import_module(PACKAGE + '.' + name)
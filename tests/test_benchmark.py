@@ -0,0 +1,9 @@
+def test_replay_without_error_replies(skybber):
+    benchmark = skybber('benchmark')
+    stats = skybber('stats')
+    workload = benchmark.generateWorkload(5, 60, seed=1)
+    errors = stats.commandStats.getErrorCounts()
+    elapsed, latencies, timeouts, queries = benchmark.runReplay(5, workload)
+    assert timeouts == 0
+    assert sum(len(values) for values in latencies.values()) == len(workload)
+    assert stats.commandStats.getErrorCounts() == errors
@@ -0,0 +1,39 @@
+import random
+import sqlite3
+
+
+def _checkPlans(migrations, path):
+    conn = sqlite3.connect(path)
+    try:
+        assert migrations.getVersion(conn) == migrations.getLatestVersion()
+        plans = migrations.explainQueries(conn)
+    finally:
+        conn.close()
+    assert len(plans) == len(migrations.HOT_QUERIES)
+    for name, plan, ok in plans:
+        assert ok, name + ': ' + plan
+        assert 'INDEX' in plan or 'PRIMARY KEY' in plan, name + ': ' + plan
+
+
+def test_hot_queries_use_indexes(skybber, tmp_path):
+    migrations = skybber('migrations')
+    path = str(tmp_path / 'skybber.db')
+    migrations.prepareDatabase(path)
+    _checkPlans(migrations, path)
+
+
+def test_hot_queries_use_indexes_with_statistics(skybber, tmp_path):
+    migrations = skybber('migrations')
+    benchmark = skybber('benchmark')
+    path = str(tmp_path / 'skybber.db')
+    benchmark.seedDatabase(path, 500)
+    # stored ephemerides are mostly inside the kept window of days
+    rnd = random.Random(1)
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO ephemeris(kind, key, day, value) VALUES (?, ?, ?, ?)',
+                     ((rnd.choice(('tw', 'riset')), 'key%d' % i, 46000.0 + rnd.uniform(-2.0, 34.0), '[]')
+                      for i in range(20000)))
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    _checkPlans(migrations, path)
@@ -0,0 +1,198 @@
+# coding: utf-8
+
+# SkybberBot: Astronomical jabber/xmpp bot
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Sunset and civil, nautical and astronomical twilight solver
+
+Position of the Sun is computed by ephem only at noon, midnight and next
+noon and interpolated by parabola. Dusk and dawn of every horizon are then
+solved from the hour angle of the interpolated position, so one night of an
+observer costs three ephem computations, two when consecutive nights are
+solved by iterTwilights. Twilights use geometric center of the Sun, sunset
+horizon includes refraction and semidiameter.
+"""
+
+import functools
+import math
+
+from .utils import lazyImport
+
+ephem = lazyImport('ephem')
+
+RISET_OK = 0
+NEVER_RISING = 1
+NEVER_SETTING = 2
+
+SUNSET, CIVIL, NAUTICAL, ASTRONOMICAL = range(4)
+
+# (name, horizon in degrees)
+HORIZONS = (('Sunset', -0.8333), ('Civil', -6.0), ('Nautical', -12.0), ('Astronomical', -18.0))
+
+SIDEREAL_RATE = 1.00273790935
+ITERATIONS = 3
+TWO_PI = 2.0 * math.pi
+
+
+class Twilight(object):
+    """ Dusk and dawn of the Sun crossing horizon
+    """
+
+    def __init__(self, name, horizon, dusk, dawn, riset):
+        self._name = name
+        self._horizon = horizon
+        self._dusk = dusk
+        self._dawn = dawn
+        self._riset = riset
+
+    def getName(self):
+        return self._name
+
+    def getHorizon(self):
+        """ Return horizon in degrees
+        """
+        return self._horizon
+
+    def getDusk(self):
+        """ Return ephem date of the Sun setting below horizon or None
+        """
+        return self._dusk
+
+    def getDawn(self):
+        """ Return ephem date of the Sun rising above horizon or None
+        """
+        return self._dawn
+
+    def getRiset(self):
+        """ Return RISET_OK, NEVER_RISING or NEVER_SETTING
+        """
+        return self._riset
+
+
+def _wrap(angle):
+    """ Return angle normalized to (-pi, pi]
+    """
+    angle = math.fmod(angle, TWO_PI)
+    if angle > math.pi:
+        angle -= TWO_PI
+    elif angle <= -math.pi:
+        angle += TWO_PI
+    return angle
+
+
+def _observer(lng, lat):
+    observer = ephem.Observer()
+    observer.long, observer.lat = lng, lat
+    observer.pressure = 0
+    return observer
+
+
+def _sample(observer, sun, date):
+    """ Return (ra, dec, local sidereal time) of the Sun at ephem date
+    """
+    observer.date = date
+    sun.compute(observer)
+    return float(sun.ra), float(sun.dec), float(observer.sidereal_time())
+
+
+def _solve(lat, noon, samples):
+    """ Return tuple of Twilight of HORIZONS from samples of the Sun at noon, midnight and next noon
+    """
+    ras, decs = [], []
+    for ra, dec, _ in samples:
+        if ras:
+            ra = ras[-1] + _wrap(ra - ras[-1])
+        ras.append(ra)
+        decs.append(dec)
+    lst_noon = samples[0][2]
+
+    def interpolate(values, x):
+        # parabola through values at x = 0, 0.5, 1
+        a, b, c = values
+        return a + x * (-3.0 * a + 4.0 * b - c) + x * x * (2.0 * a - 4.0 * b + 2.0 * c)
+
+    def hourAngle(x):
+        return lst_noon + TWO_PI * SIDEREAL_RATE * x - interpolate(ras, x)
+
+    sin_lat, cos_lat = math.sin(lat), math.cos(lat)
+
+    def solve(sin_h, sign, x):
+        """ Return day fraction after noon of hour angle sign * H0 of horizon, or riset failure
+        """
+        dec = interpolate(decs, x)
+        cos_h0 = (sin_h - sin_lat * math.sin(dec)) / (cos_lat * math.cos(dec))
+        if cos_h0 > 1.0:
+            return None, NEVER_RISING
+        if cos_h0 < -1.0:
+            return None, NEVER_SETTING
+        x = (sign * math.acos(cos_h0) - hourAngle(0.0)) % TWO_PI / TWO_PI
+        for _ in range(ITERATIONS):
+            dec = interpolate(decs, x)
+            cos_h0 = max(-1.0, min(1.0, (sin_h - sin_lat * math.sin(dec)) / (cos_lat * math.cos(dec))))
+            x += _wrap(sign * math.acos(cos_h0) - hourAngle(x)) / TWO_PI
+        return x, RISET_OK
+
+    result = []
+    for name, horizon in HORIZONS:
+        sin_h = math.sin(math.radians(horizon))
+        dusk, riset = solve(sin_h, 1.0, 0.5)
+        dawn, _ = solve(sin_h, -1.0, 0.5)
+        if riset == RISET_OK:
+            result.append(Twilight(name, horizon, ephem.Date(noon + dusk), ephem.Date(noon + dawn), riset))
+        else:
+            result.append(Twilight(name, horizon, None, None, riset))
+    return tuple(result)
+
+
+@functools.lru_cache(maxsize=4096)
+def solveTwilights(lng, lat, noon):
+    """ Return tuple of Twilight of HORIZONS of night following noon (ephem date),
+        longitude and latitude are in radians
+    """
+    observer = _observer(lng, lat)
+    sun = ephem.Sun()
+    return _solve(lat, noon, [_sample(observer, sun, noon + offset) for offset in (0.0, 0.5, 1.0)])
+
+
+def iterTwilights(lng, lat, noon, days):
+    """ Yield (noon, tuple of Twilight of HORIZONS) of nights of days following noon.
+        Next noon sample of the Sun is noon sample of next day, so a night costs
+        two ephem computations. Results are not cached, memory does not grow with days
+    """
+    observer = _observer(lng, lat)
+    sun = ephem.Sun()
+    noon = float(noon)
+    last = _sample(observer, sun, noon)
+    for day in range(days):
+        day_noon = noon + day
+        samples = (last, _sample(observer, sun, day_noon + 0.5), _sample(observer, sun, day_noon + 1.0))
+        yield ephem.Date(day_noon), _solve(lat, day_noon, samples)
+        last = samples[2]
+
+
+def toValues(twilights):
+    """ Return JSON serializable list of [dusk, dawn, riset] of twilights
+    """
+    return [[None if tw.getDusk() is None else float(tw.getDusk()),
+             None if tw.getDawn() is None else float(tw.getDawn()), tw.getRiset()] for tw in twilights]
+
+
+def fromValues(values):
+    """ Return tuple of Twilight of HORIZONS from result of toValues
+    """
+    return tuple(Twilight(name, horizon, None if dusk is None else ephem.Date(dusk),
+                          None if dawn is None else ephem.Date(dawn), riset)
+                 for (name, horizon), (dusk, dawn, riset) in zip(HORIZONS, values))
@@ -114,6 +114,44 @@ class TypeDetector(object):
     def getTypeValue(self):
         return self._typeValue
 
+    @staticmethod
+    def parseCoordinates(sval1, sval2):
+        """ Parse longitude and latitude given as numbers or in geographic format (in any order)
+
+        Return (lng, lat, error), error is None if values are valid
+        """
+        val1 = TypeDetector(sval1)
+        val2 = TypeDetector(sval2)
+
+        lng = None
+        lat = None
+
+        if val1.isNumber():
+            if val2.isNumber():
+                lng = float(val1.getTypeValue())
+                lat = float(val2.getTypeValue())
+            else:
+                return (None, None, 'Invalid argument: "' + sval2 + '".  Number is expected.')
+        elif val1.getType() == TypeDetector.LOCATION_LONG:
+            if val2.getType() == TypeDetector.LOCATION_LAT:
+                lng = val1.getTypeValue()
+                lat = val2.getTypeValue()
+            else:
+                return (None, None, 'Invalid argument: "' + sval2 + u'". Latitude expected. Example: 50°46\'1.655"N')
+        elif val1.getType() == TypeDetector.LOCATION_LAT:
+            if val2.getType() == TypeDetector.LOCATION_LONG:
+                lat = val1.getTypeValue()
+                lng = val2.getTypeValue()
+            else:
+                return (None, None, 'Invalid argument: "' + sval2 + u'". Longitude expected. Example: 15°3\'53.856"E')
+        else:
+            return (None, None, 'Invalid format of argument value: "' + sval1 + '". Use help for .')
+
+        if not -180.0 <= lng <= 180.0 or not -90.0 <= lat <= 90.0:
+            return (None, None, 'Coordinates out of range: ' + sval1 + ' ' + sval2)
+
+        return (lng, lat, None)
+
     def getRadAngle(self):
         if self._type in { TypeDetector.LOCATION_LONG, TypeDetector.LOCATION_LAT }:
             return math.pi * self.getTypeValue(self) / 180.0
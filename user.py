@@ -1,14 +1,23 @@
 from .location import Location
+from .site import Site
 
 class User(object):
     """ User class
     """
-    
-    def __init__(self, user_id, jid, profile_description, default_location_id):
+
+    SQL_BY_JID = 'SELECT user_id, jid, descr, default_location_id, time_zone FROM users WHERE jid=?'
+    SQL_LOCATION_BY_NAME = 'SELECT location_id, user_id, name, long, lat, site_id FROM locations WHERE user_id=? AND name=?'
+    SQL_LOCATION_LIST = 'SELECT location_id, user_id, name, long, lat, site_id FROM locations WHERE user_id=?'
+    SQL_LOCATION_LIST_BY_JID = 'SELECT u.user_id, u.jid, u.descr, u.default_location_id, u.time_zone, ' \
+                               'l.location_id, l.user_id, l.name, l.long, l.lat, l.site_id ' \
+                               'FROM users u LEFT JOIN locations l ON l.user_id=u.user_id WHERE u.jid=? ORDER BY l.location_id'
+
+    def __init__(self, user_id, jid, profile_description, default_location_id, time_zone=None):
         self._user_id = user_id
         self._jid = jid
         self._profile_description = profile_description
         self._default_location_id = default_location_id
+        self._time_zone = time_zone
     
     def getUserId(self):
         return self._user_id
@@ -21,14 +30,19 @@ class User(object):
     
     def getDefaultLocationId(self):
         return self._default_location_id
+
+    def getTimeZone(self):
+        """ Return name of user's time zone or None
+        """
+        return self._time_zone
     
     def getDefaultLocation(self, c):
         return Location.getLocationById(c, self.getDefaultLocationId())
     
     def getLocationByName(self, c, loc_name):
-        rs = c.execute('SELECT location_id, user_id, name, long, lat FROM locations WHERE user_id=? AND name=?', (self.getUserId(), loc_name)).fetchone()
+        rs = c.execute(User.SQL_LOCATION_BY_NAME, (self.getUserId(), loc_name)).fetchone()
         if rs is not None:
-            loc = rs is not None and Location(rs[0], rs[1], rs[2], rs[3], rs[4]) or None
+            loc = rs is not None and Location(rs[0], rs[1], rs[2], rs[3], rs[4], rs[5]) or None
         else:
             loc = None
         return loc
@@ -36,12 +50,16 @@ class User(object):
     def setDefaultLocation(self, c, location):
         c.execute('UPDATE users SET default_location_id=? WHERE user_id=?', (location.getLocationId(), self.getUserId(),))
 
+    def setTimeZone(self, c, time_zone):
+        c.execute('UPDATE users SET time_zone=? WHERE user_id=?', (time_zone, self.getUserId(),))
+        self._time_zone = time_zone
+
     def getUserLocationList(self, c, size = None):
-        rs = c.execute('SELECT location_id, user_id, name, long, lat FROM locations WHERE user_id=?', (self.getUserId(), ))
+        rs = c.execute(User.SQL_LOCATION_LIST, (self.getUserId(), ))
         result = ()
         if size is None or size > 0:
             for rsloc in rs:
-                loc = Location(rsloc[0], rsloc[1], rsloc[2], rsloc[3], rsloc[4])
+                loc = Location(rsloc[0], rsloc[1], rsloc[2], rsloc[3], rsloc[4], rsloc[5])
                 result += (loc, )
                 if size is not None and len(result) >= size:
                     break;
@@ -53,7 +71,8 @@ class User(object):
         return result
     
     def createLocation(self, c, loc_name, lng, lat):
-        c.execute('INSERT INTO locations(user_id, name, long, lat) VALUES (?,?,?,?)', (self.getUserId(), loc_name, lng, lat))
+        site = Site.getOrCreate(c, lng, lat)
+        c.execute('INSERT INTO locations(user_id, name, long, lat, site_id) VALUES (?,?,?,?,?)', (self.getUserId(), loc_name, lng, lat, site.getSiteId()))
         return self.getLocationByName(c, loc_name)
     
     def delete(self, c):
@@ -65,10 +84,24 @@ class User(object):
         c.execute('INSERT INTO users(jid, descr) VALUES ( ?, ? )', (strjid, 'description'))
         return User.getUserbyJID(c, strjid)
 
+    @staticmethod
+    def getUserLocationListByJID(c, strjid):
+        """ Return (user, locations) of user with jid loaded by one query, user is None if not registered
+        """
+        rs = c.execute(User.SQL_LOCATION_LIST_BY_JID, (strjid, ))
+        user = None
+        result = ()
+        for row in rs:
+            if user is None:
+                user = User(row[0], row[1], row[2], row[3], row[4])
+            if row[5] is not None:
+                result += (Location(row[5], row[6], row[7], row[8], row[9], row[10]), )
+        return (user, result)
+
     @staticmethod
     def getUserbyJID(c, strjid):
-        rs = c.execute('SELECT user_id, jid, descr, default_location_id FROM users WHERE jid=?', (strjid, )).fetchone()
+        rs = c.execute(User.SQL_BY_JID, (strjid, )).fetchone()
         user = None
         if rs is not None: 
-            user = User(rs[0], rs[1], rs[2], rs[3])
+            user = User(rs[0], rs[1], rs[2], rs[3], rs[4])
         return user
@@ -0,0 +1,76 @@
+from .location import Location
+from .user import User
+
+class UserContext(object):
+    """ User row, default location, first location and optionally named location
+        of one user loaded by single joined query
+    """
+
+    SQL_LOAD = 'SELECT u.user_id, u.jid, u.descr, u.default_location_id, u.time_zone, ' \
+               'd.location_id, d.user_id, d.name, d.long, d.lat, d.site_id, ' \
+               'f.location_id, f.user_id, f.name, f.long, f.lat, f.site_id, ' \
+               'n.location_id, n.user_id, n.name, n.long, n.lat, n.site_id ' \
+               'FROM users u ' \
+               'LEFT JOIN locations d ON d.location_id=u.default_location_id ' \
+               'LEFT JOIN locations f ON f.location_id=(SELECT MIN(location_id) FROM locations WHERE user_id=u.user_id) ' \
+               'LEFT JOIN locations n ON n.user_id=u.user_id AND n.name=? ' \
+               'WHERE u.jid=?'
+
+    def __init__(self, jid, loc_name, user, default_location, first_location, named_location):
+        self._jid = jid
+        self._loc_name = loc_name
+        self._user = user
+        self._default_location = default_location
+        self._first_location = first_location
+        self._named_location = named_location
+
+    def getJID(self):
+        return self._jid
+
+    def getLocName(self):
+        """ Return name of location requested when context was loaded
+        """
+        return self._loc_name
+
+    def getUser(self):
+        """ Return registered user or None
+        """
+        return self._user
+
+    def getRoles(self):
+        """ Return set of user's roles
+        """
+        return {'registered'} if self._user is not None else set()
+
+    def getDefaultLocation(self):
+        return self._default_location
+
+    def getNamedLocation(self):
+        """ Return location named by loc_name or None
+        """
+        return self._named_location
+
+    def getObserverLocation(self):
+        """ Return location of observer
+
+        1. location named by loc_name if it was requested
+        2. user default location
+        3. first user location
+        """
+        if self._loc_name is not None:
+            return self._named_location
+        if self._default_location is not None:
+            return self._default_location
+        return self._first_location
+
+    @staticmethod
+    def _location(rs, i):
+        return Location(rs[i], rs[i + 1], rs[i + 2], rs[i + 3], rs[i + 4], rs[i + 5]) if rs[i] is not None else None
+
+    @staticmethod
+    def load(c, strjid, loc_name=None):
+        rs = c.execute(UserContext.SQL_LOAD, (loc_name, strjid)).fetchone()
+        if rs is None:
+            return UserContext(strjid, loc_name, None, None, None, None)
+        return UserContext(strjid, loc_name, User(rs[0], rs[1], rs[2], rs[3], rs[4]),
+                           UserContext._location(rs, 5), UserContext._location(rs, 11), UserContext._location(rs, 17))
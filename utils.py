@@ -1,7 +1,58 @@
+import os
 import re
-import ephem
+import sys
 import datetime
 import math
+import importlib.util
+import functools
+import threading
+import types
+
+# lock of each lazy module is held while the module executes
+_lazy_locks = {}
+_lazy_loading = set()
+
+class _LazyModule(types.ModuleType):
+    """ Module executed on first attribute access, one thread executes it
+    """
+    def __getattribute__(self, attr):
+        name = types.ModuleType.__getattribute__(self, '__name__')
+        lock = _lazy_locks.get(name)
+        if lock is not None:
+            with lock:
+                # others wait for the load, the loading thread sees partial module
+                if type(self) is _LazyModule and name not in _lazy_loading:
+                    _lazy_loading.add(name)
+                    try:
+                        spec = types.ModuleType.__getattribute__(self, '__spec__')
+                        spec.loader.exec_module(self)
+                        self.__class__ = types.ModuleType
+                        del _lazy_locks[name]
+                    finally:
+                        _lazy_loading.discard(name)
+        return types.ModuleType.__getattribute__(self, attr)
+
+def lazyImport(name):
+    """ Return module which is really loaded on first attribute access,
+        raise ModuleNotFoundError if module does not exist
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            raise ModuleNotFoundError('No module named %r' % name, name=name)
+        module = importlib.util.module_from_spec(spec)
+        _lazy_locks.setdefault(name, threading.RLock())
+        module.__class__ = _LazyModule
+        sys.modules[name] = module
+        # submodule is attribute of package as after regular import
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, module)
+    return module
+
+ephem = lazyImport('ephem')
+zoneinfo = lazyImport('zoneinfo')
 
 def xmlNodeValue(parent_node, node_name):
     node = parent_node.find(node_name)
@@ -14,22 +65,110 @@ def parseIsoDateTime(sdate):
 def parseXmppDateTime(sdate):
     return parseIsoDateTime(sdate[0:4] + '-' + sdate[4:6] + '-' + sdate[6:])
 
-def formatLocalDateTime(dt):
-    return '' if dt is None else ephem.localtime(dt).strftime('%Y-%m-%d %H:%M:%S')
+@functools.lru_cache(maxsize=None)
+def getZone(zone_name):
+    """ Return tzinfo of IANA zone name, raise KeyError if zone does not exist
+    """
+    try:
+        return zoneinfo.ZoneInfo(zone_name)
+    except (ValueError, zoneinfo.ZoneInfoNotFoundError):
+        raise KeyError(zone_name)
+
+def isValidZone(zone_name):
+    try:
+        getZone(zone_name)
+        return True
+    except KeyError:
+        return False
+
+def _utcOffset(zone, day_start, seconds):
+    return (day_start + datetime.timedelta(seconds=seconds)).astimezone(zone).utcoffset()
+
+@functools.lru_cache(maxsize=4096)
+def _dayOffsets(zone_name, day):
+    """ Return tuple of (seconds from UTC midnight, utc offset) segments of UTC day (ordinal) in zone.
 
-def formatLocalTime(ephmdt):
-    return ephem.localtime(ephmdt).strftime('%H:%M:%S')
+    Day has one segment unless offset of the zone changes during the day, changes are
+    found by bisection to the second.
+    """
+    zone = getZone(zone_name)
+    day_start = datetime.datetime.fromordinal(day).replace(tzinfo=datetime.timezone.utc)
+    segments = [(0, _utcOffset(zone, day_start, 0))]
 
-def formatLocalDate(ephmdt):
-    return ephem.localtime(ephmdt).strftime('%Y-%m-%d')
+    def split(lo, lo_offset, hi, hi_offset):
+        if lo_offset == hi_offset:
+            return
+        if hi - lo <= 1:
+            segments.append((hi, hi_offset))
+            return
+        mid = (lo + hi) // 2
+        mid_offset = _utcOffset(zone, day_start, mid)
+        split(lo, lo_offset, mid, mid_offset)
+        split(mid, mid_offset, hi, hi_offset)
 
-def formatLocalDateDDMM(ephmdt):
-    return ephem.localtime(ephmdt).strftime('%d/%m')
+    split(0, segments[0][1], 86399, _utcOffset(zone, day_start, 86399))
+    return tuple(segments)
+
+def toLocalDateTime(ephmdt, zone_name=None):
+    """ Return naive local datetime of ephem date in zone, server zone is used if zone_name is None
+    """
+    if zone_name is None:
+        return ephem.localtime(ephmdt)
+    utc = ephem.Date(ephmdt).datetime()
+    seconds = utc.hour * 3600 + utc.minute * 60 + utc.second
+    offset = None
+    for start, segment_offset in _dayOffsets(zone_name, utc.toordinal()):
+        if start > seconds:
+            break
+        offset = segment_offset
+    return utc + offset
+
+def localToUtc(dt, zone_name=None):
+    """ Return naive UTC datetime of naive local datetime in zone, server zone is used if zone_name is None
+    """
+    zone = getZone(zone_name) if zone_name is not None else None
+    if zone is None:
+        return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt.replace(tzinfo=zone).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def toUnixTime(ephmdt):
+    """ Return unix time of ephem date (UTC)
+    """
+    return (float(ephmdt) - 25567.5) * 86400.0
+
+def localNow(zone_name=None):
+    """ Return naive current local datetime in zone
+    """
+    if zone_name is None:
+        return datetime.datetime.now()
+    return datetime.datetime.now(getZone(zone_name)).replace(tzinfo=None)
+
+def formatLocalDateTime(dt, zone_name=None):
+    return '' if dt is None else toLocalDateTime(dt, zone_name).strftime('%Y-%m-%d %H:%M:%S')
+
+def formatLocalTime(ephmdt, zone_name=None):
+    return toLocalDateTime(ephmdt, zone_name).strftime('%H:%M:%S')
+
+def formatLocalDate(ephmdt, zone_name=None):
+    return toLocalDateTime(ephmdt, zone_name).strftime('%Y-%m-%d')
+
+def formatLocalDateDDMM(ephmdt, zone_name=None):
+    return toLocalDateTime(ephmdt, zone_name).strftime('%d/%m')
+
+def constellationName(position, epoch=None):
+    """ Return name of constellation of computed body or of (ra, dec) position of epoch
+    """
+    if epoch is None:
+        return ephem.constellation(position)[1]
+    return ephem.constellation(position, epoch)[1]
 
 def formatSign(s):
     return float(s) < 0 and str(s) or (' ' + str(s)) 
 
+@functools.lru_cache(maxsize=1024)
 def magMeter(sm, max_mag, min_mag, step):
+    if sm is None or sm == '':
+        return ''
     mag = float(sm)
     mag = (mag > min_mag and min_mag) or (mag < max_mag and max_mag) or mag
     koef = 1.0 / step
@@ -51,6 +190,16 @@ def parseArgs(args):
                 result[a] = ''
     return result 
 
+def cachePath(path):
+    """ Return path of generated file if its directory is writable, otherwise path
+        of the file in user cache directory, which is created
+    """
+    if os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+        return path
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'skybber')
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, os.path.basename(path))
+
 def todegrees(angle_rad):
     return angle_rad / math.pi * 180.0
 